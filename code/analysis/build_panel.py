@@ -0,0 +1,28 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+from data_utils import *
+from profile_utils import enable_profiling, write_run_report
+
+# parse command line options
+parser = argparse.ArgumentParser(description='Build the county-by-year panel for the years listed under panel_years in data.yaml.')
+parser.add_argument('--jobs', type=int, default=None, help='number of worker processes')
+parser.add_argument('--no-cache', action='store_true', help='rebuild every year from the raw files')
+parser.add_argument('--csv', action='store_true', help='also write a .csv copy of the panel')
+parser.add_argument('--report', action='store_true', help='write a timing and memory report for each stage to results/logs/')
+parser.add_argument('--profile', action='store_true', help='with --report, also write a cProfile dump of the slowest stage')
+args = parser.parse_args()
+
+if args.profile:
+    enable_profiling()
+
+# build each year and write the panel to data/clean/dat_panel.feather
+panel = build_panel(n_workers=args.jobs, use_cache=not args.no_cache, write_csv=args.csv)
+
+print(panel.groupby('year').size().to_string())
+
+# write the timing and memory of each stage
+if args.report:
+    write_run_report(project_path('results/logs/build_panel'))
@@ -1,14 +1,28 @@
+import argparse
 import numpy as np
 import os
 import pandas as pd
 import sys
 import yaml
 
-# set working directory to file location
-set_working_dir()
-
-sys.path.insert(1, '../utils')
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
 from data_utils import *
+from profile_utils import enable_profiling, write_run_report
+
+# parse command line options
+parser = argparse.ArgumentParser(description='Clean and merge raw data files for analysis.')
+parser.add_argument('--no-cache', action='store_true', help='re-read every raw input instead of using the cache in data/cache/')
+parser.add_argument('--csv', action='store_true', help='also write .csv copies of the clean data files')
+parser.add_argument('--report', action='store_true', help='write a timing and memory report for each stage to results/logs/')
+parser.add_argument('--profile', action='store_true', help='with --report, also write a cProfile dump of the slowest stage')
+args = parser.parse_args()
+
+if args.profile:
+    enable_profiling()
 
 # clean and merge datasets
-clean_data()
+clean_data(use_cache=not args.no_cache, write_csv=args.csv)
+
+# write the timing and memory of each stage
+if args.report:
+    write_run_report(project_path('results/logs/clean_data'))
@@ -0,0 +1,26 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+from data_utils import *
+from plot_utils import render_maps
+
+# parse command line options
+parser = argparse.ArgumentParser(description='Draw county maps for the variables listed under map_variables in data.yaml.')
+parser.add_argument('variables', nargs='*', help='variables to map (default: all of map_variables)')
+parser.add_argument('--jobs', type=int, default=None, help='number of worker processes')
+parser.add_argument('--formats', nargs='+', default=['png', 'pdf'], help='file formats to write')
+args = parser.parse_args()
+
+out = load_config()
+variables = args.variables or list(out['map_variables'])
+
+# check the mapped variables against the clean data before drawing anything
+out.check_columns('maps', clean_data_columns(), extra=variables)
+
+# draw every map to results/figures/maps/map_<variable>.<format>
+paths = render_maps(load_clean_data(columns=['county'] + variables), out, variables=variables, 
+                    formats=args.formats, n_workers=args.jobs)
+
+print(str(len(paths)) + ' maps written')
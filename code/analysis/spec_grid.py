@@ -0,0 +1,26 @@
+import argparse
+import os
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+from data_utils import *
+from profile_utils import enable_profiling, write_run_report
+
+# parse command line options
+parser = argparse.ArgumentParser(description='Fit the robustness specification grid defined by the grid_* keys of data.yaml.')
+parser.add_argument('--jobs', type=int, default=None, help='number of worker processes')
+parser.add_argument('--report', action='store_true', help='write a timing and memory report for each stage to results/logs/')
+parser.add_argument('--profile', action='store_true', help='with --report, also write a cProfile dump of the slowest stage')
+args = parser.parse_args()
+
+if args.profile:
+    enable_profiling()
+
+# fit every specification and write the coefficients to results/tables/spec_grid.feather
+results = run_spec_grid(n_workers=args.jobs)
+
+print(str(results.groupby(['sample', 'outcome', 'instruments', 'controls']).ngroups) + ' specifications fit')
+
+# write the timing and memory of each stage
+if args.report:
+    write_run_report(project_path('results/logs/spec_grid'))
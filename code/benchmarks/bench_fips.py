@@ -0,0 +1,61 @@
+import os
+import pandas as pd
+import sys
+import timeit
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+from data_utils import *
+
+def get_cfips_loop(df):
+
+    '''
+    list-comprehension implementation of get_cfips, kept for comparison
+    '''
+
+    df.STATEFIPS =[x.zfill(2) for x in df.STATEFIPS.astype(str)]
+    df.COUNTYFIPS = [x.zfill(3) for x in df.COUNTYFIPS.astype(str)]
+    df['county'] = [x + y for x, y in zip(df.STATEFIPS.astype(str), df.COUNTYFIPS.astype(str))]
+    df.county = df.county.astype(int)
+
+    return df
+
+def parse_geo_fips_loop(geography):
+
+    '''
+    list-comprehension implementation of parse_geo_fips, kept for comparison
+    '''
+
+    return pd.Series([x[-5:] for x in geography]).astype(int)
+
+def time_pair(label, old, new, repeat=5):
+
+    '''
+    times the old and new implementations, checks that they agree, and prints the speedup
+    '''
+
+    pd.testing.assert_series_equal(old().reset_index(drop=True), new().reset_index(drop=True), check_names=False)
+
+    t_old = min(timeit.repeat(old, number=1, repeat=repeat))
+    t_new = min(timeit.repeat(new, number=1, repeat=repeat))
+
+    print(label + ': ' + str(round(t_old * 1000, 2)) + ' ms -> ' + str(round(t_new * 1000, 2)) + ' ms (' + str(round(t_old / t_new, 1)) + 'x)')
+
+    return None
+
+### county FIPS codes on the full SOI county files
+for file_name in ['21incyallagi.csv', '17incyallagi.csv', '21incyallnoagi.csv', '17incyallnoagi.csv']:
+
+    soi = pd.read_csv(project_path('data/raw/SOI', file_name), encoding='latin-1', usecols=['STATEFIPS', 'COUNTYFIPS'])
+
+    time_pair('get_cfips, ' + file_name + ' (' + str(soi.shape[0]) + ' rows)',
+              lambda: get_cfips_loop(soi.copy()).county,
+              lambda: get_cfips(soi.copy()).county)
+
+### county FIPS codes from Census geography identifiers
+for file_name in ['census_5yr_acs_2021.csv', 'census_econ_2021.csv', 'census_educ_2021.csv', 'census_marriage_2021.csv']:
+
+    acs = pd.read_csv(project_path('data/raw/census', file_name), skiprows=[0], usecols=['Geography'])
+
+    time_pair('parse_geo_fips, ' + file_name + ' (' + str(acs.shape[0]) + ' rows)',
+              lambda: parse_geo_fips_loop(acs.Geography),
+              lambda: parse_geo_fips(acs.Geography))
@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+UTILS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils')
+
+# libraries that take a second or more to import and are only needed by some stages
+HEAVY = ['linearmodels', 'statsmodels', 'scipy.stats', 'scipy.sparse', 'scipy.linalg', 'geopandas', 'seaborn', 'mapclassify']
+
+# import budgets, in seconds on top of importing numpy and pandas. no module may load a
+# heavy library at import
+BUDGETS = {'path_utils': 0.2,
+           'config_utils': 0.2,
+           'cache_utils': 0.2,
+           'profile_utils': 0.2,
+           'table_utils': 0.2,
+           'iv_utils': 0.2,
+           'data_utils': 0.3,
+           'pipeline': 0.3,
+           'taxprep': 0.3,
+           'plot_utils': 0.8}
+
+def time_import(module, repeat=3):
+
+    '''
+    imports module in fresh interpreters and returns the fastest import time in seconds,
+    along with the heavy libraries the import loaded
+    '''
+
+    code = ('import sys, time; sys.path.insert(1, ' + repr(UTILS_DIR) + '); start = time.perf_counter(); import ' + module + '; '
+            'print(json.dumps([time.perf_counter() - start, [x for x in ' + repr(HEAVY) + ' if x in sys.modules]]))')
+
+    times = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, '-c', 'import json; ' + code], cwd=UTILS_DIR, capture_output=True, text=True, check=True)
+        seconds, loaded = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(seconds)
+
+    return min(times), loaded
+
+parser = argparse.ArgumentParser(description='Check the import time of each utils module against its budget, and that no module loads heavy libraries at import.')
+parser.add_argument('modules', nargs='*', default=list(BUDGETS), help='modules to check (default: all)')
+parser.add_argument('--repeat', type=int, default=3, help='number of fresh imports of each module; the fastest is kept (default: 3)')
+parser.add_argument('--scale', type=float, default=1, help='multiplies every budget, e.g. 2 on a slow machine (default: 1)')
+args = parser.parse_args()
+
+# numpy and pandas are needed by every stage, so budgets are measured on top of them
+base, _ = time_import('numpy, pandas', repeat=args.repeat)
+print('numpy, pandas'.ljust(16) + str(round(base * 1000)).rjust(8) + ' ms')
+
+failures = []
+for module in args.modules:
+
+    seconds, loaded = time_import(module, repeat=args.repeat)
+    budget = BUDGETS[module] * args.scale
+
+    problems = []
+    if seconds - base > budget:
+        problems.append('over budget of +' + str(round(budget * 1000)) + ' ms')
+    if loaded:
+        problems.append('loads ' + ', '.join(loaded))
+
+    print(module.ljust(16) + str(round(seconds * 1000)).rjust(8) + ' ms' + ('  <- ' + '; '.join(problems) if problems else ''))
+
+    if problems:
+        failures.append(module)
+
+if failures:
+    print(str(len(failures)) + ' module(s) failed the import check: ' + ', '.join(failures))
+    sys.exit(1)
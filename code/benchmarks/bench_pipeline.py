@@ -0,0 +1,143 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+from data_utils import *
+from fixtures import make_fixtures
+from plot_utils import GEOMETRY_PATH
+
+parser = argparse.ArgumentParser(description='Time every loader, merge and regression on synthetic inputs, and compare against a saved baseline.')
+parser.add_argument('--scale', type=float, default=1, help='size of the synthetic inputs relative to the real ones, e.g. 1, 10 or 100 (default: 1)')
+parser.add_argument('--root', default=None, help='fixture directory (default: data/synthetic/scale_<scale>), written if missing')
+parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each benchmark; the fastest is kept (default: 3)')
+parser.add_argument('--jobs', type=int, default=None, help='number of worker processes for pooled stages (default: n_workers in data.yaml)')
+parser.add_argument('--only', nargs='+', default=None, metavar='NAME', help='run only these benchmarks')
+parser.add_argument('--save', default=None, metavar='PATH', help='write the timings to a .json file')
+parser.add_argument('--compare', default=None, metavar='PATH', help='compare against timings saved with --save, and exit with status 1 on a slowdown')
+parser.add_argument('--tolerance', type=float, default=1.25, help='slowdown ratio counted as a regression with --compare (default: 1.25)')
+args = parser.parse_args()
+
+root = os.path.abspath(args.root or project_path('data/synthetic/scale_' + format(args.scale, 'g')))
+
+# trees written before the county shapefile and EITC schedule were added are rewritten too
+if not all(os.path.exists(os.path.join(root, path)) for path in ['code/config/data.yaml', GEOMETRY_PATH, 'data/clean/eitc_fig_data.csv']):
+    print('writing fixtures to ' + root)
+    make_fixtures(root, scale=args.scale)
+
+# resolve every data path, and the config file, inside the fixtures
+set_project(root=root)
+
+out = load_config()
+n_workers = out['n_workers'] if args.jobs is None else args.jobs
+years = ['2017', '2021']
+
+def quiet(func):
+
+    '''
+    wraps func so that its progress messages are not printed
+    '''
+
+    def wrapper():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func()
+
+    return wrapper
+
+def uncached(func):
+
+    '''
+    wraps func so that the in-memory crosswalk matrices are rebuilt on every run
+    '''
+
+    def wrapper():
+        get_xwalk_matrix.cache_clear()
+        return func()
+
+    return wrapper
+
+### inputs the later benchmarks start from, built once outside the timings
+with contextlib.redirect_stdout(io.StringIO()):
+    frames = get_paid_prep_counts(out['states'], years=years, n_workers=n_workers, use_cache=False)
+    zip_counts = build_zip_counts(frames['2021'], year='2021')
+    dat_dict = county_prep_counts(years=years, states=out['states'], n_workers=n_workers, xwalk_weight=out['xwalk_weight'], use_cache=False)
+    counties = pd.merge(dat_dict['2021'], dat_dict['2017'], how='left', on='county', validate='1:1')
+    metro = merge_metro(counties, use_cache=False)
+    demog = merge_demog(metro, use_cache=False)
+    clean_data(use_cache=False)
+
+df = load_clean_data()
+df['const'] = 1
+outcomes = ['share_eip', 'mean_eip', 'share_ctc_dif', 'mean_ctc_dif', 'share_eitc_dif', 'mean_eitc_dif']
+regs = df.dropna(subset=['share_using_pp', 'share_using_pp_17'] + out['fs_X_3'] + outcomes)
+
+### benchmarks, grouped into loaders, transforms and merges, and analysis
+benchmarks = {
+    'get_paid_prep_counts': lambda: get_paid_prep_counts(out['states'], years=years, n_workers=n_workers, use_cache=False),
+    'read_xwalk_weights': lambda: read_xwalk_weights(year='2021', weight=out['xwalk_weight'], use_cache=False),
+    'read_metro': lambda: read_metro(use_cache=False),
+    'read_demog': lambda: read_demog(use_cache=False),
+    'read_soi': lambda: read_soi(file_name='21incyallnoagi.csv', use_cache=False),
+    'stream_soi': lambda: stream_soi(file_name='21incyallagi.csv', columns=['N1', 'PREP', 'N59660'], use_cache=False),
+    'load_clean_data': lambda: load_clean_data(),
+
+    'build_zip_counts': lambda: build_zip_counts(frames['2021'], year='2021'),
+    'zip_to_county': uncached(lambda: zip_to_county(zip_counts, year='2021', weight=out['xwalk_weight'], use_cache=False)),
+    'merge_metro': lambda: merge_metro(counties, use_cache=False),
+    'merge_demog': lambda: merge_demog(metro, use_cache=False),
+    'merge_soi': lambda: merge_soi(demog, use_cache=False),
+    'clean_data': uncached(lambda: clean_data(use_cache=False)),
+
+    'summarize': lambda: summarize(df, out['summ_stats'], years=out['summ_stats_years']),
+    'nested_ols': lambda: nested_ols(regs[out['fs_y']], [add_constant(regs[out['fs_X_' + i]]) for i in ['1', '2', '3']]),
+    'iv2sls_multi': lambda: iv2sls_multi(regs[outcomes], regs[out['spec_3_controls']], regs[out['spec_3_endog']], regs[out['spec_3_inst']]),
+    'make_2sls_tables': lambda: make_2sls_tables(regs, outcomes=outcomes),
+    'resample': lambda: resample(regs['share_eip'], regs[out['spec_3_controls']], regs[out['spec_3_endog']], regs[out['spec_3_inst']],
+                                 method='wild', clusters=regs['STATEFIPS'], reps=999, n_workers=n_workers),
+    'spec_grid': lambda: run_spec_grid(n_workers=n_workers),
+}
+
+names = list(benchmarks) if args.only is None else args.only
+unknown = [name for name in names if name not in benchmarks]
+if unknown:
+    parser.error('unknown benchmark(s): ' + ', '.join(unknown))
+
+print('scale ' + format(args.scale, 'g') + ': ' + str(len(df)) + ' counties, ' + str(len(zip_counts)) + ' zipcodes with preparers in 2021')
+
+timings = {}
+for name in names:
+    timings[name] = min(timeit.repeat(quiet(benchmarks[name]), number=1, repeat=args.repeat))
+    print(name.ljust(24) + str(round(timings[name] * 1000, 1)).rjust(12) + ' ms')
+
+if args.save is not None:
+    os.makedirs(os.path.dirname(args.save) or '.', exist_ok=True)
+    with open(args.save, 'w') as stream:
+        json.dump({'scale': args.scale, 'repeat': args.repeat, 'n_workers': n_workers, 'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+                   'timings': timings}, stream, indent=2)
+
+### regressions against a saved baseline
+if args.compare is not None:
+
+    with open(args.compare, 'r') as stream:
+        baseline = json.load(stream)
+
+    if baseline['scale'] != args.scale:
+        print('warning: baseline was timed at scale ' + format(baseline['scale'], 'g'))
+
+    slower = []
+    for name in names:
+        if name in baseline['timings']:
+            ratio = timings[name] / baseline['timings'][name]
+            flag = '  <- slower' if ratio > args.tolerance else ''
+            print(name.ljust(24) + str(round(ratio, 2)).rjust(8) + 'x baseline' + flag)
+            if flag:
+                slower.append(name)
+
+    if slower:
+        print(str(len(slower)) + ' benchmark(s) more than ' + str(args.tolerance) + 'x slower than ' + args.compare + ': ' + ', '.join(slower))
+        sys.exit(1)
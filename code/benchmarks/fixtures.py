@@ -0,0 +1,378 @@
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+from data_utils import *
+from plot_utils import GEOMETRY_PATH
+
+# two-digit FIPS codes of the states in the preparer listings
+STATE_FIPS = {'al': 1, 'ak': 2, 'az': 4, 'ar': 5, 'ca': 6, 'co': 8, 'ct': 9, 'de': 10, 'dc': 11, 'fl': 12,
+              'ga': 13, 'hi': 15, 'id': 16, 'il': 17, 'in': 18, 'ia': 19, 'ks': 20, 'ky': 21, 'la': 22, 'me': 23,
+              'md': 24, 'ma': 25, 'mi': 26, 'mn': 27, 'ms': 28, 'mo': 29, 'mt': 30, 'ne': 31, 'nv': 32, 'nh': 33,
+              'nj': 34, 'nm': 35, 'ny': 36, 'nc': 37, 'nd': 38, 'oh': 39, 'ok': 40, 'or': 41, 'pa': 42, 'ri': 44,
+              'sc': 45, 'sd': 46, 'tn': 47, 'tx': 48, 'ut': 49, 'vt': 50, 'va': 51, 'wa': 53, 'wv': 54, 'wi': 55,
+              'wy': 56}
+
+# sizes of the real inputs, which scale 1 reproduces
+BASE_COUNTIES = 3143
+BASE_ZIPS = 41000
+BASE_PREPARERS = 600000
+
+# column names of the preparer listings (see get_paid_prep_count)
+PREP_COLUMNS = ['name', 'addr1', 'addr2', 'city', 'state', 'zip', 'zip4', 'fname', 'mi', 'lname', 'phone', 'bk1', 'bk2', 'bk3', 'bk4']
+
+# EITC schedule parameters by tax year and number of children: phase-in rate, maximum credit,
+# phase-out start and phase-out rate for single filers
+EITC_PARAMETERS = {'17': {'nc': (0.0765, 510, 8340, 0.0765), 'oc': (0.34, 3400, 18340, 0.1598),
+                          'tc': (0.40, 5616, 18340, 0.2106), 'thc': (0.45, 6318, 18340, 0.2106)},
+                   '21': {'nc': (0.153, 1502, 11610, 0.153), 'oc': (0.34, 3618, 19520, 0.1598),
+                          'tc': (0.40, 5980, 19520, 0.2106), 'thc': (0.45, 6728, 19520, 0.2106)}}
+
+AGE_GROUPS = ['20 to 24 years', '25 to 34 years', '35 to 44 years', '45 to 54 years', '55 to 59 years', '60 to 64 years',
+              '65 to 74 years', '75 to 84 years', '85 years and over']
+
+def make_geography(scale=1, seed=0):
+
+    '''
+    Draws the counties and zipcodes of a synthetic country. Counties and zipcodes are
+    scaled from the real counts, but identifiers are five-digit codes, so states are capped
+    at 999 counties and the country at 99,999 zipcodes; past those caps only the listing
+    sizes keep growing with scale.
+
+    inputs:
+        scale: size relative to the real inputs, e.g. 1, 10 or 100
+        seed: random seed
+    outputs:
+        counties: dataframe with one row per county: 'STATEFIPS', 'COUNTYFIPS', 'county',
+        'state' and the latent county characteristics used by the other generators
+        xwalk: dataframe with one row per zipcode-county pair: 'ZIP', 'COUNTY' and 'state'
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    states = list(STATE_FIPS)
+    weights = rng.lognormal(0, 0.8, len(states))
+    sizes = np.clip(np.round(BASE_COUNTIES * scale * weights / weights.sum()), 1, 999).astype(int)
+
+    # real county codes are odd numbers
+    codes = np.array(list(range(1, 1000, 2)) + list(range(2, 1000, 2)))
+    counties = pd.DataFrame({'state': np.repeat(states, sizes),
+                             'STATEFIPS': np.repeat([STATE_FIPS[state] for state in states], sizes),
+                             'COUNTYFIPS': np.concatenate([np.sort(codes[:size]) for size in sizes])})
+    counties['county'] = counties.STATEFIPS * 1000 + counties.COUNTYFIPS
+
+    n = len(counties)
+    counties['returns'] = np.maximum(np.round(rng.lognormal(9.3, 1.3, n)), 50).astype(np.int64)
+    counties['tot_pop'] = np.round(counties.returns * rng.uniform(1.8, 2.3, n)).astype(np.int64)
+    counties['p_prep'] = rng.beta(6, 6, n)
+    counties['p_black'] = rng.beta(0.6, 4, n)
+    counties['p_hisp'] = rng.beta(0.6, 4, n)
+
+    # zipcodes, numbered in order of county, each in one county and a fifth also in a neighbour
+    n_zips = int(min(BASE_ZIPS * scale, 99999 - 1000))
+    owners = np.sort(rng.choice(n, n_zips - n, replace=True, p=counties.returns / counties.returns.sum()))
+    owners = np.sort(np.concatenate([np.arange(n), owners]))
+    zips = 1001 + np.arange(n_zips)
+
+    second = rng.uniform(size=n_zips) < 0.2
+    neighbours = np.minimum(owners[second] + 1, n - 1)
+    same_state = counties.state.to_numpy()[neighbours] == counties.state.to_numpy()[owners[second]]
+
+    xwalk = pd.DataFrame({'ZIP': np.concatenate([zips, zips[second][same_state]]),
+                          'row': np.concatenate([owners, neighbours[same_state]])})
+    xwalk['COUNTY'] = counties.county.to_numpy()[xwalk.row]
+    xwalk['state'] = counties.state.to_numpy()[xwalk.row]
+
+    return counties, xwalk.drop(columns='row').drop_duplicates(['ZIP', 'COUNTY']).sort_values(['ZIP', 'COUNTY'], ignore_index=True)
+
+def write_preparer_listings(root, xwalk, year, scale=1, seed=0):
+
+    '''
+    Writes one pipe-delimited preparer listing per state, at the paths given by 'prep_paths'
+    in the config file, with the 15 columns of the IRS extracts. Preparers are spread over
+    each state's zipcodes; a few zip fields are blank or malformed, as in the real files.
+    '''
+
+    rng = np.random.default_rng([seed, int(year)])
+
+    paths = load_config()['prep_paths']
+    zips = xwalk.drop_duplicates('ZIP')
+    n_rows = int(BASE_PREPARERS * scale)
+
+    rows = rng.choice(len(zips), n_rows, replace=True)
+    listing = pd.DataFrame({'zip': zips.ZIP.to_numpy()[rows].astype(str), 'state': zips.state.to_numpy()[rows]})
+    listing['zip'] = listing.zip.str.zfill(5)
+    listing.loc[rng.uniform(size=n_rows) < 0.002, 'zip'] = 'N/A'
+
+    for column in PREP_COLUMNS:
+        if column not in listing:
+            listing[column] = 'X'
+    listing['phone'] = '5555555555'
+
+    for state, group in listing.groupby('state'):
+        path = os.path.join(root, os.path.relpath(get_prep_file_path(state=state, year=year, paths=paths), project_path()))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        group.assign(state=state.upper())[PREP_COLUMNS].to_csv(path, sep='|', index=False, encoding='ISO-8859-1')
+
+    return None
+
+def write_xwalk(root, xwalk, year, seed=0):
+
+    '''
+    Writes the HUD zip-county crosswalk for the first quarter of a year, with address
+    ratios that sum to one within each zipcode.
+    '''
+
+    rng = np.random.default_rng([seed, int(year), 1])
+
+    out = xwalk[['ZIP', 'COUNTY']].copy()
+    out['USPS_ZIP_PREF_CITY'] = 'CITY'
+    out['USPS_ZIP_PREF_STATE'] = xwalk.state.str.upper()
+
+    for ratio in ['RES_RATIO', 'BUS_RATIO', 'OTH_RATIO', 'TOT_RATIO']:
+        draws = rng.uniform(0.05, 1, len(out))
+        out[ratio] = np.round(draws / pd.Series(draws).groupby(out.ZIP).transform('sum').to_numpy(), 6)
+
+    os.makedirs(os.path.join(root, 'data/raw/zip_county_xwalk'), exist_ok=True)
+    out.to_csv(os.path.join(root, 'data/raw/zip_county_xwalk/ZIP_COUNTY_03' + year + '.csv'), index=False)
+
+    return None
+
+def write_metro(root, counties, seed=0):
+
+    '''
+    Writes the USDA rural-urban continuum codes workbook.
+    '''
+
+    rng = np.random.default_rng([seed, 2])
+
+    metro = pd.DataFrame({'FIPS': counties.county.map('{:05d}'.format), 'State': counties.state.str.upper(),
+                          'County_Name': 'County', 'Population_2020': counties.tot_pop,
+                          'RUCC_2023': rng.integers(1, 10, len(counties))})
+    metro['Description'] = np.where(metro.RUCC_2023 <= 3, 'Metro', 'Nonmetro')
+
+    os.makedirs(os.path.join(root, 'data/raw/urban_rural'), exist_ok=True)
+    metro.to_excel(os.path.join(root, 'data/raw/urban_rural/Ruralurbancontinuumcodes2023.xlsx'), index=False)
+
+    return None
+
+def write_census(root, counties, seed=0):
+
+    '''
+    Writes the four 2021 5-year ACS tables in the Census download layout: a row of
+    variable codes, then a row of labels, then one row per county with 'Geography' codes
+    such as '0500000US01001'.
+    '''
+
+    rng = np.random.default_rng([seed, 3])
+    n = len(counties)
+    pop = counties.tot_pop.to_numpy()
+
+    ages = rng.dirichlet(np.ones(len(AGE_GROUPS) + 1) * 4, n)
+    demog = {"Estimate!!SEX AND AGE!!Total population": pop}
+    demog.update({"Estimate!!SEX AND AGE!!Total population!!" + group: np.round(pop * ages[:, i]) for i, group in enumerate(AGE_GROUPS)})
+    demog["Estimate!!Race alone or in combination with one or more other races!!Total population!!Black or African American"] = np.round(pop * counties.p_black)
+    demog["Percent!!HISPANIC OR LATINO AND RACE!!Total population!!Hispanic or Latino (of any race)"] = np.round(100 * counties.p_hisp, 1)
+    demog["Percent!!SEX AND AGE!!Total population!!Male"] = np.round(rng.normal(49.5, 1.5, n), 1)
+
+    econ = {"Percent!!EMPLOYMENT STATUS!!Population 16 years and over!!In labor force": np.round(rng.normal(60, 6, n), 1),
+            "Percent!!EMPLOYMENT STATUS!!Population 16 years and over!!In labor force!!Civilian labor force!!Unemployed": np.round(rng.gamma(4, 1.2, n), 1),
+            "Estimate!!INCOME AND BENEFITS (IN 2021 INFLATION-ADJUSTED DOLLARS)!!Total households!!Median household income (dollars)": np.round(rng.lognormal(11, 0.25, n))}
+
+    young, older = np.round(pop * 0.09), np.round(pop * 0.68)
+    educ = {'Estimate!!Total!!AGE BY EDUCATIONAL ATTAINMENT!!Population 18 to 24 years': young,
+            "Estimate!!Total!!AGE BY EDUCATIONAL ATTAINMENT!!Population 18 to 24 years!!Bachelor's degree or higher": np.round(young * rng.beta(2, 12, n)),
+            'Estimate!!Total!!AGE BY EDUCATIONAL ATTAINMENT!!Population 25 years and over': older,
+            "Estimate!!Total!!AGE BY EDUCATIONAL ATTAINMENT!!Population 25 years and over!!Bachelor's degree or higher": np.round(older * rng.beta(3, 8, n))}
+
+    marriage = {"Estimate!!Now married (except separated)!!Population 15 years and over": np.round(rng.normal(48, 6, n), 1)}
+
+    os.makedirs(os.path.join(root, 'data/raw/census'), exist_ok=True)
+
+    for name, table in [('5yr_acs_2021', demog), ('econ_2021', econ), ('educ_2021', educ), ('marriage_2021', marriage)]:
+
+        df = pd.DataFrame({'Geography': counties.county.map('0500000US{:05d}'.format), 'Geographic Area Name': 'County'})
+        for i, (label, values) in enumerate(table.items()):
+            df[label] = values
+            # each estimate comes with its margin of error
+            df[label.replace('Estimate!!', 'Margin of Error!!').replace('Percent!!', 'Percent Margin of Error!!')] = np.round(np.abs(values) * 0.05, 1)
+
+        codes = ['GEO_ID', 'NAME'] + ['V' + str(i).zfill(3) + ('E' if j % 2 == 0 else 'M') for i in range(len(table)) for j in range(2)]
+
+        with open(os.path.join(root, 'data/raw/census/census_' + name + '.csv'), 'w', newline='') as stream:
+            stream.write(','.join(codes) + '\n')
+            df.to_csv(stream, index=False)
+
+    return None
+
+def write_soi(root, counties, year, seed=0):
+
+    '''
+    Writes the SOI county files for a tax year: '<yy>incyallnoagi.csv' with one row per
+    county plus state totals (COUNTYFIPS 0), and '<yy>incyallagi.csv' with the same
+    variables split over eight AGI bins. EIP fields (N10971, A10971) are only included
+    from tax year 2021. Amounts are in thousands of dollars.
+    '''
+
+    rng = np.random.default_rng([seed, int(year), 4])
+    n = len(counties)
+    returns = np.round(counties.returns.to_numpy() * rng.uniform(0.9, 1.1, n)).astype(np.int64)
+
+    variables = {'N1': returns, 'PREP': rng.binomial(returns, counties.p_prep)}
+    variables['N11070'] = rng.binomial(returns, rng.beta(4, 14, n))
+    variables['A11070'] = np.round(variables['N11070'] * rng.normal(3.2 if year >= '2021' else 2.0, 0.2, n)).astype(np.int64)
+    variables['N59660'] = rng.binomial(returns, rng.beta(4, 20, n))
+    variables['A59660'] = np.round(variables['N59660'] * rng.normal(2.4, 0.3, n)).astype(np.int64)
+    variables['RAC'] = rng.binomial(returns, 0.15)
+    variables['A00100'] = np.round(returns * rng.lognormal(4.1, 0.3, n)).astype(np.int64)
+    variables['N02650'] = returns
+    variables['A07225'] = rng.binomial(returns, 0.02)
+    if year >= '2021':
+        variables['N10971'] = rng.binomial(returns, rng.beta(10, 8, n))
+        variables['A10971'] = np.round(variables['N10971'] * rng.normal(1.4, 0.1, n)).astype(np.int64)
+
+    ids = pd.DataFrame({'STATEFIPS': counties.STATEFIPS, 'STATE': counties.state.str.upper(),
+                        'COUNTYFIPS': counties.COUNTYFIPS, 'COUNTYNAME': 'County'})
+
+    # county-by-bin values: returns and credits are split over the eight AGI bins, with
+    # EITC concentrated in the lowest bins and EIP absent from the top bin
+    profiles = {'EITC': [0.3, 0.35, 0.25, 0.08, 0.02, 0, 0, 0], 'N10971': [0.12, 0.16, 0.16, 0.14, 0.14, 0.16, 0.12, 0]}
+    bins = {}
+    for name, values in variables.items():
+        profile = profiles['EITC'] if name in ['N59660', 'A59660'] else profiles.get(name, [0.1, 0.13, 0.15, 0.14, 0.12, 0.16, 0.14, 0.06])
+        bins[name] = rng.multinomial(values, profile)
+
+    agi = ids.loc[ids.index.repeat(8)].reset_index(drop=True)
+    agi['agi_stub'] = np.tile(np.arange(1, 9), n)
+    for name in variables:
+        agi[name] = bins[name].reshape(-1)
+
+    noagi = ids.copy()
+    for name in variables:
+        noagi[name] = bins[name].sum(axis=1)
+
+    # state totals come first in each state's rows
+    for df, keys in [(noagi, ['STATEFIPS']), (agi, ['STATEFIPS', 'agi_stub'])]:
+        totals = df.groupby(keys, as_index=False)[list(variables)].sum()
+        totals['STATE'] = df.groupby(keys)['STATE'].first().to_numpy()
+        totals['COUNTYFIPS'] = 0
+        totals['COUNTYNAME'] = 'State Total'
+        df = pd.concat([totals[df.columns], df]).sort_values(['STATEFIPS', 'COUNTYFIPS'] + keys[1:], kind='stable')
+
+        os.makedirs(os.path.join(root, 'data/raw/SOI'), exist_ok=True)
+        name = 'incyallagi.csv' if 'agi_stub' in keys else 'incyallnoagi.csv'
+        df.to_csv(os.path.join(root, 'data/raw/SOI', year[2:] + name), index=False, encoding='latin-1')
+
+    return None
+
+def write_geography(root, counties):
+
+    '''
+    Writes a county shapefile at GEOMETRY_PATH with the fields of the Census cartographic
+    boundary file ('GEOID', 'STATEFP', 'COUNTYFP', 'NAME'). Counties are the cells of a
+    grid over the lower 48 states in county order, so neighbouring counties share exact
+    borders, as the map code expects.
+    '''
+
+    import geopandas as gpd
+    import shapely
+
+    n = len(counties)
+    n_cols = int(np.ceil(np.sqrt(n * 2.4)))
+    n_rows = int(np.ceil(n / n_cols))
+
+    # cell corners come from one set of edges, so shared borders are identical
+    lon = np.linspace(-124, -67, n_cols + 1)
+    lat = np.linspace(49, 25, n_rows + 1)
+    col, row = np.arange(n) % n_cols, np.arange(n) // n_cols
+
+    geo = gpd.GeoDataFrame({'STATEFP': counties.STATEFIPS.map('{:02d}'.format).to_numpy(),
+                            'COUNTYFP': counties.COUNTYFIPS.map('{:03d}'.format).to_numpy(),
+                            'GEOID': counties.county.map('{:05d}'.format).to_numpy(),
+                            'NAME': ('County ' + counties.county.astype(str)).to_numpy()},
+                           geometry=shapely.box(lon[col], lat[row + 1], lon[col + 1], lat[row]), crs='EPSG:4269')
+
+    path = os.path.join(root, GEOMETRY_PATH)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    geo.to_file(path)
+
+    return None
+
+def write_eitc_schedule(root):
+
+    '''
+    Writes the EITC schedule behind figure 1 to data/clean/eitc_fig_data.csv: credit amounts
+    by earned income for each number of children in 2017 and 2021, with columns
+    '<children>_<yy>_inc' and '<children>_<yy>_ben'.
+    '''
+
+    income = np.arange(0, 60001, 100)
+    df = pd.DataFrame()
+
+    for yy, schedules in EITC_PARAMETERS.items():
+        for children, (rate, maximum, start, phase_out) in schedules.items():
+            credit = np.minimum(income * rate, maximum) - np.maximum(income - start, 0) * phase_out
+            df[children + '_' + yy + '_inc'] = income
+            df[children + '_' + yy + '_ben'] = np.maximum(credit, 0).round(2)
+
+    df.to_csv(os.path.join(root, 'data/clean/eitc_fig_data.csv'), index=False)
+
+    return None
+
+def make_fixtures(root, scale=1, years=None, seed=0):
+
+    '''
+    Writes a complete set of synthetic inputs under root, laid out like the project
+    (root/data/raw/..., with a copy of the config file in root/code/config/), so every
+    stage can run on them with the project set to root (see path_utils.use_project).
+    Column names, file layouts and value ranges follow the real IRS, HUD, Census, USDA,
+    SOI and Census shapefile inputs, and the EITC schedule for figure 1 is written to
+    root/data/clean/.
+
+    inputs:
+        root: output directory
+        scale: size relative to the real inputs, e.g. 1, 10 or 100 (see make_geography)
+        years: list of tax years to write listings, crosswalks and SOI files for. None
+        uses every year in 'years' and 'panel_years' of the config file.
+        seed: random seed
+    outputs:
+        counties: dataframe of the synthetic counties
+    '''
+
+    out = load_config()
+    years = sorted(set(out['years']) | set(out['panel_years'])) if years is None else years
+
+    for directory in ['code/utils', 'code/config', 'data/clean', 'data/intermediate', 'results/tables', 'results/figures', 'results/logs']:
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+    shutil.copy(out.path, os.path.join(root, 'code/config/data.yaml'))
+
+    counties, xwalk = make_geography(scale=scale, seed=seed)
+
+    for year in years:
+        write_preparer_listings(root, xwalk, year, scale=scale, seed=seed)
+        write_xwalk(root, xwalk, year, seed=seed)
+        write_soi(root, counties, year, seed=seed)
+
+    write_metro(root, counties, seed=seed)
+    write_census(root, counties, seed=seed)
+    write_geography(root, counties)
+    write_eitc_schedule(root)
+
+    return counties
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Write synthetic raw input files at a given scale.')
+    parser.add_argument('--scale', type=float, default=1, help='size relative to the real inputs (default: 1)')
+    parser.add_argument('--out', default=None, help='output directory (default: data/synthetic/scale_<scale> in the project)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    root = args.out or project_path('data/synthetic/scale_' + format(args.scale, 'g'))
+    counties = make_fixtures(root, scale=args.scale, seed=args.seed)
+
+    print('wrote ' + str(len(counties)) + ' counties to ' + os.path.abspath(root))
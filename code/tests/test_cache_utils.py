@@ -0,0 +1,156 @@
+import importlib.util
+import os
+import pandas as pd
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+import cache_utils
+from cache_utils import CACHE_DIR, HASH_DIR, hash_file
+from path_utils import use_project
+
+LOADER = '''
+import pandas as pd
+from cache_utils import cached
+
+CALLS = []
+
+@cached(sources=lambda path, scale=1: [path])
+def read_counts(path, scale=1):
+    CALLS.append(path)
+    return pd.read_csv(path) * scale{edit}
+'''
+
+def load_module(root, name, edit=''):
+
+    '''
+    writes a module holding a cached loader to root and imports it, so that editing the
+    loader can be simulated by importing a second module with a different body
+    '''
+
+    path = os.path.join(root, name + '.py')
+    with open(path, 'w') as stream:
+        stream.write(LOADER.format(edit=edit))
+
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+def write_csv(root, name, values):
+
+    path = os.path.join(root, name)
+    pd.DataFrame({'x': values}).to_csv(path, index=False)
+
+    return path
+
+def cache_entries(root):
+
+    cache_dir = os.path.join(root, CACHE_DIR)
+
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith('.parquet')) if os.path.isdir(cache_dir) else []
+
+def test_hit_and_changed_source_file(tmp_path):
+
+    loader = load_module(tmp_path, 'loader')
+    path = write_csv(tmp_path, 'counts.csv', [1, 2, 3])
+
+    with use_project(root=tmp_path):
+        first = loader.read_counts(path)
+        second = loader.read_counts(path)
+        assert len(loader.CALLS) == 1
+        pd.testing.assert_frame_equal(first, second)
+
+        # a changed raw file misses the cache, and the new contents are returned
+        write_csv(tmp_path, 'counts.csv', [1, 2, 3, 4])
+        third = loader.read_counts(path)
+        assert len(loader.CALLS) == 2
+        assert third['x'].tolist() == [1, 2, 3, 4]
+
+def test_changed_arguments(tmp_path):
+
+    loader = load_module(tmp_path, 'loader')
+    path = write_csv(tmp_path, 'counts.csv', [1, 2, 3])
+
+    with use_project(root=tmp_path):
+        loader.read_counts(path)
+        assert loader.read_counts(path, scale=2)['x'].tolist() == [2, 4, 6]
+        assert len(loader.CALLS) == 2
+
+        # defaults are part of the key, so passing the default explicitly is a hit
+        loader.read_counts(path, scale=1)
+        assert len(loader.CALLS) == 2
+
+def test_changed_loader_body(tmp_path):
+
+    path = write_csv(tmp_path, 'counts.csv', [1, 2, 3])
+
+    with use_project(root=tmp_path):
+        before = load_module(tmp_path, 'loader')
+        before.read_counts(path)
+
+        # the same loader name with an edited body misses the cache
+        after = load_module(tmp_path, 'loader_edited', edit=' + 1')
+        assert after.read_counts(path)['x'].tolist() == [2, 3, 4]
+        assert len(after.CALLS) == 1
+
+def test_use_cache_false_bypasses_cache(tmp_path):
+
+    loader = load_module(tmp_path, 'loader')
+    path = write_csv(tmp_path, 'counts.csv', [1, 2, 3])
+
+    with use_project(root=tmp_path):
+        loader.read_counts(path, use_cache=False)
+        loader.read_counts(path, use_cache=False)
+        assert len(loader.CALLS) == 2
+        assert cache_entries(tmp_path) == []
+
+        # nor does it read an existing entry
+        loader.read_counts(path)
+        loader.read_counts(path, use_cache=False)
+        assert len(loader.CALLS) == 4
+
+def test_eviction_removes_least_recently_used(tmp_path, monkeypatch):
+
+    loader = load_module(tmp_path, 'loader')
+    paths = [write_csv(tmp_path, name + '.csv', [1, 2, 3]) for name in ['a', 'b', 'c']]
+
+    with use_project(root=tmp_path):
+        loader.read_counts(paths[0])
+        entry_a = cache_entries(tmp_path)
+        loader.read_counts(paths[1])
+        entry_b = sorted(set(cache_entries(tmp_path)) - set(entry_a))
+
+        cache_dir = os.path.join(tmp_path, CACHE_DIR)
+        size = os.path.getsize(os.path.join(cache_dir, entry_a[0]))
+        os.utime(os.path.join(cache_dir, entry_a[0]), ns=(1, 1))
+        os.utime(os.path.join(cache_dir, entry_b[0]), ns=(2, 2))
+
+        # a hit refreshes a, so b is now the least recently used entry
+        loader.read_counts(paths[0])
+        assert len(loader.CALLS) == 2
+
+        monkeypatch.setattr(cache_utils, 'CACHE_MAX_BYTES', 2 * size)
+        loader.read_counts(paths[2])
+
+        entries = cache_entries(tmp_path)
+        assert len(entries) == 2
+        assert entry_a[0] in entries and entry_b[0] not in entries
+
+def test_hash_file_rebuilds_unreadable_index(tmp_path):
+
+    path = write_csv(tmp_path, 'counts.csv', [1, 2, 3])
+    cache_dir = os.path.join(tmp_path, 'cache')
+
+    digest = hash_file(path, cache_dir=cache_dir)
+    index = os.listdir(os.path.join(cache_dir, HASH_DIR))
+    assert len(index) == 1
+
+    # a half-written entry is treated as missing and rewritten
+    with open(os.path.join(cache_dir, HASH_DIR, index[0]), 'w') as stream:
+        stream.write('{"path": ')
+    assert hash_file(path, cache_dir=cache_dir) == digest
+
+    # each source file has its own entry, so hashing another file leaves the first in place
+    hash_file(write_csv(tmp_path, 'other.csv', [4]), cache_dir=cache_dir)
+    assert len(os.listdir(os.path.join(cache_dir, HASH_DIR))) == 2
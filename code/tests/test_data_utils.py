@@ -0,0 +1,32 @@
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+from data_utils import apply_schema
+
+DTYPES = {'county': 'int32', 'tot_*': 'int32', 'returns*': 'int32', 'state_ind_*': 'uint8', 'share_*': 'float32'}
+
+def test_apply_schema_casts_whole_numbers():
+
+    df = pd.DataFrame({'county': [1001.0, 56045.0], 'returns': [10.0, np.nan], 'state_ind_1': [0, 1], 'share_eip': [0.25, 0.5]})
+    out = apply_schema(df, dtypes=DTYPES)
+
+    assert out['county'].dtype == np.int32 and out['county'].tolist() == [1001, 56045]
+    assert out['state_ind_1'].dtype == np.uint8
+    assert out['share_eip'].dtype == np.float32
+
+    # integers with missing values are stored as floats
+    assert out['returns'].dtype == np.float64
+
+def test_apply_schema_keeps_fractional_and_out_of_range_values():
+
+    # counts allocated to counties with crosswalk weights, an amount beyond the int32 range,
+    # and a negative value declared unsigned
+    df = pd.DataFrame({'tot_prep': [12.4, 7.0], 'tot_eip': [3.1e9, 1.0], 'returns_17': [2.5, np.nan], 'state_ind_2': [-1, 1]})
+    out = apply_schema(df, dtypes=DTYPES)
+
+    for column in df.columns:
+        assert out[column].dtype == df[column].dtype
+        pd.testing.assert_series_equal(out[column], df[column])
@@ -0,0 +1,102 @@
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+from iv_utils import add_constant, count_absorbed, iv2sls, resample
+
+def make_data(n=600, seed=0):
+
+    '''
+    synthetic 2SLS data with counties nested in states and a year grouping crossed with both
+    '''
+
+    rng = np.random.default_rng(seed)
+
+    df = pd.DataFrame({'county': rng.integers(0, 40, n)})
+    df['state'] = df['county'] // 8
+    df['year'] = rng.integers(0, 3, n)
+
+    effect = rng.normal(size=40)[df['county']] + rng.normal(size=3)[df['year']]
+    df['z'] = rng.normal(size=n) + effect
+    df['w'] = rng.normal(size=n)
+    u = rng.normal(size=n)
+    df['x'] = df['z'] + 0.5 * u + rng.normal(size=n)
+    df['y'] = 1.0 * df['x'] + 0.3 * df['w'] + effect + u
+
+    return df
+
+def dummies(df, groups):
+
+    '''
+    fixed-effect dummies: every level of the first grouping, and all but one level of the others
+    '''
+
+    return pd.concat([pd.get_dummies(df[group], prefix=group, drop_first=i > 0, dtype=float) for i, group in enumerate(groups)], axis=1)
+
+def dummy_fit(df, groups):
+
+    from linearmodels.iv import IV2SLS
+
+    exog = pd.concat([df[['w']], dummies(df, groups)], axis=1)
+
+    return IV2SLS(df['y'], exog, df[['x']], df[['z']]).fit(cov_type='robust', debiased=True)
+
+def test_count_absorbed_nested():
+
+    df = make_data()
+
+    # states are unions of counties, so they add no parameters whichever order they come in
+    assert count_absorbed(df, ['state', 'county']) == 40
+    assert count_absorbed(df, ['county', 'state']) == 40
+    assert count_absorbed(df, ['state']) == 5
+
+def test_count_absorbed_crossed():
+
+    df = make_data()
+
+    # counties and years are connected, so one level is shared
+    assert count_absorbed(df, ['county', 'year']) == 40 + 3 - 1
+    assert count_absorbed(df, ['state', 'county', 'year']) == 40 + 3 - 1
+
+    # two disconnected blocks share one level each
+    blocks = pd.DataFrame({'a': [0, 0, 1, 1, 2, 2, 3, 3], 'b': [0, 1, 0, 1, 2, 3, 2, 3]})
+    assert count_absorbed(blocks, ['a', 'b']) == 4 + 4 - 2
+
+def test_iv2sls_nested_absorb_matches_dummies():
+
+    df = make_data()
+
+    res = iv2sls(df['y'], df[['w']], df[['x']], df[['z']], absorb=df[['state', 'county']], debiased=True)
+    dummy = dummy_fit(df, ['county'])
+
+    assert res.df_resid == dummy.df_resid
+    np.testing.assert_allclose(res.params[['w', 'x']], dummy.params[['w', 'x']], rtol=1e-8)
+    np.testing.assert_allclose(res.std_errors[['w', 'x']], dummy.std_errors[['w', 'x']], rtol=1e-6)
+
+def test_iv2sls_crossed_absorb_matches_dummies():
+
+    df = make_data()
+
+    res = iv2sls(df['y'], df[['w']], df[['x']], df[['z']], absorb=df[['county', 'year']], debiased=True)
+    dummy = dummy_fit(df, ['county', 'year'])
+
+    assert res.df_resid == dummy.df_resid
+    np.testing.assert_allclose(res.params[['w', 'x']], dummy.params[['w', 'x']], rtol=1e-6)
+    np.testing.assert_allclose(res.std_errors[['w', 'x']], dummy.std_errors[['w', 'x']], rtol=1e-5)
+
+def test_permutation_tests_the_permuted_instrument():
+
+    df = make_data()
+    exog = add_constant(df[['w']])
+
+    # strong instrument and a true effect of one: the reduced form is far from zero
+    res = resample(df['y'], exog, df[['x']], df[['z']], method='permutation', reps=500, n_workers=1)
+    assert list(res.pvalues.index) == ['z']
+    assert res.pvalues['z'] < 0.01
+
+    # no effect of x on y: the permuted instrument is not significant
+    df['y'] = df['w'] + np.random.default_rng(1).normal(size=len(df))
+    res = resample(df['y'], exog, df[['x']], df[['z']], method='permutation', reps=500, n_workers=1)
+    assert res.pvalues['z'] > 0.05
@@ -0,0 +1,42 @@
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import os
+import sys
+import threading
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../utils'))
+from profile_utils import RECORDS, reset_records, stage
+
+def test_runs_in_threads_keep_separate_records():
+
+    barrier = threading.Barrier(2)
+    found = {}
+
+    def run(name):
+
+        reset_records()
+        with stage(name + '_start'):
+            pass
+
+        # the other run resets its records while this one is running
+        barrier.wait()
+
+        # stages of this run in threads started in copies of its context share its records
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for future in [executor.submit(contextvars.copy_context().run, stage_job, name + '_' + str(i)) for i in range(2)]:
+                future.result()
+
+        barrier.wait()
+        found[name] = sorted(record['stage'] for record in RECORDS.get())
+
+    def stage_job(name):
+        with stage(name):
+            pass
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in ['a', 'b']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert found == {'a': ['a_0', 'a_1', 'a_start'], 'b': ['b_0', 'b_1', 'b_start']}
@@ -0,0 +1,257 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pandas as pd
+from path_utils import project_path
+import shutil
+import threading
+
+# cache directory, relative to the project root (see path_utils.set_project)
+CACHE_DIR = 'data/cache/'
+CACHE_MAX_BYTES = 5 * 1024**3
+
+# folder of the cache directory holding one hash index entry per source file
+HASH_DIR = 'file_hashes'
+
+def _tmp_path(path):
+
+    '''
+    Returns a temporary path next to path which no other process or thread writes to, so
+    a file can be written there in full and then moved into place with os.replace.
+    '''
+
+    return path + '.' + str(os.getpid()) + '_' + str(threading.get_ident()) + '.tmp'
+
+def hash_file(path, cache_dir=None):
+
+    '''
+    Returns the sha256 hash of a file's contents. Hashes are remembered in the 'file_hashes'
+    folder of the cache directory together with the file's size and modification time, so
+    a source file is only re-read when it has changed on disk. Each source file has its own
+    index entry, written atomically, so worker processes hashing different files at the
+    same time do not overwrite each other's entries, and an unreadable entry is rebuilt.
+
+    inputs:
+        path: path to the file to hash
+        cache_dir: directory holding the hash index. None uses CACHE_DIR in the project.
+    outputs:
+        digest: hex digest of the file contents
+    '''
+
+    cache_dir = project_path(CACHE_DIR) if cache_dir is None else cache_dir
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, HASH_DIR, hashlib.sha256(path.encode()).hexdigest()[:32] + '.json')
+
+    entry = None
+    try:
+        with open(index_path, 'r') as stream:
+            entry = json.load(stream)
+    except (OSError, ValueError):
+        entry = None
+
+    if isinstance(entry, dict) and entry.get('path') == path and entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns:
+        return entry['sha256']
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as stream:
+        for block in iter(lambda: stream.read(1024**2), b''):
+            digest.update(block)
+
+    entry = {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    tmp_path = _tmp_path(index_path)
+    with open(tmp_path, 'w') as stream:
+        json.dump(entry, stream)
+    os.replace(tmp_path, index_path)
+
+    return digest.hexdigest()
+
+def cache_key(name, sources, arguments, code='', cache_dir=None):
+
+    '''
+    Builds the cache key for a loader call from the loader name and code, the contents of its 
+    source files, and its arguments.
+
+    inputs:
+        name: name of the loader
+        sources: list of source file paths read by the loader
+        arguments: dictionary of loader arguments. values must be representable as json.
+        code: source code of the loader, so that editing the loader invalidates its entries
+        cache_dir: directory holding the hash index. None uses CACHE_DIR in the project.
+    outputs:
+        key: hex digest identifying the cached output
+    '''
+
+    payload = {'name': name,
+               'code': hashlib.sha256(code.encode()).hexdigest(),
+               'sources': [hash_file(path, cache_dir=cache_dir) for path in sources],
+               'arguments': arguments}
+
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def evict_cache(cache_dir=None, max_bytes=None):
+
+    '''
+    Deletes the least recently used cached frames until the cache directory is no larger
+    than max_bytes. Cache hits refresh a file's modification time, so the oldest
+    modification time marks the least recently used entry.
+
+    inputs:
+        cache_dir: cache directory. None uses CACHE_DIR in the project.
+        max_bytes: maximum total size of cached frames, in bytes. None uses CACHE_MAX_BYTES.
+    outputs: None
+    '''
+
+    cache_dir = project_path(CACHE_DIR) if cache_dir is None else cache_dir
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+
+    if not os.path.isdir(cache_dir):
+        return None
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.parquet'):
+            # another process may evict the same entry first
+            try:
+                stat = os.stat(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            pass
+        total -= size
+
+    return None
+
+def clear_cache(cache_dir=None):
+
+    '''
+    Deletes every cached frame and the file hash index.
+
+    inputs:
+        cache_dir: cache directory. None uses CACHE_DIR in the project.
+    outputs: None
+    '''
+
+    cache_dir = project_path(CACHE_DIR) if cache_dir is None else cache_dir
+
+    evict_cache(cache_dir=cache_dir, max_bytes=0)
+
+    shutil.rmtree(os.path.join(cache_dir, HASH_DIR), ignore_errors=True)
+
+    return None
+
+def function_source(functions):
+
+    '''
+    Returns the source code of a list of functions, joined together. Decorated functions
+    give the source of the function they wrap, and functions whose source cannot be read
+    (e.g. builtins) give an empty string.
+
+    inputs:
+        functions: list of functions
+    outputs:
+        code: source code of the functions
+    '''
+
+    code = []
+    for func in functions:
+        try:
+            code.append(inspect.getsource(func))
+        except (OSError, TypeError):
+            code.append('')
+
+    return '\n'.join(code)
+
+def cached(sources, depends=[]):
+
+    '''
+    Decorator which caches the dataframe returned by a raw-input loader as a Parquet file
+    under CACHE_DIR in the project. Entries are keyed on the sha256 hash of every source
+    file plus the loader arguments, so editing a raw file or calling the loader with
+    different arguments produces a new entry. The decorated loader takes an extra keyword argument
+    'use_cache' (default True); passing use_cache=False reads the raw files directly and
+    leaves the cache untouched. Loaders which take a 'use_cache' argument themselves are
+    passed the flag, so they can forward it to the cached loaders they call. The source
+    code of the loader and of the functions in depends is part of the key, so editing
+    the loader or one of those functions also invalidates its entries.
+
+    inputs:
+        sources: function which takes the loader's arguments and returns the list of raw
+        file paths the loader reads
+        depends: list of names of functions, in the loader's module, whose output the
+        loader's output depends on (e.g. the helpers it calls)
+    outputs:
+        decorator: function which wraps a loader with the cache
+    '''
+
+    def decorator(func):
+
+        signature = inspect.signature(func)
+        forward = 'use_cache' in signature.parameters
+        state = {'code': None}
+
+        def source_code():
+
+            # read lazily, so depends may name functions defined after the loader
+            if state['code'] is None:
+                state['code'] = function_source([func] + [func.__globals__[name] for name in depends])
+
+            return state['code']
+
+        @functools.wraps(func)
+        def wrapper(*args, use_cache=True, **kwargs):
+
+            if forward:
+                kwargs['use_cache'] = use_cache
+
+            if not use_cache:
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            arguments.pop('use_cache', None)
+
+            key = cache_key(func.__name__, sources(**arguments), arguments, code=source_code())
+            path = os.path.join(project_path(CACHE_DIR), func.__name__ + '_' + key[:24] + '.parquet')
+
+            # an entry evicted by another process since the check is rebuilt
+            if os.path.exists(path):
+                try:
+                    os.utime(path)
+                    return pd.read_parquet(path)
+                except FileNotFoundError:
+                    pass
+
+            df = func(*args, **kwargs)
+
+            # frames with mixed-type object columns cannot be stored as Parquet; return them uncached
+            tmp_path = _tmp_path(path)
+            try:
+                df.to_parquet(tmp_path)
+                os.replace(tmp_path, path)
+            except (ImportError, NotImplementedError, TypeError, ValueError) as e:
+                print('not caching ' + func.__name__ + ': ' + str(e))
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            evict_cache()
+
+            return df
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,181 @@
+import keyword
+import os
+from path_utils import config_path
+import re
+import yaml
+
+# parsed config files, keyed on absolute path
+_CONFIGS = {}
+
+# settings every config file must define
+REQUIRED_KEYS = ['infl_mpl', 'states', 'agi_bin_dict', 'agi_17_bin_dict', 'summ_stats', 'summ_stats_years',
+                 'panel_years', 'prep_paths', 'xwalk_weight', 'fs_y', 'fs_X_1', 'table_labels']
+
+class Config(dict):
+
+    '''
+    Settings from a config file. A Config is a dictionary, so settings are read as
+    out['key'], and it is shared by every caller in a process: treat it as read-only.
+
+    attributes:
+        path: absolute path of the config file
+        mtime_ns: modification time of the file when it was read
+        columns: dictionary keyed by stage ('regs', 'summary_stats', 'spec_grid', 'maps')
+        of the clean data columns the stage reads, so loaders can read only those
+        required: dictionary keyed by stage of the columns that must exist in the clean
+        data. some stage columns are optional, e.g. summary statistics for a variable that
+        is only available in one year.
+    '''
+
+    def __init__(self, settings, path='', mtime_ns=None):
+
+        super().__init__(settings)
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.columns, self.required = stage_columns(self)
+
+    def __reduce__(self):
+        return (Config, (dict(self), self.path, self.mtime_ns))
+
+    def check_columns(self, stage, available, extra=[]):
+
+        '''
+        Fails fast if the config names variables that the clean data does not have.
+
+        inputs:
+            stage: stage name, a key of columns
+            available: list of columns of the clean data (see clean_data_columns)
+            extra: list of further columns the caller needs
+        outputs:
+            columns: the stage's columns plus extra, without duplicates, keeping only the
+            optional ones that exist
+        '''
+
+        available = set(available)
+        missing = [x for x in dict.fromkeys(self.required[stage] + list(extra)) if x not in available]
+
+        if missing:
+            raise ValueError(os.path.basename(self.path) + ': unknown variable(s) for ' + stage + ': ' + ', '.join(missing))
+
+        return [x for x in dict.fromkeys(self.columns[stage] + list(extra)) if x in available]
+
+def _names(value):
+
+    '''
+    Flattens a variable name or (nested) list of variable names, dropping 'const'.
+    '''
+
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [] if value == 'const' else [value]
+
+    return [x for item in value for x in _names(item)]
+
+def stage_columns(out):
+
+    '''
+    Lists the clean data columns read by each analysis stage.
+
+    inputs:
+        out: config dictionary
+    outputs:
+        columns: dictionary keyed by stage of the columns the stage reads
+        required: dictionary keyed by stage of the columns that must exist
+    '''
+
+    columns, required = {}, {}
+
+    # first- and second-stage regressions
+    regs = []
+    for key, value in out.items():
+        if key == 'fs_y' or key.startswith('fs_X_') or key.startswith('spec_'):
+            regs += _names(value)
+    columns['regs'] = required['regs'] = list(dict.fromkeys(regs))
+
+    # summary statistics: the first year's columns must exist, other years are read if present
+    suffixes = list((out.get('summ_stats_years') or {'': ''}).values())
+    extra = _names([out.get('summ_stats_weights'), out.get('summ_stats_by')])
+    columns['summary_stats'] = list(dict.fromkeys([x + suffix for x in out.get('summ_stats', []) for suffix in suffixes] + extra))
+    required['summary_stats'] = list(dict.fromkeys([x + suffixes[0] for x in out.get('summ_stats', [])] + extra))
+
+    # specification grid, plus any column named in a sample query
+    grid = _names([out.get('grid_outcomes'), out.get('grid_endog'), out.get('grid_inst'), out.get('grid_always'), out.get('grid_controls')])
+    queries = [name for query in (out.get('grid_samples') or {}).values() if query
+               for name in re.findall(r'[A-Za-z_][A-Za-z0-9_]*', query) if not keyword.iskeyword(name)]
+    columns['spec_grid'] = list(dict.fromkeys(grid + queries))
+    required['spec_grid'] = list(dict.fromkeys(grid))
+
+    # county maps
+    columns['maps'] = required['maps'] = ['county'] + list(out.get('map_variables') or {})
+
+    return columns, required
+
+def validate_config(out, path='data.yaml'):
+
+    '''
+    Checks the structure of a config file, so that a typo fails when the file is read
+    rather than partway through a run.
+
+    inputs:
+        out: config dictionary
+        path: path of the config file, for error messages
+    outputs: None
+    '''
+
+    name = os.path.basename(path)
+
+    missing = [key for key in REQUIRED_KEYS if key not in out]
+    if missing:
+        raise ValueError(name + ': missing setting(s): ' + ', '.join(missing))
+
+    if out['xwalk_weight'] not in [None, 'res', 'bus', 'tot']:
+        raise ValueError(name + ": xwalk_weight must be null, 'res', 'bus' or 'tot', not " + repr(out['xwalk_weight']))
+
+    if 'default' not in out['prep_paths']:
+        raise ValueError(name + ": prep_paths needs a 'default' entry")
+
+    if not out['summ_stats_years']:
+        raise ValueError(name + ': summ_stats_years is empty')
+
+    for spec in sorted({key.rsplit('_', 1)[0] for key in out if re.fullmatch(r'spec_\d+_\w+', key)}):
+        for part in ['controls', 'endog', 'inst']:
+            if spec + '_' + part not in out:
+                raise ValueError(name + ': ' + spec + ' has no ' + spec + '_' + part)
+
+    for variable, scheme in (out.get('map_variables') or {}).items():
+        scheme = {**(out.get('map_default') or {}), **(scheme or {})}
+        if 'bins' not in scheme and 'scheme' not in scheme:
+            raise ValueError(name + ': map scheme for ' + variable + " needs 'bins' or 'scheme'")
+
+    return None
+
+def read_config(file_path=None):
+
+    '''
+    Returns the validated Config for a config file, parsing the file only the first time
+    it is read in a process or after it changes on disk.
+
+    inputs:
+        file_path: path to the yaml config file. None reads the project's config file (see
+        path_utils.set_project).
+    outputs:
+        out: Config object
+    '''
+
+    path = os.path.abspath(config_path() if file_path is None else file_path)
+    mtime_ns = os.stat(path).st_mtime_ns
+
+    out = _CONFIGS.get(path)
+    if out is not None and out.mtime_ns == mtime_ns:
+        return out
+
+    with open(path, 'r') as stream:
+        settings = yaml.safe_load(stream)
+
+    validate_config(settings, path=path)
+
+    out = Config(settings, path=path, mtime_ns=mtime_ns)
+    _CONFIGS[path] = out
+
+    return out
@@ -1,7 +1,17 @@
-from linearmodels.iv import IV2SLS # for two-stage least squares regressions 
+# scipy.sparse, pyarrow and linearmodels are imported in the functions that use them, so
+# that scripts importing this module only pay for the libraries their stages need
+from cache_utils import cached
+from config_utils import read_config
+import fnmatch
+import functools
+from iv_utils import add_constant, iv2sls, iv2sls_multi, nested_ols, resample, spec_grid
+import numpy as np
 import os
 import pandas as pd
-import yaml
+from path_utils import project_executor, project_path, set_project, use_project
+from profile_utils import RECORDS, instrument
+from table_utils import results_frame, write_table
+import tracemalloc
 
 def set_working_dir():
 
@@ -18,29 +28,60 @@ def set_working_dir():
 
     return None
 
-def load_config(file_path='../config/data.yaml'):
+def load_config(file_path=None):
 
     '''
     loads config file into memory for data cleaning, assigning
-    config file to object 'out'
+    config file to object 'out'. The file is parsed and validated once per process and
+    re-read only when it changes on disk (see config_utils.py).
 
     inputs: 
-        file_path: path to yaml file with data config settings
+        file_path: path to yaml file with data config settings. None reads the project's
+        config file, 'code/config/data.yaml' unless set with set_project
     outputs: 
-        out: object containing yaml contents
+        out: Config object (a dictionary) containing yaml contents, with the clean data
+        columns read by each analysis stage in out.columns
     '''
 
-    with open(file_path, 'r') as stream:
-        out = yaml.safe_load(stream)
+    return read_config(file_path)
 
-    return out
+def get_prep_file_path(state='ak', year='2017', paths=None):
 
+    '''
+    Builds the path to the raw IRS preparer listing for a given state and year. Extracts 
+    for different years unpack into different directory layouts, so the path templates 
+    are read from 'prep_paths' in the config file: the entry for the year if there is 
+    one, and the 'default' entry otherwise. Relative templates are relative to the
+    project's code/utils directory.
+
+    inputs:
+        state: desired U.S. state of data to load
+        year: desired year of data to load, e.g. '2017'
+        paths: None to read the path templates from the config file, or a dictionary of
+        templates with '{state}' and '{year}' placeholders
+
+    outputs:
+        path: absolute path to the pipe-delimited preparer listing
+    '''
+
+    if paths is None:
+        paths = load_config()['prep_paths']
+
+    path = project_path('code/utils', paths.get(year, paths['default']).format(state=state, year=year))
+
+    return path
+
+@instrument
+@cached(sources=lambda state, year: [get_prep_file_path(state=state, year=year)])
 def get_paid_prep_count(state='ak', year='2017'):
 
     '''
     Converts raw state-level IRS data files containing lists of preparer names and addresses
     into total count of preparers by zipcode for that state.
 
+    Only the zip column (the sixth of the 15 columns: name, addr1, addr2, city, state, zip, 
+    zip4, fname, mi, lname, phone, bk1, bk2, bk3, bk4) is parsed.
+
     inputs: 
         state: desired U.S. state of data to load 
         year: desired year of data to load. valid options are '2017', '2021' 
@@ -48,16 +89,10 @@ def get_paid_prep_count(state='ak', year='2017'):
     outputs: 
         counts: dataframe with count of tax preparers by zipcode for the specified state and year.
     '''
-    
-    if year == '2017':
-        df = pd.read_csv('../../data/raw/paid_preparers/' + year + '/' + state + '/var/IRS/data/scripts/efile/downloadNew/' + state + '.txt', 
-          sep="|", encoding='ISO-8859-1')
-        
-    elif year == '2021':
-        df = pd.read_csv('../../data/raw/paid_preparers/' + year + '/var/IRS/data/scripts/efile/downloadNew/' + state + '.txt', 
-          sep="|", encoding='ISO-8859-1')
-    
-    df.columns=['name', 'addr1', 'addr2', 'city', 'state', 'zip', 'zip4', 'fname', 'mi', 'lname', 'phone', 'bk1', 'bk2', 'bk3', 'bk4']
+
+    df = pd.read_csv(get_prep_file_path(state=state, year=year), sep="|", encoding='ISO-8859-1', usecols=[5])
+
+    df.columns=['zip']
     
     counts = df.zip.value_counts().rename_axis('zip').reset_index(name='counts_'+year)
     counts.zip = counts.zip.apply(pd.to_numeric, errors='coerce')
@@ -66,13 +101,231 @@ def get_paid_prep_count(state='ak', year='2017'):
     
     return counts
 
-def zip_to_county(df, year='2017'):
+def _get_paid_prep_count_job(job):
+
+    '''
+    Unpacks a (state, year, use_cache) tuple for get_paid_prep_count so it can be mapped over
+    a process pool. Returns the counts and the stage records of the call.
+    '''
+
+    state, year, use_cache = job
+
+    # stage records made in a worker process are sent back with its result
+    start = len(RECORDS.get())
+    counts = get_paid_prep_count(state=state, year=year, use_cache=use_cache)
+
+    return counts, RECORDS.get()[start:]
+
+@instrument
+def get_paid_prep_counts(states, years=['2017', '2021'], n_workers=None, use_cache=True):
+
+    '''
+    Runs get_paid_prep_count for every state/year combination on a pool of worker processes.
+
+    inputs:
+        states: list of U.S. states to load
+        years: list of years to load
+        n_workers: number of worker processes. None uses every available core; 1 reads the
+        files one after another in the current process.
+        use_cache: if False, re-reads the raw listings instead of using the on-disk cache
+
+    outputs:
+        counts: dictionary keyed by year, each entry a list of zipcode-level count dataframes
+        in the same order as states
+    '''
+
+    jobs = [(state, year, use_cache) for year in years for state in states]
+
+    if n_workers == 1:
+        frames = [_get_paid_prep_count_job(job)[0] for job in jobs]
+    else:
+        with project_executor(max_workers=n_workers) as executor:
+            results = list(executor.map(_get_paid_prep_count_job, jobs))
+        frames = [frame for frame, _ in results]
+        RECORDS.get().extend(record for _, records in results for record in records)
+
+    counts = {year: [] for year in years}
+
+    for (state, year, _), frame in zip(jobs, frames):
+        counts[year].append(frame)
+
+    return counts
+
+def build_zip_counts(frames, year='2017', report_memory=False):
+
+    '''
+    Combines per-state zipcode-level preparer counts into a single zipcode-level dataframe.
+    Rather than concatenating the frames one at a time, each frame is added into a dense 
+    array indexed by 5-digit zipcode with np.bincount, so memory use stays flat no matter how 
+    many states or territories are added. Zipcodes that are not valid 5-digit integers cannot
+    match the zip-county crosswalk and are dropped.
+
+    inputs:
+        frames: list of dataframes with columns 'zip' and 'counts_<year>', as returned by 
+        get_paid_prep_count
+        year: year associated with the count data
+        report_memory: if True, prints the peak memory allocated while building the output
+
+    outputs:
+        counts: dataframe with one row per zipcode with at least one preparer, with columns 
+        'zip' and 'counts_<year>'
+    '''
+
+    if report_memory:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+    totals = np.zeros(100000)
+
+    for frame in frames:
+        zips = frame['zip'].to_numpy(dtype=float)
+        valid = (zips >= 0) & (zips < 100000) & (zips % 1 == 0)
+        totals += np.bincount(zips[valid].astype(np.int64), 
+                              weights=frame['counts_' + year].to_numpy(dtype=float)[valid], 
+                              minlength=100000)
+
+    zips = np.flatnonzero(totals)
+    counts = pd.DataFrame({'zip': zips, 'counts_' + year: totals[zips]})
+
+    if report_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        if not tracing:
+            tracemalloc.stop()
+        print('peak memory building zip counts for ' + str(year) + ': ' + str(round(peak / 1024**2, 2)) + ' MB')
+
+    return counts
+
+@cached(sources=lambda year, weight: [project_path('data/raw/zip_county_xwalk/ZIP_COUNTY_03' + year + '.csv')])
+def read_xwalk_weights(year='2017', weight=None):
+
+    '''
+    Reads the HUD zip-county crosswalk for the first quarter of a given year and computes 
+    the share of each zipcode allocated to each county. By default zipcodes that span
+    multiple counties are split equally across those counties; alternatively the HUD 
+    residential, business or total address ratios can be used as weights.
+
+    inputs:
+        year: calendar year of the crosswalk
+        weight: None for an equal split, or one of 'res', 'bus', 'tot' to weight by the
+        corresponding HUD address ratio
+    outputs:
+        weights: dataframe with one row per crosswalk entry and columns 'zip', 'county'
+        and 'weight'. the weights of each zipcode sum to one.
+    '''
+
+    ratio = None if weight is None else weight.upper() + '_RATIO'
+
+    zip_cty = pd.read_csv(project_path('data/raw/zip_county_xwalk/ZIP_COUNTY_03' + year + '.csv'), 
+                          usecols = ['ZIP', 'COUNTY'] + ([] if ratio is None else [ratio]))
+   
+    # standardize colnames and dtypes
+    weights = pd.DataFrame({'zip': zip_cty['ZIP'].astype(int), 'county': zip_cty['COUNTY'].astype(int)})
+
+    # equal split across the counties each zipcode spans
+    weights['weight'] = 1 / weights.groupby('zip')['zip'].transform('size')
+
+    if ratio is not None:
+        ratios = zip_cty[ratio].astype(float)
+        totals = ratios.groupby(weights['zip']).transform('sum')
+        # zipcodes with no addresses in the HUD data keep the equal split
+        weights['weight'] = (ratios / totals).where(totals > 0, weights['weight'])
+
+    return weights
+
+def get_xwalk_matrix(year='2017', weight=None, use_cache=True):
+
+    '''
+    Compiles the zip-county crosswalk into a sparse county-by-zipcode allocation matrix, so
+    that any zipcode-level vector can be allocated to counties with a single matrix-vector 
+    product. Matrices are kept in memory after the first call, keyed on the crosswalk
+    file's path and modification time, so a changed file or another project root builds
+    a new matrix.
+
+    inputs:
+        year: calendar year of the crosswalk
+        weight: None for an equal split, or one of 'res', 'bus', 'tot' (see read_xwalk_weights)
+        use_cache: if False, re-reads the crosswalk instead of using the on-disk cache
+    outputs:
+        matrix: scipy.sparse csr matrix with one row per county and one column per zipcode
+        zips: sorted array of the zipcodes labelling the columns
+        counties: sorted array of the county FIPS codes labelling the rows
+    '''
+
+    path = project_path('data/raw/zip_county_xwalk/ZIP_COUNTY_03' + year + '.csv')
+
+    return _xwalk_matrix(path, os.stat(path).st_mtime_ns, year=year, weight=weight, use_cache=use_cache)
+
+@functools.lru_cache(maxsize=16)
+def _xwalk_matrix(path, mtime_ns, year='2017', weight=None, use_cache=True):
+
+    '''
+    Builds the allocation matrix for get_xwalk_matrix. path and mtime_ns only key the
+    in-memory cache; the crosswalk is read for the current project.
+    '''
+
+    from scipy import sparse
+
+    weights = read_xwalk_weights(year=year, weight=weight, use_cache=use_cache)
+
+    zips, zip_idx = np.unique(weights['zip'].to_numpy(), return_inverse=True)
+    counties, county_idx = np.unique(weights['county'].to_numpy(), return_inverse=True)
+
+    # duplicate zip-county entries are summed when converting to csr
+    matrix = sparse.coo_matrix((weights['weight'].to_numpy(), (county_idx, zip_idx)), 
+                               shape=(len(counties), len(zips))).tocsr()
+
+    return matrix, zips, counties
+
+# drops every in-memory matrix, e.g. to time rebuilding them
+get_xwalk_matrix.cache_clear = _xwalk_matrix.cache_clear
+
+def allocate_to_county(df, columns=None, year='2017', weight=None, use_cache=True):
+
+    '''
+    Allocates zipcode-level measures to counties using the sparse crosswalk matrix from
+    get_xwalk_matrix. All columns are allocated at once with one sparse matrix product.
+    Zipcodes missing from the crosswalk are dropped; crosswalk zipcodes missing from df 
+    count as zero.
+
+    inputs:
+        df: zipcode-level dataframe with column 'zip'. rows with the same zipcode are summed.
+        columns: list of columns to allocate. None allocates every column other than 'zip'.
+        year: calendar year of the crosswalk
+        weight: None for an equal split, or one of 'res', 'bus', 'tot' (see read_xwalk_weights)
+        use_cache: if False, re-reads the crosswalk instead of using the on-disk cache
+    outputs:
+        county_df: dataframe with column 'county' and the allocated columns, with one row
+        per county in the crosswalk
+    '''
+
+    if columns is None:
+        columns = [x for x in df.columns if x != 'zip']
+
+    matrix, zips, counties = get_xwalk_matrix(year=year, weight=weight, use_cache=use_cache)
+
+    # scatter zip-level values into the crosswalk's zipcode order
+    pos = np.searchsorted(zips, df['zip'].to_numpy())
+    pos = np.minimum(pos, len(zips) - 1)
+    found = zips[pos] == df['zip'].to_numpy()
+
+    values = np.zeros((len(zips), len(columns)))
+    np.add.at(values, pos[found], df.loc[found, columns].to_numpy(dtype=float))
+
+    county_df = pd.DataFrame(matrix @ values, columns=columns)
+    county_df.insert(0, 'county', counties)
+
+    return county_df
+
+@instrument
+def zip_to_county(df, year='2017', weight=None, use_cache=True):
 
     '''
     function which takes as input a dataframe with zipcode-level count data
     and outputs a dataframe with county-level count data. In cases where zipcodes
     span multiple counties, the function divides the counted object equally across
-    counties.
+    counties, or by the HUD address ratios if weight is given.
 
     NOTE: Connecticut and Alaska changed some or all of their county definitions during the
     sample period. While SOI data have been updated to reflect these new definitions, most 
@@ -82,39 +335,15 @@ def zip_to_county(df, year='2017'):
     inputs: 
         df: zipcode-level data
         year: calendar year associated with zipcode-level data
+        weight: None for an equal split, or one of 'res', 'bus', 'tot' (see read_xwalk_weights)
+        use_cache: if False, re-reads the crosswalk instead of using the on-disk cache
 
     outputs:
         df: county-level data
     '''
     
-    # dedupe zip level data
-    df = df.groupby('zip').sum().reset_index()
-    
-    # read in zip-county crosswalk
-    zip_cty = pd.read_csv('../../data/raw/zip_county_xwalk/ZIP_COUNTY_03'+year+'.csv', usecols = ['ZIP', 'COUNTY'])
-   
-    # standardize colnames and dtypes
-    zip_cty = zip_cty.rename(columns={'ZIP': 'zip'})
-    zip_cty['zip'] = zip_cty['zip'].astype(int)
-    
-    # merge zip/county data, using zip_county crosswalk as left dataset (not all zipcodes have preparers)
-    df = zip_cty.merge(df, how='left', on='zip', validate='m:1')
-    
-    df['counts_'+year] = df['counts_'+year].fillna(0)
-    
-    # create duplicate column for groupby
-    df['zip_dupe'] = df['zip']
-    
-    # merge in grouped zip data
-    df = df.merge(df[['zip', 'zip_dupe']].groupby('zip').count().reset_index().rename(columns={'zip_dupe': 'zip_count'}), how='left')
-    
-    # allocate preparers evenly across zipcodes that span multiple counties
-    df['counts_'+year] = df['counts_'+year] / df['zip_count']
-    
-    # group data by county and sum
-    df = df[['COUNTY', 'counts_'+year]].groupby('COUNTY').sum().reset_index()
-
-    df = df.rename(columns={'COUNTY': 'county'})
+    # allocate zip-level counts to counties through the crosswalk
+    df = allocate_to_county(df, columns=['counts_'+year], year=year, weight=weight, use_cache=use_cache)
 
     ct_ak_drops = [2261, 9110, 9120, 9130, 9140, 9150, 9160, 9170, 9180, 9190]
 
@@ -127,7 +356,59 @@ def zip_to_county(df, year='2017'):
 
     return df
 
-def merge_metro(df):
+def county_prep_counts(years=['2017', '2021'], states=['ak'], n_workers=None, xwalk_weight=None, use_cache=True):
+
+    '''
+    Reads the preparer listings for the given years and states and converts them into
+    county-level preparer counts.
+
+    inputs:
+        years: list of years to load
+        states: list of U.S. states to load
+        n_workers: number of worker processes used to read the listings
+        xwalk_weight: None to split zipcodes equally across counties, or one of 'res', 
+        'bus', 'tot' to weight by HUD address ratios
+        use_cache: if False, re-reads the raw files instead of using the on-disk cache
+
+    outputs:
+        dat_dict: dictionary keyed by year of county-level dataframes with columns 'county'
+        and 'counts_<year>'
+    '''
+
+    dat_dict = {}
+
+    # read preparer listings for all states and years in parallel
+    prep_counts = get_paid_prep_counts(states, years=years, n_workers=n_workers, use_cache=use_cache)
+    
+    for year in years:    
+    
+        dat_dict[year] = build_zip_counts(prep_counts[year], year=year, report_memory=True)
+    
+        dat_dict[year] = zip_to_county(dat_dict[year], year=year, weight=xwalk_weight, use_cache=use_cache)
+
+    return dat_dict
+
+@cached(sources=lambda: [project_path('data/raw/urban_rural/Ruralurbancontinuumcodes2023.xlsx')])
+def read_metro():
+
+    '''
+    Reads the USDA 2023 rural-urban continuum codes and classifies each county as urban or not.
+
+    inputs: None
+    outputs:
+        metro: dataframe with columns 'county', 'RUCC_2023' and 'urban'
+    '''
+
+    metro = pd.read_excel(project_path('data/raw/urban_rural/Ruralurbancontinuumcodes2023.xlsx'), usecols=['FIPS', 'RUCC_2023'])
+    
+    metro = metro.rename(columns={"FIPS": 'county'})
+    
+    metro['urban'] = [1 if x==1 or x==2 or x==3 else 0 for x in metro.RUCC_2023]
+
+    return metro
+
+@instrument
+def merge_metro(df, use_cache=True):
     
     '''
     Function which takes as input a dataframe with county FIPS codes and outputs
@@ -136,70 +417,51 @@ def merge_metro(df):
 
     input: 
         df: dataframe with column called "county" containing county FIPS codes
+        use_cache: if False, re-reads the continuum codes instead of using the on-disk cache
     output:
         df: dataframe with USDA rural-urban continuum codes stored as column 'RUCC_2023', 
         along with binary classification of county as "urban" or not based on these 
         continuum codes. 
     '''
 
-    metro = pd.read_excel("../../data/raw/urban_rural/Ruralurbancontinuumcodes2023.xlsx", usecols=['FIPS', 'RUCC_2023'])
-    
-    metro = metro.rename(columns={"FIPS": 'county'})
-    
-    metro['urban'] = [1 if x==1 or x==2 or x==3 else 0 for x in metro.RUCC_2023]
+    metro = read_metro(use_cache=use_cache)
     
     df = df.merge(metro, how='left', on='county')
     
     return df
 
-def merge_demog(df):
-    
-    '''
-    Function that merges county-level demographic data from the Census 2021 5-year ACS
-    into existing dataframe.
+@cached(sources=lambda: [project_path('data/raw/census/census_5yr_acs_2021.csv'), 
+                          project_path('data/raw/census/census_econ_2021.csv'), 
+                          project_path('data/raw/census/census_educ_2021.csv'), 
+                          project_path('data/raw/census/census_marriage_2021.csv')])
+def read_demog():
 
-    input:
-        df: dataframe with county-level FIPS codes stored as column 'county'
+    '''
+    Reads the Census 2021 5-year ACS demographic, economic, education and marriage tables
+    and derives the county-level variables merged in by merge_demog.
 
+    inputs: None
     output:
-        df: dataframe with following columns:
-            'county': 5-digit FIPS county code
-            'share_black': percent share of total county residents who are black
-            'maj_black': 1-0 indicator of whether total county is majority black
-            'share_hisp': percent share of total county residents who are hispanic
-            'maj_hisp': 1-0 indicator of whether total county is majority hispanic
-            'share_male': percentage share of total county residents who are male
-            'adult_pop': number of county residents who are over the age of 20
-            'tot_pop': total county population
-            'share_elderly': percentage share of county residents over 65
-            'child_pop': number of county residents under the age of 20
-            'share_college': percentage share of county residents 18+ with bachelor's degree
-            'r_lfp': share of county residents 16+ in labor force
-            'r_unemp': share of civilian workforce 16+ who are unemployed
-            'median_hh_inc': median county-level household income in 2021 dollars
-            'r_marriage': percentage share of county residents 15+ who are married
-            'hh_inc_pct': percentile rankings of median hh income for in-sample counties
-
+        acs: dataframe with one row per county, with columns 'county', 'share_black', 
+        'maj_black', 'share_hisp', 'maj_hisp', 'share_male', 'adult_pop', 'tot_pop', 
+        'share_elderly', 'child_pop', 'share_college', 'r_lfp', 'r_unemp', 'median_hh_inc'
+        and 'r_marriage'
     '''
 
     # load Census ACS files
-    demog = pd.read_csv('../../data/raw/census/census_5yr_acs_2021.csv', skiprows=[0])
-    econ = pd.read_csv('../../data/raw/census/census_econ_2021.csv', skiprows=[0])
-    educ = pd.read_csv('../../data/raw/census/census_educ_2021.csv', skiprows=[0])
-    marriage = pd.read_csv('../../data/raw/census/census_marriage_2021.csv', skiprows=[0])
+    demog = pd.read_csv(project_path('data/raw/census/census_5yr_acs_2021.csv'), skiprows=[0])
+    econ = pd.read_csv(project_path('data/raw/census/census_econ_2021.csv'), skiprows=[0])
+    educ = pd.read_csv(project_path('data/raw/census/census_educ_2021.csv'), skiprows=[0])
+    marriage = pd.read_csv(project_path('data/raw/census/census_marriage_2021.csv'), skiprows=[0])
 
     # clean/standardize Census 'county' labels
-    demog['county'] = [x[-5:] for x in demog.Geography]
-    demog.county = demog.county.astype(int)
+    demog['county'] = parse_geo_fips(demog.Geography)
 
-    econ['county'] = [x[-5:] for x in econ.Geography]
-    econ.county = econ.county.astype(int)
+    econ['county'] = parse_geo_fips(econ.Geography)
 
-    educ['county'] = [x[-5:] for x in educ.Geography]
-    educ.county = educ.county.astype(int)
+    educ['county'] = parse_geo_fips(educ.Geography)
 
-    marriage['county'] = [x[-5:] for x in marriage.Geography]
-    marriage.county = marriage.county.astype(int)
+    marriage['county'] = parse_geo_fips(marriage.Geography)
 
     # define demographic variables
     demog['share_black'] = demog["Estimate!!Race alone or in combination with one or more other races!!Total population!!Black or African American"]/demog['Estimate!!SEX AND AGE!!Total population']
@@ -212,28 +474,62 @@ def merge_demog(df):
     demog['share_elderly'] = (demog["Estimate!!SEX AND AGE!!Total population!!65 to 74 years"]+ demog["Estimate!!SEX AND AGE!!Total population!!75 to 84 years"]+ demog["Estimate!!SEX AND AGE!!Total population!!85 years and over"]) / demog['tot_pop']
     demog['child_pop'] = demog['tot_pop'] - demog['adult_pop']
 
-    # merge demographic variables to output dataframe
-    df = df.merge(demog[['county', 'share_black', 'maj_black', 'share_hisp', 'maj_hisp', 'share_male', 'adult_pop', 'tot_pop', 'share_elderly', 'child_pop']], on='county', how='left', validate='1:1')
-
     # define education variables
     educ['share_college'] = (educ["Estimate!!Total!!AGE BY EDUCATIONAL ATTAINMENT!!Population 18 to 24 years!!Bachelor's degree or higher"] + educ["Estimate!!Total!!AGE BY EDUCATIONAL ATTAINMENT!!Population 25 years and over!!Bachelor's degree or higher"]) / (educ['Estimate!!Total!!AGE BY EDUCATIONAL ATTAINMENT!!Population 18 to 24 years'] + educ['Estimate!!Total!!AGE BY EDUCATIONAL ATTAINMENT!!Population 25 years and over']) 
 
-    # merge education variables to output dataframe
-    df = df.merge(educ[['county', 'share_college']], on='county', how='left', validate='1:1')
-
     # define economic variables
     econ['r_lfp'] = econ["Percent!!EMPLOYMENT STATUS!!Population 16 years and over!!In labor force"]
     econ['r_unemp'] = econ["Percent!!EMPLOYMENT STATUS!!Population 16 years and over!!In labor force!!Civilian labor force!!Unemployed"]
     econ['median_hh_inc'] = econ["Estimate!!INCOME AND BENEFITS (IN 2021 INFLATION-ADJUSTED DOLLARS)!!Total households!!Median household income (dollars)"]
 
-    # merge economic variables to output dataframe
-    df = df.merge(econ[['county', 'r_lfp', 'r_unemp', 'median_hh_inc']], on='county', how='left', validate='1:1')
-
     # define marriage variables
     marriage['r_marriage'] = marriage["Estimate!!Now married (except separated)!!Population 15 years and over"]/100
 
-    # merge marriage variables to output dataframe
-    df = df.merge(marriage[['county', 'r_marriage']], on='county', how='left', validate='1:1')
+    # combine ACS variables into one county-level dataframe
+    acs = demog[['county', 'share_black', 'maj_black', 'share_hisp', 'maj_hisp', 'share_male', 'adult_pop', 'tot_pop', 'share_elderly', 'child_pop']]
+    acs = acs.merge(educ[['county', 'share_college']], on='county', how='outer', validate='1:1')
+    acs = acs.merge(econ[['county', 'r_lfp', 'r_unemp', 'median_hh_inc']], on='county', how='outer', validate='1:1')
+    acs = acs.merge(marriage[['county', 'r_marriage']], on='county', how='outer', validate='1:1')
+
+    return acs
+
+@instrument
+def merge_demog(df, use_cache=True):
+    
+    '''
+    Function that merges county-level demographic data from the Census 2021 5-year ACS
+    into existing dataframe.
+
+    input:
+        df: dataframe with county-level FIPS codes stored as column 'county'
+        use_cache: if False, re-reads the ACS files instead of using the on-disk cache
+
+    output:
+        df: dataframe with following columns:
+            'county': 5-digit FIPS county code
+            'share_black': percent share of total county residents who are black
+            'maj_black': 1-0 indicator of whether total county is majority black
+            'share_hisp': percent share of total county residents who are hispanic
+            'maj_hisp': 1-0 indicator of whether total county is majority hispanic
+            'share_male': percentage share of total county residents who are male
+            'adult_pop': number of county residents who are over the age of 20
+            'tot_pop': total county population
+            'share_elderly': percentage share of county residents over 65
+            'child_pop': number of county residents under the age of 20
+            'share_college': percentage share of county residents 18+ with bachelor's degree
+            'r_lfp': share of county residents 16+ in labor force
+            'r_unemp': share of civilian workforce 16+ who are unemployed
+            'median_hh_inc': median county-level household income in 2021 dollars
+            'r_marriage': percentage share of county residents 15+ who are married
+            'hh_inc_pct': percentile rankings of median hh income for in-sample counties
+
+    '''
+
+    # load Census ACS variables
+    acs = read_demog(use_cache=use_cache)
+
+    # merge ACS variables to output dataframe
+    df = df.merge(acs, on='county', how='left', validate='1:1')
 
     # final data cleaning/feature generation
     df.median_hh_inc = pd.to_numeric(df.median_hh_inc, errors='coerce')
@@ -245,23 +541,133 @@ def get_cfips(df):
 
     '''
     function that converts 2-digit state FIPS and 3-digit county FIPS code columns into a single
-    column containing 5-digit county FIPS codes. 
+    column containing 5-digit county FIPS codes, computed as state * 1000 + county.
 
     input:
         df: dataframe with separate columns STATEFIPS and COUNTYFIPS that may be stored as 
         strings, floats, or integers.
     output: 
         df: dataframe with column 'county' containing 5-digit county FIPS codes stored as integers.
+        STATEFIPS and COUNTYFIPS are converted to integers.
     '''
     
-    df.STATEFIPS =[x.zfill(2) for x in df.STATEFIPS.astype(str)]
-    df.COUNTYFIPS = [x.zfill(3) for x in df.COUNTYFIPS.astype(str)]
-    df['county'] = [x + y for x, y in zip(df.STATEFIPS.astype(str), df.COUNTYFIPS.astype(str))]
-    df.county = df.county.astype(int)
+    df['STATEFIPS'] = pd.to_numeric(df.STATEFIPS).astype(int)
+    df['COUNTYFIPS'] = pd.to_numeric(df.COUNTYFIPS).astype(int)
+    df['county'] = df.STATEFIPS * 1000 + df.COUNTYFIPS
     
     return df
 
-def merge_soi(df):
+def parse_geo_fips(geography):
+
+    '''
+    function that extracts 5-digit county FIPS codes from Census 'Geography' identifiers
+    such as '0500000US01001'. The identifiers are viewed as a fixed-width byte array and the 
+    last five digits are combined arithmetically, avoiding a Python-level loop and string 
+    to integer parsing.
+
+    input:
+        geography: series of Census geography identifiers ending in the county FIPS code
+    output:
+        county: series of 5-digit county FIPS codes stored as integers
+    '''
+
+    codes = geography.to_numpy(dtype='S')
+    width = codes.dtype.itemsize
+
+    # identifiers of different lengths do not line up in a fixed-width array
+    if width < 5 or (np.char.str_len(codes) != width).any():
+        return geography.str[-5:].astype(int)
+
+    digits = codes.view('u1').reshape(-1, width)[:, -5:].astype(np.int64) - ord('0')
+
+    if ((digits < 0) | (digits > 9)).any():
+        raise ValueError('Geography identifiers must end in a 5-digit county FIPS code')
+
+    return pd.Series(digits @ np.array([10000, 1000, 100, 10, 1]), index=geography.index)
+
+def make_state_indicators(statefips, prefix='state_ind_', as_sparse=False):
+
+    '''
+    function that builds 1-0 indicators for every state in a column of state FIPS codes as a
+    single block, rather than adding one column at a time. Concatenate the result onto the
+    source dataframe in one step.
+
+    input:
+        statefips: series of integer state FIPS codes
+        prefix: prefix of the indicator column names. columns are named prefix plus the 
+        zero-padded 2-digit FIPS code, e.g. 'state_ind_02'
+        as_sparse: if True, returns sparse uint8 columns, which store only the nonzero entries
+    output:
+        indicators: dataframe of uint8 indicators with the same index as statefips, with one
+        column per state in ascending FIPS order
+    '''
+
+    states = pd.Categorical(statefips)
+    codes = states.codes
+    columns = [prefix + str(int(x)).zfill(2) for x in states.categories]
+
+    # one nonzero entry per row, in the column of that row's state
+    rows = np.flatnonzero(codes >= 0)
+
+    if as_sparse:
+        from scipy import sparse
+        matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.uint8), (rows, codes[rows])), 
+                                   shape=(len(codes), len(columns)))
+        indicators = pd.DataFrame.sparse.from_spmatrix(matrix, index=statefips.index, columns=columns)
+    else:
+        matrix = np.zeros((len(codes), len(columns)), dtype=np.uint8)
+        matrix[rows, codes[rows]] = 1
+        indicators = pd.DataFrame(matrix, index=statefips.index, columns=columns)
+
+    return indicators
+
+@cached(sources=lambda file_name: [project_path('data/raw/SOI/' + file_name)])
+def read_soi(file_name='21incyallagi.csv'):
+
+    '''
+    Reads a raw SOI county data file.
+
+    inputs:
+        file_name: name of the file in the raw SOI directory, e.g. '21incyallagi.csv'
+    outputs:
+        df: dataframe with the contents of the SOI file
+    '''
+
+    df = pd.read_csv(project_path('data/raw/SOI/' + file_name), encoding='latin-1')
+
+    return df
+
+@cached(sources=lambda file_name, columns, chunksize: [project_path('data/raw/SOI/' + file_name)])
+def stream_soi(file_name='21incyallagi.csv', columns=['N1'], chunksize=100000):
+
+    '''
+    Reads a raw SOI county-by-AGI-bin file in chunks, keeping only the FIPS codes, the AGI 
+    bin and the requested columns. Each chunk's state totals are dropped and its columns 
+    are summed by county and AGI bin, and the partial sums are combined as chunks are read,
+    so memory is bounded by the number of county-by-bin cells rather than by the file size.
+
+    inputs:
+        file_name: name of the file in the raw SOI directory, e.g. '21incyallagi.csv'
+        columns: list of SOI variables to keep, e.g. ['N1', 'N59660']
+        chunksize: number of rows read at a time
+    outputs:
+        df: dataframe with columns 'county', 'agi_stub' and the requested variables
+    '''
+
+    totals = None
+
+    for chunk in pd.read_csv(project_path('data/raw/SOI/' + file_name), usecols=['STATEFIPS', 'COUNTYFIPS', 'agi_stub'] + columns, 
+                             chunksize=chunksize, encoding='latin-1'):
+
+        chunk = get_cfips(chunk.loc[chunk.COUNTYFIPS != 0].copy())
+        partial = chunk.groupby(['county', 'agi_stub'])[columns].sum()
+
+        totals = partial if totals is None else pd.concat([totals, partial]).groupby(level=['county', 'agi_stub']).sum()
+
+    return totals.reset_index()
+
+@instrument
+def merge_soi(df, use_cache=True):
 
     '''
     Function that merges county-level filing data from SOI into existing dataframe.
@@ -269,10 +675,12 @@ def merge_soi(df):
     input:
         df: dataframe with county-level FIPS codes stored as column 'county'
         (and possibly other variables, 'county' is the minimum requirement)
+        use_cache: if False, re-reads the SOI files instead of using the on-disk cache
     output:
         df_overall: dataframe with the following columns (plus any other columns
         included in input dataframe):
             'county': five-digit county FIPS code
+            'returns(_17)': number of returns filed (N1)
             'share_eip': share of filers reporting <=$200k AGI claiming EIP in TY21
             'mean_eip': per-county average EIP claim amount
             'eip_amount': total EIP spend per county
@@ -287,67 +695,70 @@ def merge_soi(df):
             'mean_ctc_dif': First difference of mean CTC claim amts between TY21, TY17
             'share_eitc_dif': First difference of share of tps claiming EITC between TY21, TY17
             'mean_eitc_dif': First difference of mean EITC claim amts between TY21, TY17
+            'state_ind_<fips>': 1-0 indicator for each 2-digit state FIPS code
+        df_agi: county-by-agi-bin dataframe with columns 'county', 'agi_stub', the TY21 
+        variables named in 'agi_bin_dict' of the config file, and the TY17 variables named in
+        'agi_17_bin_dict' (suffixed '_17')
     '''
 
     # load data config file
     out = load_config()
       
-    # load aggregate and agi-level SOI data
-    overall = pd.read_csv('../../data/raw/SOI/21incyallnoagi.csv', encoding='latin-1')
-    overall_17 = pd.read_csv('../../data/raw/SOI/17incyallnoagi.csv', encoding='latin-1')
-    agi = pd.read_csv('../../data/raw/SOI/21incyallagi.csv', encoding='latin-1')
-    agi_17 = pd.read_csv('../../data/raw/SOI/17incyallagi.csv', encoding='latin-1')
-
-    # get 5-digit county code from state/county fips
-    for df in [overall, overall_17, agi, agi_17]:
-        df = df.loc[df.COUNTYFIPS != 0]
-        df = get_cfips(df)
-    
-    # generate aggregate filing data for agi-restricted tax credits (EITC, EIP)
-    for df in [agi, agi_17]:
+    # load aggregate SOI data
+    overall = read_soi('21incyallnoagi.csv', use_cache=use_cache)
+    overall_17 = read_soi('17incyallnoagi.csv', use_cache=use_cache)
+
+    # get 5-digit county code from state/county fips, dropping state totals
+    overall, overall_17 = [get_cfips(x.loc[x.COUNTYFIPS != 0].copy()) for x in [overall, overall_17]]
+
+    # stream agi-level SOI data, reading only the variables used below and in the agi bin dictionaries
+    agi = stream_soi('21incyallagi.csv', 
+                     columns=list(dict.fromkeys(['N1', 'N10971', 'N59660', 'A59660', 'RAC'] + list(out['agi_bin_dict'].values()))), 
+                     use_cache=use_cache)
+    agi_17 = stream_soi('17incyallagi.csv', 
+                        columns=list(dict.fromkeys(['N1', 'N59660', 'A59660', 'RAC'] + list(out['agi_17_bin_dict'].values()))), 
+                        use_cache=use_cache)
+
+    # generate aggregate filing data for filers reporting <=$200k agi (EIP)
+    agi_temp = agi.loc[agi.agi_stub<=7, ['county', 'N1', 'N10971']].groupby('county').sum()
+    agi_temp = agi_temp.reset_index()
+
+    agi_temp['share_eip'] = agi_temp.N10971/agi_temp.N1
 
-        if df == agi:
-            year=""
-        elif df == agi_17:
-            year='_17'
+    # generate aggregate filing data for filers reporting <=$75k agi (EITC)
+    agi_eitc = {}
 
-        if df == agi: 
-            agi_temp = df.loc[df.agi_stub<=7]
-            agi_temp = agi_temp['county', 'N1', 'N10971'].groupby('county').sum()
-            agi_temp = agi_temp.reset_index()
+    for year, agi_year in [('', agi), ('_17', agi_17)]:
 
-            agi_temp['share_eip'] = agi_temp.N10971/agi_temp.N1
+        agi_year = agi_year.loc[agi_year.agi_stub<=5, ['county', 'N1', 'N59660', 'A59660', 'RAC']].groupby('county').sum()
+        agi_year = agi_year.reset_index()
 
-        df = df.loc[df.agi_stub<=5]
-        df = df[['county', 'N1', 'N59660', 'A59660', 'RAC']].groupby('county').sum()
-        df = df.reset_index()
+        agi_year['share_eitc_lt_75k'+year] = agi_year.N59660 / agi_year.N1
+        agi_year['mean_eitc'+year] = (agi_year.A59660 / agi_year.N59660) * 1000
+        agi_year['tot_eitc'+year] = agi_year.A59660
 
-        df['share_eitc_lt_75k'+year] = df.N59660 / df.N1
-        df['mean_eitc'+year] = (df.A59660 / df.N59660) * 1000
-        df['tot_eitc'+year] = df.A59660
+        agi_eitc[year] = agi_year
 
     # generate aggregate data for all households
-    for df in [overall, overall_17]:
-        if df == overall:
-            year=""
-            df['eip_amount'] = df.A10971
-            df['mean_eip'] = (df.eip_amount / df.N10971) * 1000
-        elif df == overall_17:
-            year='_17'
+    overall['eip_amount'] = overall.A10971
+    overall['mean_eip'] = (overall.eip_amount / overall.N10971) * 1000
+
+    for year, overall_year in [('', overall), ('_17', overall_17)]:
     
-        df['tot_ctc'+year] = df.A11070
-        df['share_using_pp'+year] = df.PREP / df.N1
-        df['share_ctc'+year] = df.N11070 / df.N1
-        df['mean_ctc'+year] = (df.A11070 / df.N11070) * 1000
+        overall_year['returns'+year] = overall_year.N1
+        overall_year['tot_ctc'+year] = overall_year.A11070
+        overall_year['share_using_pp'+year] = overall_year.PREP / overall_year.N1
+        overall_year['share_ctc'+year] = overall_year.N11070 / overall_year.N1
+        overall_year['mean_ctc'+year] = (overall_year.A11070 / overall_year.N11070) * 1000
 
     # merge overall features with features for filers with less than $75K agi
-    overall = overall[['county', 'STATEFIPS', 'tot_ctc', 'eip_amount', 'share_using_pp', 'share_ctc', 'mean_eip', 'mean_ctc']].merge(agi[['county', 'share_eitc_lt_75k', 'mean_eitc', 'tot_eitc']], how='left', on='county', validate='1:1')
+    overall = overall[['county', 'STATEFIPS', 'returns', 'tot_ctc', 'eip_amount', 'share_using_pp', 'share_ctc', 'mean_eip', 'mean_ctc']].merge(agi_eitc[''][['county', 'share_eitc_lt_75k', 'mean_eitc', 'tot_eitc']], how='left', on='county', validate='1:1')
     
-    overall = overall.merge(agi_17[['county', 'share_eitc_lt_75k_17', 'mean_eitc_17', 'tot_eitc_17']], how='left', on='county', validate='1:1')
+    overall = overall.merge(agi_eitc['_17'][['county', 'share_eitc_lt_75k_17', 'mean_eitc_17', 'tot_eitc_17']], how='left', on='county', validate='1:1')
     
     overall = overall.merge(agi_temp[['county', 'share_eip']], how='left', on='county', validate='1:1')
 
-    overall = overall.merge(overall_17[['county', 'share_ctc_17', 'mean_ctc_17', 'tot_ctc_17', 'share_using_pp_17']], how='left', on='county', validate='1:1')
+    overall = overall.merge(overall_17[['county', 'returns_17', 'share_ctc_17', 'mean_ctc_17', 'tot_ctc_17', 'share_using_pp_17']], how='left', on='county', validate='1:1')
 
     # merge with base dataset
     df_overall = overall.merge(df, how='left', on='county', validate='1:1')
@@ -359,47 +770,430 @@ def merge_soi(df):
     df_overall['mean_eitc_dif'] = (df_overall.mean_eitc - df_overall.mean_eitc_17*out['infl_mpl'])
 
     # generate state indicators
-    for state in df_overall.STATEFIPS.unique().tolist():
-         df_overall['state_ind_' + str(state)] = [1 if x == state else 0 for x in df_overall.STATEFIPS]
+    df_overall = pd.concat([df_overall, make_state_indicators(df_overall.STATEFIPS)], axis=1)
+
+    # county-by-agi-bin data, with columns named as in the agi bin dictionaries of the config file
+    df_agi = agi[['county', 'agi_stub'] + list(out['agi_bin_dict'].values())]
+    df_agi = df_agi.rename(columns={v: k for k, v in out['agi_bin_dict'].items()})
+
+    agi_17 = agi_17[['county', 'agi_stub'] + list(out['agi_17_bin_dict'].values())]
+    agi_17 = agi_17.rename(columns={v: k + '_17' for k, v in out['agi_17_bin_dict'].items()})
+
+    df_agi = df_agi.merge(agi_17, how='outer', on=['county', 'agi_stub'], validate='1:1')
+
+    return df_overall, df_agi
+
+def panel_year_sources(year, states, xwalk_weight):
+
+    '''
+    Lists the raw files read by build_panel_year for one year.
+    '''
+
+    paths = load_config()['prep_paths']
+
+    return ([get_prep_file_path(state=state, year=year, paths=paths) for state in dict.fromkeys(states)]
+            + [project_path('data/raw/zip_county_xwalk/ZIP_COUNTY_03' + year + '.csv'),
+               project_path('data/raw/SOI/' + year[2:] + 'incyallnoagi.csv'),
+               project_path('data/raw/SOI/' + year[2:] + 'incyallagi.csv')])
+
+# functions whose output the panel years depend on, so that editing them rebuilds cached years
+PANEL_YEAR_DEPENDS = ['county_prep_counts', 'get_paid_prep_counts', '_get_paid_prep_count_job', 'get_paid_prep_count',
+                      'get_prep_file_path', 'build_zip_counts', 'zip_to_county', 'allocate_to_county', 'get_xwalk_matrix',
+                      '_xwalk_matrix', 'read_xwalk_weights', 'read_soi', 'stream_soi', 'get_cfips']
+
+@instrument
+@cached(sources=panel_year_sources, depends=PANEL_YEAR_DEPENDS)
+def build_panel_year(year='2021', states=['ak'], xwalk_weight=None, use_cache=True):
+
+    '''
+    Builds one tax year of the county panel: preparer counts from the IRS listings and 
+    filing measures from that year's SOI county files ('<yy>incyallnoagi.csv' and 
+    '<yy>incyallagi.csv'). Each year is cached on its own, so adding a year to the panel
+    only processes the new year; editing one of the functions in PANEL_YEAR_DEPENDS 
+    rebuilds every year. EIP measures are missing for years whose SOI files have
+    no EIP fields. Dollar amounts are nominal.
+
+    inputs:
+        year: tax year, e.g. '2021'
+        states: list of U.S. states to load
+        xwalk_weight: None to split zipcodes equally across counties, or one of 'res', 
+        'bus', 'tot' to weight by HUD address ratios
+        use_cache: if False, rebuilds the year and re-reads every raw input it uses
+        instead of using the on-disk cache
+    outputs:
+        df: county-level dataframe with columns 'county', 'year', 'prep_count', 'STATEFIPS', 'returns',
+        'share_using_pp', 'share_ctc', 'mean_ctc', 'tot_ctc', 'share_eitc_lt_75k', 
+        'mean_eitc', 'tot_eitc', 'share_eip', 'mean_eip' and 'eip_amount'
+    '''
+
+    yy = year[2:]
+
+    # preparer counts; year workers run in parallel already, so read the states serially
+    counts = county_prep_counts(years=[year], states=states, n_workers=1, xwalk_weight=xwalk_weight, use_cache=use_cache)[year]
+    counts = counts.rename(columns={'counts_' + year: 'prep_count'})
+
+    overall = read_soi(yy + 'incyallnoagi.csv', use_cache=use_cache)
+    overall = get_cfips(overall.loc[overall.COUNTYFIPS != 0].copy())
+
+    agi_columns = pd.read_csv(project_path('data/raw/SOI/' + yy + 'incyallagi.csv'), nrows=0, encoding='latin-1').columns
+    eip = 'N10971' in agi_columns
+    agi = stream_soi(yy + 'incyallagi.csv', columns=['N1', 'N59660', 'A59660'] + (['N10971'] if eip else []), use_cache=use_cache)
+
+    df = pd.DataFrame({'county': overall.county, 'STATEFIPS': overall.STATEFIPS})
+    df['returns'] = overall.N1
+    df['share_using_pp'] = overall.PREP / overall.N1
+    df['share_ctc'] = overall.N11070 / overall.N1
+    df['mean_ctc'] = (overall.A11070 / overall.N11070) * 1000
+    df['tot_ctc'] = overall.A11070
+
+    # filers reporting <=$75k agi (EITC)
+    eitc = agi.loc[agi.agi_stub<=5, ['county', 'N1', 'N59660', 'A59660']].groupby('county').sum()
+    eitc['share_eitc_lt_75k'] = eitc.N59660 / eitc.N1
+    eitc['mean_eitc'] = (eitc.A59660 / eitc.N59660) * 1000
+    eitc['tot_eitc'] = eitc.A59660
+    df = df.merge(eitc[['share_eitc_lt_75k', 'mean_eitc', 'tot_eitc']], how='left', left_on='county', right_index=True, validate='1:1')
+
+    # filers reporting <=$200k agi (EIP)
+    if eip:
+        eip_agi = agi.loc[agi.agi_stub<=7, ['county', 'N1', 'N10971']].groupby('county').sum()
+        df = df.merge((eip_agi.N10971 / eip_agi.N1).rename('share_eip'), how='left', left_on='county', right_index=True, validate='1:1')
+        df['mean_eip'] = ((overall.A10971 / overall.N10971) * 1000).to_numpy()
+        df['eip_amount'] = overall.A10971.to_numpy()
+    else:
+        df['share_eip'] = np.nan
+        df['mean_eip'] = np.nan
+        df['eip_amount'] = np.nan
+
+    df = counts.merge(df, how='outer', on='county', validate='1:1')
+    df.insert(1, 'year', int(year))
+
+    return df.astype({'county': 'int32', 'year': 'int16', 'STATEFIPS': 'Int8', 'returns': 'float64', 'tot_ctc': 'float64', 
+                      'tot_eitc': 'float64', 'eip_amount': 'float64'})
+
+def _build_panel_year_job(job):
+
+    '''
+    Builds one year of the panel. Runs in a worker process, and returns the year's frame
+    and its stage records.
+    '''
+
+    year, states, xwalk_weight, use_cache = job
+
+    start = len(RECORDS.get())
+    df = build_panel_year(year=year, states=states, xwalk_weight=xwalk_weight, use_cache=use_cache)
+
+    return df, RECORDS.get()[start:]
+
+def build_panel(years=None, n_workers=None, use_cache=True, write_csv=False):
+
+    '''
+    Builds the long county-by-year panel for the years listed under 'panel_years' in the
+    config file, processing years in parallel, and writes it to 
+    'data/clean/dat_panel.feather'. Each year is cached separately (see 
+    build_panel_year), so only new or changed years are rebuilt.
+
+    inputs:
+        years: list of tax years. None uses 'panel_years' from the config file.
+        n_workers: number of worker processes. None uses the number of cores; 1 builds 
+        the years in this process.
+        use_cache: if False, every year is rebuilt from the raw files
+        write_csv: if True, also writes a .csv copy
+    outputs:
+        panel: dataframe with one row per county and year, sorted by county and year
+    '''
+
+    out = load_config()
+    years = out['panel_years'] if years is None else years
+
+    jobs = [(str(year), out['states'], out['xwalk_weight'], use_cache) for year in years]
+
+    if n_workers == 1:
+        frames = [_build_panel_year_job(job)[0] for job in jobs]
+    else:
+        with project_executor(max_workers=n_workers) as executor:
+            results = list(executor.map(_build_panel_year_job, jobs))
+        frames = [frame for frame, _ in results]
+        RECORDS.get().extend(record for _, records in results for record in records)
+
+    panel = pd.concat(frames, ignore_index=True).sort_values(['county', 'year'], ignore_index=True)
+
+    write_clean_data(panel, name='dat_panel', write_csv=write_csv)
+
+    return panel
+
+def apply_schema(df, dtypes=None):
+
+    '''
+    Casts columns to the compact dtypes declared under 'clean_dtypes' in the config file
+    (e.g. uint8 flags, int32 FIPS codes, a categorical state code, float32 shares). Keys
+    are column names or patterns such as 'state_ind_*', checked in order; columns that 
+    match no key keep their dtype. Integer columns with missing values are stored as 
+    floats instead. Columns declared as integers which hold fractional values (e.g. 
+    counts allocated with crosswalk weights) or values outside the range of the declared
+    type keep their dtype, so the cast never truncates or wraps values.
+
+    inputs:
+        df: dataframe
+        dtypes: dictionary of column patterns and dtypes. None reads 'clean_dtypes' from 
+        the config file.
+    outputs:
+        df: dataframe with the declared dtypes
+    '''
+
+    dtypes = load_config()['clean_dtypes'] if dtypes is None else dtypes
+
+    casts = {}
+
+    for column in df.columns:
+
+        dtype = next((dtype for pattern, dtype in dtypes.items() if fnmatch.fnmatchcase(column, pattern)), None)
+
+        if dtype is None or str(df[column].dtype) == dtype:
+            continue
+
+        if dtype != 'category' and np.issubdtype(np.dtype(dtype), np.integer):
+
+            # only whole numbers within the range of the integer type are cast
+            values = df[column].dropna()
+            if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values) and len(values) > 0:
+                info = np.iinfo(dtype)
+                if not ((values % 1 == 0).all() and values.min() >= info.min and values.max() <= info.max):
+                    print('keeping ' + column + ' as ' + str(df[column].dtype) + ': values are not whole numbers within the range of ' + dtype)
+                    continue
+
+            if df[column].isna().any():
+                dtype = 'float32' if np.dtype(dtype).itemsize <= 2 else 'float64'
+
+        casts[column] = dtype
+
+    return df.astype(casts) if casts else df
+
+def memory_report(df, stage):
+
+    '''
+    Prints the size and memory use of a dataframe after a stage of the data cleaning.
+
+    inputs:
+        df: dataframe
+        stage: name of the stage, for the printed line
+    outputs:
+        size: memory use in bytes
+    '''
+
+    size = int(df.memory_usage(deep=True).sum())
 
-    return df_overall
+    print('memory after ' + stage + ': ' + str(df.shape[0]) + ' rows x ' + str(df.shape[1]) + ' columns, ' 
+          + str(np.round(size / 1024**2, 2)) + ' MB')
 
-def clean_data():
+    return size
+
+@instrument
+def write_clean_data(df, name='dat_clean', write_csv=False):
+
+    '''
+    Writes a clean data file in Arrow IPC (Feather v2) format, with the compact dtypes
+    declared in the config file (see apply_schema). The file is stored uncompressed so 
+    that it can be memory-mapped and read without copying. 
+
+    inputs:
+        df: dataframe to write
+        name: file name, without extension, in the clean data directory
+        write_csv: if True, also writes a .csv copy for sharing
+    outputs: None
+    '''
+
+    df = apply_schema(df.reset_index(drop=True))
+    memory_report(df, 'clean_dtypes (' + name + ')')
+
+    df.to_feather(project_path('data/clean/' + name + '.feather'), compression='uncompressed')
+
+    if write_csv:
+        df.to_csv(project_path('data/clean/' + name + '.csv'), index=False)
+
+    return None
+
+def load_clean_data(columns=None, name='dat_clean'):
+
+    '''
+    Loads a clean data file written by write_clean_data. The file is memory-mapped, so only
+    the requested columns are read from disk, and numeric columns without missing values 
+    are not copied. Columns have the dtypes declared in the config file (see apply_schema).
+
+    inputs:
+        columns: list of columns to load. None loads every column.
+        name: file name, without extension, in the clean data directory
+    outputs:
+        df: dataframe with the requested columns
+    '''
+
+    from pyarrow import feather
+
+    if columns is not None:
+        columns = list(dict.fromkeys(columns))
+
+    table = feather.read_table(project_path('data/clean/' + name + '.feather'), columns=columns, memory_map=True)
+
+    # files written before the schema was declared are cast on load
+    return apply_schema(table.to_pandas(split_blocks=True))
+
+def clean_data_columns(name='dat_clean'):
+
+    '''
+    Lists the columns of a clean data file written by write_clean_data, reading only the
+    file's schema.
+
+    inputs:
+        name: file name, without extension, in the clean data directory
+    outputs:
+        columns: list of column names
+    '''
+
+    import pyarrow as pa
+    from pyarrow import ipc
+
+    with ipc.open_file(pa.memory_map(project_path('data/clean/' + name + '.feather'))) as reader:
+        return reader.schema.names
+
+def regression_columns(out, outcomes=[], absorb=[]):
+
+    '''
+    Lists the columns of the clean data used by the first-stage and second-stage 
+    regressions defined in the config file.
+
+    inputs:
+        out: config dictionary returned by load_config
+        outcomes: list of second-stage outcomes
+        absorb: list of grouping columns for absorbed fixed effects
+    outputs:
+        columns: list of column names, without duplicates
+    '''
+
+    return [x for x in dict.fromkeys(list(outcomes) + list(absorb) + out.columns['regs']) if x != 'const']
+
+def clean_data(use_cache=True, write_csv=False, n_workers=None):
     """
     Wrapper function that imports, cleans, and writes out data for analysis.
 
-    inputs: None
+    inputs:
+        use_cache: if False, every raw input is re-read instead of loaded from the 
+        on-disk cache in data/cache/
+        write_csv: if True, also writes .csv copies of the clean data files
+        n_workers: number of worker processes reading the preparer listings. None uses
+        'n_workers' from the config file.
     outputs: None
     """
 
-    dat_dict = {}
-
     out = load_config()
     years=['2017', '2021']
-    
-    for year in years:    
-    
-        dat_dict[year] = pd.DataFrame(columns=['zip', 'counts_' + year])
-    
-        for state in out['states']:
-            dat = get_paid_prep_count(state=state, year=year)
-            dat_dict[year] = pd.concat([dat_dict[year], dat], ignore_index=True)
-    
-        dat_dict[year] = zip_to_county(dat_dict[year], year=year)
-
-    df = pd.merge(dat_dict['2021'], dat_dict['2017'], how='left', on='county', validate='1:1')
+    n_workers = out['n_workers'] if n_workers is None else n_workers
 
-    df = merge_metro(df)
-    df = merge_demog(df)
-    df, df_agi = merge_soi(df)
+    dat_dict = county_prep_counts(years=years, states=out['states'], n_workers=n_workers, 
+                                  xwalk_weight=out['xwalk_weight'], use_cache=use_cache)
 
-    df.to_csv('../../data/clean/dat_clean.csv', index=False)
-    df_agi.to_csv('../../data/clean/dat_clean_agi.csv', index=False)
+    df = pd.merge(dat_dict['2021'], dat_dict['2017'], how='left', on='county', validate='1:1')
+    memory_report(df, 'county_prep_counts')
+
+    df = merge_metro(df, use_cache=use_cache)
+    memory_report(df, 'merge_metro')
+    df = merge_demog(df, use_cache=use_cache)
+    memory_report(df, 'merge_demog')
+    df, df_agi = merge_soi(df, use_cache=use_cache)
+    memory_report(df, 'merge_soi')
+    memory_report(df_agi, 'merge_soi (agi bins)')
+
+    write_clean_data(df, name='dat_clean', write_csv=write_csv)
+    write_clean_data(df_agi, name='dat_clean_agi', write_csv=write_csv)
     
     return None
 
+def summarize(df, variables, years={'2021': '', '2017': '_17'}, weights=None, by=None):
+
+    '''
+    Computes county-level means and standard deviations of each variable in each year and
+    of the difference between the first two years, in one vectorized pass: every year's
+    columns and the differences are stacked into one array, and the weighted counts, sums 
+    and sums of squares of every column (and group) come from a single product with a 
+    group indicator matrix. Values are shifted by a reference value per column before 
+    squaring so the variance does not lose precision for large means. Missing values are
+    skipped column by column, as in pandas.
+
+    inputs:
+        df: dataframe of county-level data
+        variables: list of variables, named as in the first year (e.g. the summ_stats key
+        of the config file)
+        years: dictionary of year label to the suffix of that year's columns. variables 
+        without a column for a year are reported as missing for that year.
+        weights: None, or name of a column of frequency weights (e.g. 'returns'). standard
+        deviations use the sum of weights less one as the degrees of freedom, so 
+        unweighted results equal pandas' mean() and std().
+        by: None, or name (or list of names) of columns to group by, e.g. 'urban'
+    outputs:
+        summary: dataframe with columns for each year label and 'difference', and rows 
+        indexed by (stat, variable) for stats 'mean', 'std' and 'nobs', preceded by the 
+        group if by is given
+    '''
+
+    labels = list(years)
+    n, k = len(df), len(variables)
+
+    # one block of columns per year, then the differences between the first two years (missing with one year)
+    values = np.full((n, k * (len(labels) + 1)), np.nan)
+    for j, label in enumerate(labels):
+        for i, x in enumerate(variables):
+            if x + years[label] in df.columns:
+                values[:, j * k + i] = df[x + years[label]].to_numpy(dtype=float)
+    if len(labels) > 1:
+        values[:, -k:] = values[:, :k] - values[:, k:2 * k]
+
+    valid = ~np.isnan(values)
+    w = np.ones(n) if weights is None else df[weights].to_numpy(dtype=float)
+    valid &= ~np.isnan(w)[:, None]
+    w = np.nan_to_num(w)
+
+    # shift each column by its first valid value
+    first = valid.argmax(axis=0)
+    shift = np.where(valid.any(axis=0), values[first, np.arange(values.shape[1])], 0)
+    centered = np.where(valid, values - shift, 0)
+
+    if by is None:
+        codes, groups = np.zeros(n, dtype=int), None
+    else:
+        # rows with a missing group are left out (ngroup numbers them -1)
+        grouped = df.groupby(by, sort=True, observed=True)
+        codes, groups = grouped.ngroup().to_numpy(), list(grouped.size().index)
+
+    from scipy import sparse
+
+    rows = np.flatnonzero(codes >= 0)
+    n_groups = 1 if groups is None else len(groups)
+    members = sparse.csr_matrix((w[rows], (codes[rows], rows)), shape=(n_groups, n))
+    counts = sparse.csr_matrix((np.ones(len(rows)), (codes[rows], rows)), shape=(n_groups, n))
+
+    total = members @ valid.astype(float)
+    sums = members @ centered
+    squares = members @ (centered ** 2)
+    nobs = counts @ valid.astype(float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = shift + sums / total
+        std = np.sqrt(np.maximum(squares - sums ** 2 / total, 0) / (total - 1))
+
+    columns = labels + ['difference']
+    frames = {}
+
+    for g in range(n_groups):
+        stats = {stat: pd.DataFrame(result[g].reshape(len(columns), k).T, index=variables, columns=columns)
+                 for stat, result in [('mean', mean), ('std', std), ('nobs', nobs)]}
+        frames[g if groups is None else groups[g]] = pd.concat(stats)
+
+    return frames[0] if groups is None else pd.concat(frames)
+
 def make_2sls_table(df, 
                     outcome='share_eic',  # outcome of interest
+                    absorb=None,  # fixed effects to absorb
+                    results=None,  # fitted results for each specification
+                    specs=['spec_1', 'spec_2', 'spec_3'],  # specifications, one per column
+                    formats=['tex'],  # output file formats
     ):
 
     '''
@@ -407,222 +1201,74 @@ def make_2sls_table(df,
     standard errors, indications of significance levels, and
     table caption formatted for LaTeX.
 
+    The table has one column per specification and one row per regressor: the endogenous
+    variable of the first specification, then every control (other than the constant) in 
+    the order the specifications add them, labelled from table_labels in the config file.
+
     inputs:
         df: dataframe with outcomes, instruments, endogenous variables, and controls
         outcome: outcome of interest
+        absorb: None, or list of grouping columns (e.g. ['STATEFIPS']) whose fixed effects
+        are absorbed by demeaning within groups before the 2SLS solve (see iv_utils.iv2sls)
+        instead of entering the design matrix as dummies. the table is written to 
+        'ss_<outcome>_fe.tex'.
+        results: None, or list of fitted results for each specification (as returned
+        by make_2sls_tables). if None, the specifications are fit here.
+        specs: list of config prefixes of the specifications, e.g. ['spec_1', 'spec_2']
+        formats: list of file formats to write, out of 'tex', 'txt' and 'csv'
     outputs:
         formatted .tex file with regression output
     '''
     
     out = load_config()
 
-    y = df[outcome]
-    df["const"] = 1
+    if results is None:
+
+        y = df[outcome]
+        df["const"] = 1
+
+        results = []
+
+        for spec in specs:
+
+            if absorb is None:
+                from linearmodels.iv import IV2SLS # for two-stage least squares regressions
+                res = IV2SLS(y, df[out[spec + '_controls']], df[out[spec + '_endog']], df[out[spec + '_inst']]).fit(
+                    cov_type="robust"
+                )
+            else:
+                res = iv2sls(y, df[out[spec + '_controls']], df[out[spec + '_endog']], df[out[spec + '_inst']], 
+                             absorb=df[absorb], cov_type="robust")
+            print(res)
+
+            results.append(res)
 
-    res_second1 = IV2SLS(y, df[out['spec_1_controls']], df[out['spec_1_endog']], df[out['spec_1_inst']]).fit(
-        cov_type="robust"
-    )
-    print(res_second1)
-
-    res_second2 = IV2SLS(y, df[out['spec_2_controls']], df[out['spec_2_endog']], df[out['spec_2_inst']]).fit(
-        cov_type="robust"
-    )
-    print(res_second2)
-
-    res_second3 = IV2SLS(y, df[out['spec_3_controls']], df[out['spec_3_endog']], df[out['spec_3_inst']]).fit(
-        cov_type="robust"
-    )
-    print(res_second3)
-
-    filename = '../../results/tables/ss_'+ outcome +'.txt'
-
-    with open(filename, mode='w') as output:
-
-        print(r"\begin{table}[h!]", file=output)
-        print(r"\begin{center}", file=output)
-        print(r"\caption{Second-stage regression results: RESULT \label{tab:LABEL}}", file=output)
-        print(r"\setlength\tabcolsep{0pt}", file=output)
-        print(r"\begin{tabular*}{\linewidth}{@{\extracolsep{\fill}} lccc }", file=output)
-
-        print(r"Specification & (1) & (2) & (3)  \\", file=output)
-
-        print(r"\hline", file=output)
-        print(out['spec_1_inst'])
-
-        print(r"Share using paid preparer & "
-            + str(res_second1.params[out['spec_1_endog']].round(3))
-            + (r"^{***}" if res_second1.pvalues[out['spec_1_endog']].round(3) < 0.01 else
-                r"^{**}" if res_second1.pvalues[out['spec_1_endog']].round(3) < 0.05 else
-                 r"^{*}" if res_second1.pvalues[out['spec_1_endog']].round(3) < 0.1 else
-                  "")
-            + r" & "
-            + str(res_second2.params[out['spec_1_endog']].round(3))
-            + (r"^{***}" if res_second2.pvalues[out['spec_1_endog']].round(3) < 0.01 else
-                r"^{**}" if res_second2.pvalues[out['spec_1_endog']].round(3) < 0.05 else
-                 r"^{*}" if res_second2.pvalues[out['spec_1_endog']].round(3) < 0.1 else
-                  "")
-            + r" & "
-            + str(res_second3.params[out['spec_1_endog']].round(3))
-            + (r"^{***}" if res_second3.pvalues[out['spec_1_endog']].round(3) < 0.01 else
-                r"^{**}" if res_second3.pvalues[out['spec_1_endog']].round(3) < 0.05 else
-                 r"^{*}" if res_second3.pvalues[out['spec_1_endog']].round(3) < 0.1 else
-                  "")
-            + r" \\",
-            file=output
-        )
-        print(r"(instrumented) & ("
-            + str(res_second1.std_errors[out['spec_1_endog']].round(3))
-            + r") & ("
-            + str(res_second2.std_errors[out['spec_1_endog']].round(3))
-            + r") & ("
-            + str(res_second3.std_errors[out['spec_1_endog']].round(3))
-            + r") \\",
-            file=output
-        )
-
-        print(r"Majority Black & "
-            + r" & "
-            + str(res_second2.params['maj_black'].round(3))
-            + (r"^{***}" if res_second2.pvalues['maj_black'].round(3) < 0.01 else
-                r"^{**}" if res_second2.pvalues['maj_black'].round(3) < 0.05 else
-                r"^{*}" if res_second2.pvalues['maj_black'].round(3) < 0.1 else
-                "")
-            + r" & "
-            + str(res_second3.params['maj_black'].round(3))
-            + (r"^{***}" if res_second3.pvalues['maj_black'].round(3) < 0.01 else
-                r"^{**}" if res_second3.pvalues['maj_black'].round(3) < 0.05 else
-                r"^{*}" if res_second3.pvalues['maj_black'].round(3) < 0.1 else
-                "")
-            + r" \\",
-            file=output
-        )
-        print(r" & & ("
-            + str(res_second2.std_errors['maj_black'].round(3))
-            + r") & ("
-            + str(res_second3.std_errors['maj_black'].round(3))
-            + r") \\",
-            file=output
-        )
-
-        print(r"Majority Hispanic & "
-            + r" & "
-            + str(res_second2.params['maj_hisp'].round(3))
-            + (r"^{***}" if res_second2.pvalues['maj_hisp'].round(3) < 0.01 else
-                r"^{**}" if res_second2.pvalues['maj_hisp'].round(3) < 0.05 else
-                r"^{*}" if res_second2.pvalues['maj_hisp'].round(3) < 0.1 else
-                "")
-            + r" & "
-            + str(res_second3.params['maj_hisp'].round(3))
-            + (r"^{***}" if res_second3.pvalues['maj_hisp'].round(3) < 0.01 else
-                r"^{**}" if res_second3.pvalues['maj_hisp'].round(3) < 0.05 else
-                r"^{*}" if res_second3.pvalues['maj_hisp'].round(3) < 0.1 else
-                "")
-            + r" \\",
-            file=output
-        )
-        print(r" & & ("
-            + str(res_second2.std_errors['maj_hisp'].round(3))
-            + r") & ("
-            + str(res_second3.std_errors['maj_hisp'].round(3))
-            + r") \\",
-            file=output
-        )
-
-
-        print(r"Urban & "
-            + r" & "
-            + str(res_second2.params['urban'].round(3))
-            + (r"^{***}" if res_second2.pvalues['urban'].round(3) < 0.01 else
-                r"^{**}" if res_second2.pvalues['urban'].round(3) < 0.05 else
-                r"^{*}" if res_second2.pvalues['urban'].round(3) < 0.1 else
-                "")
-            + r" & "
-            + str(res_second3.params['urban'].round(3))
-            + (r"^{***}" if res_second3.pvalues['urban'].round(3) < 0.01 else
-                r"^{**}" if res_second3.pvalues['urban'].round(3) < 0.05 else
-                r"^{*}" if res_second3.pvalues['urban'].round(3) < 0.1 else
-                "")
-            + r" \\",
-            file=output
-        )
-        print(r" & & ("
-            + str(res_second2.std_errors['urban'].round(3))
-            + r") & ("
-            + str(res_second3.std_errors['urban'].round(3))
-            + r") \\",
-            file=output
-        )
-
-        print(r"Share college educated & "
-            + r" & "
-            
-            + r" & "
-            + str(res_second3.params['share_college'].round(3))
-            + (r"^{***}" if res_second3.pvalues['share_college'].round(3) < 0.01 else
-                r"^{**}" if res_second3.pvalues['share_college'].round(3) < 0.05 else
-                r"^{*}" if res_second3.pvalues['share_college'].round(3) < 0.1 else
-                "")
-            + r" \\",
-            file=output
-        )
-        print(r" & & & ("
-            + str(res_second3.std_errors['share_college'].round(3))
-            + r") \\",
-            file=output
-        )
-
-        print(r"Median household income & "
-            + r" & "
-            
-            + r" & "
-            + str(res_second3.params['hh_inc_pct'].round(3))
-            + (r"^{***}" if res_second3.pvalues['hh_inc_pct'].round(3) < 0.01 else
-                r"^{**}" if res_second3.pvalues['hh_inc_pct'].round(3) < 0.05 else
-                r"^{*}" if res_second3.pvalues['hh_inc_pct'].round(3) < 0.1 else
-                "")
-            + r" \\",
-            file=output
-        )
-        print(r"(percentiles) & & & ("
-            + str(res_second3.std_errors['hh_inc_pct'].round(3))
-            + r") \\",
-            file=output
-        )
-
-        print(r"Marriage rate & "
-            + r" & "
-            
-            + r" & "
-            + str(res_second3.params['r_marriage'].round(3))
-            + (r"^{***}" if res_second3.pvalues['r_marriage'].round(3) < 0.01 else
-                r"^{**}" if res_second3.pvalues['r_marriage'].round(3) < 0.05 else
-                r"^{*}" if res_second3.pvalues['r_marriage'].round(3) < 0.1 else
-                "")
-            + r" \\",
-            file=output
-        )
-        print(r"(percentiles) & & & ("
-            + str(res_second3.std_errors['r_marriage'].round(3))
-            + r") \\",
-            file=output
-        )
-
-        print(r"\hline", file=output)
-
-        print(r"N & "
-            + str(int(res_second1.nobs))
-            + r" & "
-            + str(int(res_second2.nobs))
-            + r" & "
-            + str(int(res_second3.nobs))
-            + r" \\",
-            file=output
-        )
-
-        print(r"\hline", file=output)
-        print(r"\\", file=output)
-        print(r"\end{tabular*}", file=output)
-        print(r"\multicolumn{3}{p\linewidth}{\footnotesize{\emph{Notes:} The table displays the results \
+    endog = out[specs[0] + '_endog']
+    endog = [endog] if isinstance(endog, str) else endog
+    controls = [x for x in dict.fromkeys(x for spec in specs for x in out[spec + '_controls']) if x != 'const']
+
+    rows = [{'label': 'Specification', 'cells': ['(' + str(i + 1) + ')' for i in range(len(specs))]},
+            {'text': r"\hline"}]
+    # regressors without a label (e.g. state indicators) are listed by name
+    labels = {x: out['table_labels'].get(x, [x.replace('_', r"\_"), '']) for x in endog + controls}
+    rows += [{'term': x, 'label': labels[x][0], 'se_label': labels[x][1]} for x in endog + controls]
+
+    if absorb is not None:
+        rows.append({'label': r"Fixed effects (" + ", ".join(absorb).replace("_", r"\_") + r")", 'cells': ['X'] * len(specs)})
+
+    rows += [{'text': r"\hline"},
+             {'stat': 'nobs', 'label': 'N', 'digits': 'int'}]
+
+    header = [r"\begin{table}[h!]",
+              r"\begin{center}",
+              r"\caption{Second-stage regression results: RESULT \label{tab:LABEL}}",
+              r"\setlength\tabcolsep{0pt}",
+              r"\begin{tabular*}{\linewidth}{@{\extracolsep{\fill}} l" + 'c' * len(specs) + " }"]
+
+    footer = [r"\hline",
+              r"\\",
+              r"\end{tabular*}",
+              r"\multicolumn{" + str(len(specs) + 1) + r"}{p\linewidth}{\footnotesize{\emph{Notes:} The table displays the results \
              of second-stage instrumental variables regressions of the share of taxpayers using a paid \
             preparer on OUTCOME. Control variables include whether the county is majority Black, \
             majority hispanic, or urban; the share of county residents that are college educated;\
@@ -634,11 +1280,93 @@ def make_2sls_table(df,
             standard errors are displayed in parentheses. \
             2017 dollar amounts are adjusted for inflation using the Bureau of Labor Statistics CPI \
                 inflation calculator, indexed to December 2021. Stars correspond to p-values derived \
-                    from two-sided hypothesis tests. ^*: P<.10; ^{**}: P<.05; ^{***}:P<.01.", file=output)
-        print(r"}}", file=output)
-        print(r"\end{center}", file=output)
-        print(r"\end{table}", file=output)
+                    from two-sided hypothesis tests. ^*: P<.10; ^{**}: P<.05; ^{***}:P<.01.",
+              r"}}",
+              r"\end{center}",
+              r"\end{table}"]
+
+    filename = project_path('results/tables/ss_' + outcome + ('' if absorb is None else '_fe'))
+
+    write_table(results_frame(results), rows, [filename + '.' + x for x in formats], header=header, footer=footer)
+
+    return None
+
+def make_2sls_tables(df, 
+                     outcomes,  # outcomes of interest
+                     absorb=None,  # fixed effects to absorb
+                     specs=['spec_1', 'spec_2', 'spec_3'],  # specifications, one per column
+                     formats=['tex'],  # output file formats
+    ):
+
+    '''
+    Generates the 2SLS table for each of several outcomes. The outcomes share the
+    controls, endogenous variables and instruments of each specification, so each 
+    specification is fit once for all outcomes (see iv_utils.iv2sls_multi): the 
+    instrument projection is factored once and the outcomes are solved together. 
+    Estimates and robust standard errors equal those of fitting each outcome 
+    separately on rows with no missing outcome.
 
-    os.rename(filename, filename[:-3]+'tex')
+    inputs:
+        df: dataframe with outcomes, instruments, endogenous variables, and controls
+        outcomes: list of outcomes of interest
+        absorb: None, or list of grouping columns whose fixed effects are absorbed
+        specs: list of config prefixes of the specifications, e.g. ['spec_1', 'spec_2']
+        formats: list of file formats to write, out of 'tex', 'txt' and 'csv'
+    outputs:
+        formatted .tex file with regression output for each outcome
+    '''
+
+    out = load_config()
+
+    df["const"] = 1
+
+    results = {outcome: [] for outcome in outcomes}
+
+    for spec in specs:
+
+        fits = iv2sls_multi(df[outcomes], df[out[spec + '_controls']], df[out[spec + '_endog']], 
+                            df[out[spec + '_inst']], absorb=None if absorb is None else df[absorb], 
+                            cov_type="robust")
+
+        for outcome in outcomes:
+            print(fits[outcome])
+            results[outcome].append(fits[outcome])
+
+    for outcome in outcomes:
+        make_2sls_table(df, outcome=outcome, absorb=absorb, results=results[outcome], specs=specs, formats=formats)
 
     return None
+
+def run_spec_grid(n_workers=None, name='spec_grid'):
+
+    '''
+    Fits the robustness grid defined by the grid_* keys of the config file: every 
+    combination of outcome, instrument set, subset of the optional controls, and sample
+    (see iv_utils.spec_grid). Writes every coefficient to one long table in Arrow IPC 
+    (Feather v2) format, 'results/tables/<name>.feather'.
+
+    inputs:
+        n_workers: number of worker processes. None uses the number of cores.
+        name: file name, without extension, of the results table
+    outputs:
+        results: dataframe of coefficients, one row per specification, outcome and term
+    '''
+
+    out = load_config()
+
+    # check the grid's variables against the clean data before loading it, and read only those
+    df = load_clean_data(columns=out.check_columns('spec_grid', clean_data_columns()))
+    df["const"] = 1
+
+    results = spec_grid(df, 
+                        outcomes=out['grid_outcomes'], 
+                        endog=out['grid_endog'], 
+                        instruments=out['grid_inst'], 
+                        controls=out['grid_controls'], 
+                        always=out['grid_always'], 
+                        samples=out['grid_samples'], 
+                        n_workers=n_workers)
+
+    results.to_feather(project_path('results/tables/' + name + '.feather'), compression='uncompressed')
+
+    return results
@@ -0,0 +1,920 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import numpy as np
+import pandas as pd
+from profile_utils import instrument
+
+# scipy.linalg, scipy.sparse and scipy.stats are imported in the functions that use them,
+# so that importing this module (and data_utils) stays cheap
+
+def demean_within(df, columns, groups, tol=1e-10, max_iter=1000):
+
+    '''
+    Removes group means from each column (the within transformation), absorbing the fixed
+    effects of one or more grouping variables. With one grouping variable a single pass is
+    exact; with several, group means are swept out in turn (alternating projections) until
+    the largest change is below tol.
+
+    inputs:
+        df: dataframe containing the columns to transform and the grouping variables
+        columns: list of columns to demean
+        groups: list of columns identifying the fixed-effect groups, e.g. ['STATEFIPS']
+        tol: convergence tolerance for more than one grouping variable
+        max_iter: maximum number of sweeps for more than one grouping variable
+    outputs:
+        demeaned: dataframe of the demeaned columns, with the same index as df
+    '''
+
+    values = df[columns].to_numpy(dtype=float)
+    codes = [pd.factorize(df[group])[0] for group in groups]
+    counts = [np.bincount(code) for code in codes]
+
+    for _ in range(max_iter if len(groups) > 1 else 1):
+
+        change = 0
+
+        for code, count in zip(codes, counts):
+            # group sums of every column at once, then subtract each row's group mean
+            sums = np.zeros((len(count), values.shape[1]))
+            np.add.at(sums, code, values)
+            means = (sums / count[:, None])[code]
+            values = values - means
+            change = max(change, np.abs(means).max(initial=0))
+
+        if change < tol:
+            break
+
+    return pd.DataFrame(values, index=df.index, columns=columns)
+
+def count_absorbed(df, groups):
+
+    '''
+    Counts the degrees of freedom used by absorbed fixed effects, i.e. the rank of the matrix
+    of group dummies. A grouping nested in another one (each of its levels is a union of the
+    other's levels, e.g. states and counties) adds nothing and is skipped. The first two
+    remaining groupings are counted exactly, as their levels less the number of connected
+    components of the graph that links levels sharing a row. Each further grouping is
+    counted as its levels less one, which is exact for connected groupings and otherwise
+    an upper bound (so degrees of freedom are conservative).
+
+    inputs:
+        df: dataframe with the grouping variables, without missing values
+        groups: list of columns identifying the fixed-effect groups
+    outputs:
+        n_absorbed: number of absorbed parameters
+    '''
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    codes = {group: pd.factorize(df[group])[0] for group in groups}
+
+    # skip groupings determined by another grouping that is kept
+    kept = list(groups)
+    for group in groups:
+        for other in kept:
+            if other != group and (pd.Series(codes[group]).groupby(codes[other]).nunique() == 1).all():
+                kept.remove(group)
+                break
+
+    levels = [codes[group].max() + 1 for group in kept]
+
+    if len(kept) == 1:
+        return levels[0]
+
+    # bipartite graph of the first two groupings' levels, with an edge for every row
+    first, second = codes[kept[0]], codes[kept[1]] + levels[0]
+    graph = coo_matrix((np.ones(len(first)), (first, second)), shape=(levels[0] + levels[1],) * 2)
+    components = connected_components(graph, directed=False)[0]
+
+    return levels[0] + levels[1] - components + sum(x - 1 for x in levels[2:])
+
+class IVResults:
+
+    '''
+    Results of a 2SLS fit. Attribute names follow linearmodels' IVResults so the results can
+    be used in place of it when building tables.
+
+    attributes:
+        params, std_errors, tstats, pvalues: series indexed by regressor name
+        cov: parameter covariance matrix
+        nobs: number of observations
+        df_resid: residual degrees of freedom, net of absorbed fixed effects
+        n_absorbed: number of absorbed fixed-effect parameters
+        rsquared: R-squared (within R-squared if fixed effects were absorbed)
+        resids: second-stage residuals
+        cov_type: covariance estimator
+    '''
+
+    def __init__(self, params, cov, nobs, df_resid, n_absorbed, rsquared, resids, cov_type, debiased):
+
+        from scipy import stats
+
+        self.params = params
+        self.cov = cov
+        self.nobs = nobs
+        self.df_resid = df_resid
+        self.n_absorbed = n_absorbed
+        self.rsquared = rsquared
+        self.resids = resids
+        self.cov_type = cov_type
+
+        self.std_errors = pd.Series(np.sqrt(np.diag(cov)), index=params.index)
+        self.tstats = params / self.std_errors
+
+        # t distribution with small-sample adjustment, normal otherwise, as in linearmodels
+        if debiased:
+            self.pvalues = pd.Series(2 * stats.t.sf(np.abs(self.tstats), df_resid), index=params.index)
+        else:
+            self.pvalues = pd.Series(2 * stats.norm.sf(np.abs(self.tstats)), index=params.index)
+
+    def __str__(self):
+
+        table = pd.DataFrame({'Parameter': self.params, 'Std. Err.': self.std_errors,
+                              'T-stat': self.tstats, 'P-value': self.pvalues})
+
+        header = ('IV-2SLS Estimation Summary\n'
+                  + 'No. Observations: ' + str(self.nobs)
+                  + '   Absorbed effects: ' + str(self.n_absorbed)
+                  + '   R-squared: ' + str(round(self.rsquared, 4))
+                  + '   Cov. Estimator: ' + self.cov_type + '\n')
+
+        return header + table.to_string()
+
+def _prepare(dependents, exog, endog, instruments, absorb):
+
+    '''
+    Drops rows with missing values in any variable and, if absorb is given, demeans every
+    variable within groups. Returns the arrays used by the 2SLS solvers.
+    '''
+
+    exog = pd.DataFrame(exog)
+    endog = pd.DataFrame(endog)
+    instruments = pd.DataFrame(instruments)
+    outcomes = list(dependents.columns)
+
+    n_absorbed = 0
+
+    if absorb is not None:
+        absorb = pd.DataFrame(absorb)
+        exog = exog.loc[:, exog.nunique() > 1]
+        data = pd.concat([dependents, exog, endog, instruments, absorb], axis=1).dropna()
+        n_absorbed = count_absorbed(data, list(absorb.columns))
+        columns = outcomes + list(dict.fromkeys(list(exog.columns) + list(endog.columns) + list(instruments.columns)))
+        data = demean_within(data, columns, list(absorb.columns))
+    else:
+        data = pd.concat([dependents, exog, endog, instruments], axis=1).dropna()
+
+    y = data[outcomes].to_numpy(dtype=float)
+    x = np.column_stack([data[list(exog.columns)].to_numpy(dtype=float), data[list(endog.columns)].to_numpy(dtype=float)])
+    z = np.column_stack([data[list(exog.columns)].to_numpy(dtype=float), data[list(instruments.columns)].to_numpy(dtype=float)])
+    names = list(exog.columns) + list(endog.columns)
+
+    return y, x, z, names, n_absorbed, data.index
+
+def _sandwich(xhat, bread, eps, cov_type, debiased, df_resid):
+
+    '''
+    Parameter covariance for every column of the residual matrix eps. Returns an array of
+    shape (outcomes, k, k).
+    '''
+
+    nobs = len(eps)
+
+    if cov_type == 'robust':
+        # one meat matrix per outcome, sum_i e_ij^2 xhat_i xhat_i', as a single matrix product
+        k, m = xhat.shape[1], eps.shape[1]
+        weighted = (xhat[:, :, None] * (eps ** 2)[:, None, :]).reshape(nobs, k * m)
+        meat = (xhat.T @ weighted).reshape(k, k, m).transpose(2, 0, 1)
+        cov = bread[None, :, :] @ meat @ bread[None, :, :]
+        if debiased:
+            cov = cov * nobs / df_resid
+    else:
+        sigma2 = (eps ** 2).sum(axis=0) / (df_resid if debiased else nobs)
+        cov = bread[None, :, :] * sigma2[:, None, None]
+
+    return cov
+
+@instrument
+def iv2sls_multi(dependents, exog, endog, instruments, absorb=None, cov_type='robust', debiased=False):
+
+    '''
+    Two-stage least squares for several outcomes that share the same regressors and 
+    instruments. The instrument projection and the second-stage normal equations are 
+    factored once and every outcome is solved as a column of a multi-column right-hand side,
+    so fitting many outcomes costs little more than fitting one. Each outcome's estimates and
+    standard errors equal those of a separate fit on the same sample; rows missing any 
+    outcome are dropped for all outcomes. Fixed effects can be absorbed as in iv2sls.
+
+    inputs:
+        dependents: dataframe with one column per outcome
+        exog: dataframe of exogenous regressors. a constant column is dropped when fixed
+        effects are absorbed, since the group means absorb it.
+        endog: dataframe of endogenous regressors
+        instruments: dataframe of excluded instruments
+        absorb: None, or a dataframe of grouping variables whose fixed effects are absorbed
+        cov_type: 'robust' (heteroskedasticity-robust) or 'unadjusted'
+        debiased: if True, scales the covariance by nobs / df_resid and uses t-based p-values
+    outputs:
+        results: dictionary of IVResults keyed by outcome
+    '''
+
+    if cov_type not in ['robust', 'unadjusted']:
+        raise ValueError('cov_type must be robust or unadjusted')
+
+    outcomes = list(dependents.columns)
+    y, x, z, names, n_absorbed, index = _prepare(dependents, exog, endog, instruments, absorb)
+
+    nobs, k = x.shape
+
+    # first stage: project the regressors onto the instrument space
+    q, _ = np.linalg.qr(z)
+    xhat = q @ (q.T @ x)
+
+    # second stage, all outcomes at once
+    params = np.linalg.lstsq(xhat, y, rcond=None)[0]
+    eps = y - x @ params
+
+    df_resid = nobs - k - n_absorbed
+    bread = np.linalg.inv(xhat.T @ xhat)
+    cov = _sandwich(xhat, bread, eps, cov_type, debiased, df_resid)
+
+    if absorb is None:
+        tss = ((y - y.mean(axis=0)) ** 2).sum(axis=0)
+    else:
+        tss = (y ** 2).sum(axis=0)
+    rsquared = 1 - (eps ** 2).sum(axis=0) / tss
+
+    results = {}
+
+    for j, outcome in enumerate(outcomes):
+        results[outcome] = IVResults(params=pd.Series(params[:, j], index=names),
+                                     cov=pd.DataFrame(cov[j], index=names, columns=names),
+                                     nobs=nobs,
+                                     df_resid=df_resid,
+                                     n_absorbed=n_absorbed,
+                                     rsquared=rsquared[j],
+                                     resids=pd.Series(eps[:, j], index=index),
+                                     cov_type=cov_type,
+                                     debiased=debiased)
+
+    return results
+
+def iv2sls(dependent, exog, endog, instruments, absorb=None, cov_type='robust', debiased=False):
+
+    '''
+    Two-stage least squares with optional absorption of fixed effects. When absorb is given,
+    the dependent variable, exogenous regressors, endogenous regressors and instruments are
+    demeaned within groups before the 2SLS solve, so the fixed effects never enter the design
+    matrix. By the Frisch-Waugh-Lovell theorem the coefficients equal those from including
+    a dummy for every group; the degrees of freedom are reduced by the number of absorbed
+    levels. Without absorb, the estimates and standard errors match linearmodels' IV2SLS.
+
+    inputs:
+        dependent: series with the outcome
+        exog: dataframe of exogenous regressors. a constant column is dropped when fixed
+        effects are absorbed, since the group means absorb it.
+        endog: dataframe of endogenous regressors
+        instruments: dataframe of excluded instruments
+        absorb: None, or a dataframe of grouping variables whose fixed effects are absorbed
+        cov_type: 'robust' (heteroskedasticity-robust) or 'unadjusted'
+        debiased: if True, scales the covariance by nobs / df_resid and uses t-based p-values
+    outputs:
+        results: IVResults
+    '''
+
+    name = dependent.name if dependent.name is not None else 'dependent'
+
+    return iv2sls_multi(dependent.to_frame(name), exog, endog, instruments, absorb=absorb, 
+                        cov_type=cov_type, debiased=debiased)[name]
+
+class OLSResults:
+
+    '''
+    Results of one step of nested_ols. Attribute names follow statsmodels' RegressionResults
+    so the results can be used in place of it when building tables.
+
+    attributes:
+        params, bse, tvalues, pvalues: series indexed by regressor name
+        HC3_se: HC3 standard errors, whatever the cov_type
+        nobs: number of observations
+        df_model, df_resid: model and residual degrees of freedom
+        rsquared: R-squared (centered if the design has a constant)
+        fvalue, f_pvalue: F test that every non-constant coefficient is zero, a Wald test
+        using the robust covariance when cov_type is 'HC3'
+        resid: residuals
+        cov_type: covariance estimator
+    '''
+
+    def __init__(self, params, cov, hc3_cov, nobs, df_model, df_resid, rsquared, fvalue, resid, cov_type):
+
+        from scipy import stats
+
+        self.params = params
+        self.cov = cov
+        self.nobs = float(nobs)
+        self.df_model = float(df_model)
+        self.df_resid = float(df_resid)
+        self.rsquared = rsquared
+        self.fvalue = fvalue
+        self.f_pvalue = stats.f.sf(fvalue, df_model, df_resid)
+        self.resid = resid
+        self.cov_type = cov_type
+
+        self.bse = pd.Series(np.sqrt(np.diag(cov)), index=params.index)
+        self.HC3_se = pd.Series(np.sqrt(np.diag(hc3_cov)), index=params.index)
+        self.tvalues = params / self.bse
+
+        # normal p-values for robust covariances and t p-values otherwise, as in statsmodels
+        if cov_type == 'nonrobust':
+            self.pvalues = pd.Series(2 * stats.t.sf(np.abs(self.tvalues), df_resid), index=params.index)
+        else:
+            self.pvalues = pd.Series(2 * stats.norm.sf(np.abs(self.tvalues)), index=params.index)
+
+    def cov_params(self):
+
+        return pd.DataFrame(self.cov, index=self.params.index, columns=self.params.index)
+
+def _append_columns(q, r, block):
+
+    '''
+    Extends the thin QR factorization q r of a design by the columns of block, without 
+    refactoring the existing columns.
+    '''
+
+    if q.shape[1] == 0:
+        return np.linalg.qr(block)
+
+    # block Gram-Schmidt against the existing columns, run twice to keep q orthogonal
+    r12 = q.T @ block
+    w = block - q @ r12
+    correction = q.T @ w
+    r12 = r12 + correction
+    w = w - q @ correction
+
+    q2, r22 = np.linalg.qr(w)
+
+    return np.hstack([q, q2]), np.block([[r, r12], [np.zeros((r22.shape[0], r.shape[1])), r22]])
+
+def _nested_factors(data, steps):
+
+    '''
+    Yields the column order and thin QR factorization of each step's design. Each step keeps
+    the longest leading block of the previous factorization whose columns it contains (a 
+    leading block of a QR factorization is itself a QR factorization) and appends the rest,
+    so for nested designs every column is factored once.
+    '''
+
+    columns = []
+    q = np.empty((len(data), 0))
+    r = np.empty((0, 0))
+
+    for step in steps:
+
+        keep = 0
+        while keep < len(columns) and columns[keep] in step:
+            keep += 1
+        columns, q, r = columns[:keep], q[:, :keep], r[:keep, :keep]
+
+        new = [column for column in step if column not in columns]
+        if new:
+            q, r = _append_columns(q, r, data[new].to_numpy(dtype=float))
+            columns = columns + new
+
+        yield list(columns), q, r
+
+def add_constant(df):
+
+    '''
+    Adds a column of ones named 'const' in front of the regressors, as statsmodels'
+    add_constant does, without importing statsmodels. A dataframe that already has a
+    nonzero constant column is returned unchanged.
+
+    inputs:
+        df: dataframe of regressors
+    outputs:
+        design: dataframe with 'const' as its first column
+    '''
+
+    values = df.to_numpy(dtype=float)
+    if len(values) and ((values.min(axis=0) == values.max(axis=0)) & (values[0] != 0)).any():
+        return df
+
+    return pd.concat([pd.Series(1.0, index=df.index, name='const'), df], axis=1)
+
+@instrument
+def nested_ols(dependent, designs, cov_type='HC3'):
+
+    '''
+    Fits OLS for a sequence of designs that add columns step by step (e.g. the first-stage
+    specifications fs_X_1, fs_X_2, fs_X_3 with a constant), updating one QR factorization
+    as columns are added instead of refitting each design from scratch, so the whole 
+    sequence costs about as much as the largest fit. Designs need not be strictly nested;
+    a step that drops a column reuses the factorization up to that column. Each step's 
+    estimates match statsmodels' OLS(dependent, design).fit(cov_type=cov_type). Rows 
+    missing any variable of any design are dropped from every step.
+
+    inputs:
+        dependent: series (or one-column dataframe) with the outcome
+        designs: list of dataframes of regressors, one per step, including a constant if 
+        wanted (e.g. add_constant(df[out['fs_X_1']]))
+        cov_type: 'HC3' or 'nonrobust'
+    outputs:
+        results: list of OLSResults, one per design
+    '''
+
+    if cov_type not in ['HC3', 'nonrobust']:
+        raise ValueError('cov_type must be HC3 or nonrobust')
+
+    if isinstance(dependent, pd.DataFrame):
+        dependent = dependent.iloc[:, 0]
+
+    # one copy of each regressor, taken from the first design that has it
+    union = {}
+    for design in designs:
+        for column in design.columns:
+            union.setdefault(column, design[column])
+
+    data = pd.concat([dependent.rename('__dependent'), pd.DataFrame(union)], axis=1).dropna()
+    y = data['__dependent'].to_numpy(dtype=float)
+    nobs = len(y)
+
+    values = data[list(union)].to_numpy(dtype=float)
+    constants = {column for column, low, high in zip(union, values.min(axis=0), values.max(axis=0)) if low == high != 0}
+
+    from scipy import linalg
+
+    results = []
+
+    for design, (columns, q, r) in zip(designs, _nested_factors(data, [list(design.columns) for design in designs])):
+
+        k = len(columns)
+        qy = q.T @ y
+        resid = y - q @ qy
+        ssr = resid @ resid
+        r_inv = linalg.solve_triangular(r, np.eye(k))
+        params = r_inv @ qy
+
+        # HC3 weights each squared residual by (1 - h_i)^-2, with leverage h_i = |q_i|^2
+        leverage = (q ** 2).sum(axis=1)
+        meat = (q * (resid ** 2 / (1 - leverage) ** 2)[:, None]).T @ q
+        hc3_cov = r_inv @ meat @ r_inv.T
+        cov = hc3_cov if cov_type == 'HC3' else r_inv @ r_inv.T * ssr / (nobs - k)
+
+        # reorder from the factorization's column order to the design's
+        order = [columns.index(column) for column in design.columns]
+        params, cov, hc3_cov = params[order], cov[np.ix_(order, order)], hc3_cov[np.ix_(order, order)]
+
+        constant = [i for i, column in enumerate(design.columns) if column in constants]
+        slopes = [i for i in range(k) if i not in constant]
+        tss = ((y - y.mean()) ** 2).sum() if constant else (y ** 2).sum()
+
+        if cov_type == 'HC3':
+            fvalue = params[slopes] @ np.linalg.solve(cov[np.ix_(slopes, slopes)], params[slopes]) / len(slopes)
+        else:
+            fvalue = (tss - ssr) / len(slopes) / (ssr / (nobs - k))
+
+        results.append(OLSResults(params=pd.Series(params, index=design.columns),
+                                  cov=cov,
+                                  hc3_cov=hc3_cov,
+                                  nobs=nobs,
+                                  df_model=len(slopes),
+                                  df_resid=nobs - k,
+                                  rsquared=1 - ssr / tss,
+                                  fvalue=fvalue,
+                                  resid=pd.Series(resid, index=data.index),
+                                  cov_type=cov_type))
+
+    return results
+
+@instrument
+def nested_iv2sls(dependent, designs, endog, instruments, cov_type='robust', debiased=False):
+
+    '''
+    Fits 2SLS for a sequence of control sets that add columns step by step (e.g. 
+    spec_1_controls, spec_2_controls, spec_3_controls). The instrument matrix of each step
+    is the excluded instruments followed by the controls, so successive steps share a 
+    leading block and its QR factorization is extended rather than recomputed (see 
+    nested_ols). Each step's estimates match iv2sls on the same rows. Rows missing any 
+    variable of any step are dropped from every step.
+
+    inputs:
+        dependent: series with the outcome
+        designs: list of dataframes of exogenous regressors, one per step
+        endog: dataframe of endogenous regressors
+        instruments: dataframe of excluded instruments
+        cov_type: 'robust' (heteroskedasticity-robust) or 'unadjusted'
+        debiased: if True, scales the covariance by nobs / df_resid and uses t-based p-values
+    outputs:
+        results: list of IVResults, one per design
+    '''
+
+    endog = pd.DataFrame(endog)
+    instruments = pd.DataFrame(instruments)
+
+    data = pd.concat([dependent.rename('__dependent'), endog, instruments] + designs, axis=1)
+    data = data.loc[:, ~data.columns.duplicated()].dropna()
+    y = data['__dependent'].to_numpy(dtype=float)
+    x_endog = data[list(endog.columns)].to_numpy(dtype=float)
+    nobs = len(y)
+
+    steps = [list(instruments.columns) + list(design.columns) for design in designs]
+
+    results = []
+
+    for design, (_, q, _) in zip(designs, _nested_factors(data, steps)):
+
+        controls = data[list(design.columns)].to_numpy(dtype=float)
+        names = list(design.columns) + list(endog.columns)
+
+        # the controls are instruments for themselves, so only the endogenous columns move
+        x = np.column_stack([controls, x_endog])
+        xhat = np.column_stack([controls, q @ (q.T @ x_endog)])
+
+        params = np.linalg.lstsq(xhat, y, rcond=None)[0]
+        eps = (y - x @ params)[:, None]
+        df_resid = nobs - len(names)
+        cov = _sandwich(xhat, np.linalg.inv(xhat.T @ xhat), eps, cov_type, debiased, df_resid)[0]
+
+        results.append(IVResults(params=pd.Series(params, index=names),
+                                 cov=pd.DataFrame(cov, index=names, columns=names),
+                                 nobs=nobs,
+                                 df_resid=df_resid,
+                                 n_absorbed=0,
+                                 rsquared=1 - (eps[:, 0] ** 2).sum() / ((y - y.mean()) ** 2).sum(),
+                                 resids=pd.Series(eps[:, 0], index=data.index),
+                                 cov_type=cov_type,
+                                 debiased=debiased))
+
+    return results
+
+class ResampleResults:
+
+    '''
+    Results of a bootstrap or permutation run (see resample).
+
+    attributes:
+        params: point estimates on the full sample. for permutation, the reduced-form
+        coefficients of the permuted columns only (see resample).
+        draws: dataframe of the draws of params, one row per replication
+        tstats: dataframe of the bootstrap t-statistics (wild bootstrap only)
+        std_errors: standard deviation of the draws
+        pvalues: two-sided p-values for a zero coefficient. wild: symmetric bootstrap-t;
+        pairs: share of centered draws at least as large as the estimate; permutation:
+        share of permuted reduced-form coefficients at least as large as the full-sample
+        one, counting the full-sample one itself.
+        method: 'wild', 'pairs' or 'permutation'
+        reps: number of replications
+    '''
+
+    def __init__(self, params, draws, tstats, analytic_se, method):
+
+        self.params = params
+        self.draws = draws
+        self.tstats = tstats
+        self.analytic_se = analytic_se
+        self.method = method
+        self.reps = len(draws)
+
+        self.std_errors = draws.std()
+
+        if method == 'wild':
+            self.pvalues = (tstats.abs() >= (params / analytic_se).abs()).mean()
+        elif method == 'pairs':
+            self.pvalues = ((draws - params).abs() >= params.abs()).mean()
+        else:
+            self.pvalues = (1 + (draws.abs() >= params.abs()).sum()) / (1 + self.reps)
+
+    def conf_int(self, level=0.95):
+
+        '''
+        Returns bootstrap confidence intervals: symmetric percentile-t intervals for the wild
+        bootstrap and percentile intervals for the pairs bootstrap.
+        '''
+
+        if self.method == 'wild':
+            width = self.tstats.abs().quantile(level) * self.analytic_se
+            return pd.DataFrame({'lower': self.params - width, 'upper': self.params + width})
+        elif self.method == 'pairs':
+            return pd.DataFrame({'lower': self.draws.quantile((1 - level) / 2), 
+                                 'upper': self.draws.quantile((1 + level) / 2)})
+
+        raise ValueError('permutation draws are a null distribution and give no confidence interval')
+
+    def __str__(self):
+
+        table = pd.DataFrame({'Parameter': self.params, 'Boot. Std. Err.': self.std_errors,
+                              'P-value': self.pvalues})
+        if self.method != 'permutation':
+            table = table.join(self.conf_int())
+
+        return self.method + ' resampling, ' + str(self.reps) + ' replications\n' + table.to_string()
+
+def _robust_se(xhat, bread, eps, codes, n_groups):
+
+    '''
+    Heteroskedasticity-robust (codes None) or cluster-robust standard errors for every
+    column of the residual matrix eps. Returns a k x reps array.
+    '''
+
+    # scores x_hat_i e_ib, summed within clusters
+    scores = xhat[:, :, None] * eps[:, None, :]
+    if codes is not None:
+        from scipy import sparse
+        members = sparse.csr_matrix((np.ones(len(codes)), (codes, np.arange(len(codes)))), 
+                                    shape=(n_groups, len(codes)))
+        scores = (members @ scores.reshape(len(codes), -1)).reshape(n_groups, xhat.shape[1], -1)
+
+    influence = np.einsum('ij,gjb->gib', bread, scores)
+
+    return np.sqrt((influence ** 2).sum(axis=0))
+
+def _resample_job(task):
+
+    '''
+    Runs one batch of replications with its own random stream. Runs in a worker process.
+    '''
+
+    method, arrays, reps, seed, options = task
+    rng = np.random.default_rng(seed)
+
+    y, x, z = arrays['y'], arrays['x'], arrays['z']
+    codes, n_groups = arrays['codes'], arrays['n_groups']
+    rows = codes if codes is not None else np.arange(len(y))
+
+    if method == 'wild':
+        # y* = x b + e v, with one weight per cluster, holding the first stage fixed
+        if options['weights'] == 'rademacher':
+            v = rng.choice([-1.0, 1.0], size=(n_groups, reps))
+        elif options['weights'] == 'webb':
+            v = rng.choice(np.sqrt(np.array([1.5, 1.0, 0.5, 0.5, 1.0, 1.5])) * np.array([-1, -1, -1, 1, 1, 1]), 
+                           size=(n_groups, reps))
+        else:
+            v = rng.standard_normal((n_groups, reps))
+        ystar = (x @ arrays['params'])[:, None] + arrays['eps'][:, None] * v[rows]
+        draws = arrays['proj'] @ ystar
+        se = _robust_se(arrays['xhat'], arrays['bread'], ystar - x @ draws, codes, n_groups)
+        return draws.T, ((draws - arrays['params'][:, None]) / se).T
+
+    if method == 'pairs':
+        # resampling clusters with replacement is weighting each by its draw count
+        weights = rng.multinomial(n_groups, np.full(n_groups, 1 / n_groups), size=reps)[:, rows]
+        zw = z.T[None, :, :] * weights[:, None, :]
+        zwz, zwx, zwy = zw @ z, zw @ x, zw @ y
+    else:
+        # permute the chosen columns across rows, within strata if given
+        if codes is None:
+            order = np.argsort(rng.random((reps, len(y))), axis=1)
+            perm = order
+        else:
+            base = np.argsort(codes, kind='stable')
+            order = np.argsort(codes[None, :] + rng.random((reps, len(y))), axis=1)
+            perm = np.empty_like(order)
+            perm[:, base] = order
+        zs = np.repeat(z[None, :, :], reps, axis=0)
+        zs[:, :, options['permute_z']] = z[:, options['permute_z']][perm]
+        zt = np.swapaxes(zs, 1, 2)
+        # reduced-form coefficients of the permuted columns, regressing y on the permuted z
+        draws = np.linalg.solve(zt @ zs, (zt @ y)[:, :, None])[:, :, 0]
+        return draws[:, options['permute_z']], None
+
+    # batched 2SLS from the normal equations: b = (P'Z'X)^-1 P'Z'y with P = (Z'Z)^-1 Z'X
+    first = np.linalg.solve(zwz, zwx)
+    firstt = np.swapaxes(first, 1, 2)
+    draws = np.linalg.solve(firstt @ zwx, (firstt @ zwy[:, :, None]))[:, :, 0]
+
+    return draws, None
+
+@instrument
+def resample(dependent, exog, endog, instruments, method='wild', clusters=None, reps=10000, 
+             weights='rademacher', permute=None, absorb=None, seed=0, n_workers=None, batch_size=250):
+
+    '''
+    Bootstrap and permutation inference for 2SLS (or OLS, with no endogenous regressors or
+    instruments). Replications are drawn in vectorized batches and the batches are spread
+    across a process pool. Each batch draws from its own stream spawned from seed, so
+    results are reproducible for a given seed and batch_size regardless of n_workers.
+
+    methods:
+        'wild': wild bootstrap of the second-stage residuals, with one weight per cluster if
+        clusters is given. the instrument projection is computed once and reused by every
+        replication. p-values and intervals use the symmetric bootstrap-t with robust (or
+        cluster-robust) standard errors.
+        'pairs': resamples rows (or clusters) with replacement and refits both stages.
+        'permutation': randomization inference. permutes the columns in permute (by default
+        the instruments) across rows, within clusters if given, and refits the reduced
+        form, the regression of the outcome on the exogenous regressors and instruments.
+        the statistic is the reduced-form coefficient of each permuted column, so for an
+        instrument the p-value is an Anderson-Rubin type test that the endogenous
+        regressors have no effect, and with no instruments it is the OLS coefficient. 
+        only the permuted columns are reported, since their null is the only one tested.
+
+    inputs:
+        dependent: series (or one-column dataframe) with the outcome
+        exog: dataframe of exogenous regressors
+        endog: dataframe of endogenous regressors (may have no columns for OLS)
+        instruments: dataframe of excluded instruments (may have no columns for OLS)
+        method: 'wild', 'pairs' or 'permutation'
+        clusters: None, or series of cluster (strata, for permutation) ids, e.g. df['STATEFIPS']
+        reps: number of replications
+        weights: wild bootstrap weights, 'rademacher', 'webb' or 'normal'
+        permute: list of instruments or exogenous regressors to permute for 
+        method='permutation'
+        absorb: None, or a dataframe of grouping variables whose fixed effects are absorbed 
+        (wild bootstrap only)
+        seed: seed for the random streams
+        n_workers: number of worker processes. None uses the number of cores; 1 runs in
+        this process.
+        batch_size: number of replications drawn at once by a worker
+    outputs:
+        results: ResampleResults
+    '''
+
+    if method not in ['wild', 'pairs', 'permutation']:
+        raise ValueError('method must be wild, pairs or permutation')
+    if absorb is not None and method != 'wild':
+        raise ValueError('absorbed fixed effects are only supported by the wild bootstrap')
+
+    if isinstance(dependent, pd.DataFrame):
+        dependent = dependent.iloc[:, 0]
+
+    exog = pd.DataFrame(exog)
+    endog = pd.DataFrame(endog, index=exog.index)
+    instruments = pd.DataFrame(instruments, index=exog.index)
+
+    if clusters is not None:
+        keep = clusters.notna()
+        dependent, exog, endog, instruments = dependent[keep], exog[keep], endog[keep], instruments[keep]
+        absorb = None if absorb is None else pd.DataFrame(absorb)[keep]
+
+    name = dependent.name if dependent.name is not None else 'dependent'
+    y, x, z, names, n_absorbed, index = _prepare(dependent.to_frame(name), exog, endog, instruments, absorb)
+    y = y[:, 0]
+
+    if clusters is None:
+        codes, n_groups = None, len(y)
+    else:
+        codes, uniques = pd.factorize(clusters.loc[index])
+        n_groups = len(uniques)
+
+    # full-sample fit, shared by every replication
+    q, _ = np.linalg.qr(z)
+    xhat = q @ (q.T @ x)
+    bread = np.linalg.inv(xhat.T @ xhat)
+    proj = bread @ xhat.T
+    params = proj @ y
+    eps = y - x @ params
+    analytic_se = _robust_se(xhat, bread, eps[:, None], codes, n_groups)[:, 0]
+
+    zcolumns = [column for column in exog.columns if column in names] + list(instruments.columns)
+    permute = list(instruments.columns) if permute is None else permute
+    options = {'weights': weights,
+               'permute_z': [i for i, column in enumerate(zcolumns) if column in permute]}
+
+    if method == 'permutation' and (not permute or any(column not in zcolumns for column in permute)):
+        raise ValueError('permute must list instruments or exogenous regressors')
+
+    arrays = {'y': y, 'x': x, 'z': z, 'xhat': xhat, 'bread': bread, 'proj': proj, 
+              'params': params, 'eps': eps, 'codes': codes, 'n_groups': n_groups}
+
+    sizes = [batch_size] * (reps // batch_size) + ([reps % batch_size] if reps % batch_size else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(method, arrays, size, child, options) for size, child in zip(sizes, seeds)]
+
+    if n_workers == 1:
+        batches = [_resample_job(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            batches = list(executor.map(_resample_job, tasks))
+
+    if method == 'permutation':
+        # the permutations test the reduced form of the permuted columns only
+        terms = [zcolumns[i] for i in options['permute_z']]
+        reduced = np.linalg.lstsq(z, y, rcond=None)[0][options['permute_z']]
+        draws = pd.DataFrame(np.vstack([batch[0] for batch in batches]), columns=terms)
+        return ResampleResults(params=pd.Series(reduced, index=terms), draws=draws, tstats=None,
+                               analytic_se=None, method=method)
+
+    draws = pd.DataFrame(np.vstack([batch[0] for batch in batches]), columns=names)
+    tstats = None
+    if method == 'wild':
+        tstats = pd.DataFrame(np.vstack([batch[1] for batch in batches]), columns=names)
+
+    return ResampleResults(params=pd.Series(params, index=names), draws=draws, tstats=tstats,
+                           analytic_se=pd.Series(analytic_se, index=names), method=method)
+
+def _spec_grid_job(task):
+
+    '''
+    Fits one chunk of a specification grid on one sample. Runs in a worker process.
+    '''
+
+    from scipy import linalg
+
+    sample, values, gram, columns, designs, outcomes = task
+    position = {column: i for i, column in enumerate(columns)}
+    y_index = [position[column] for column in outcomes]
+    rows = []
+
+    for instruments, controls, endog in designs:
+
+        xcols = list(controls) + list(endog)
+        zcols = list(controls) + list(instruments)
+        x_index = [position[column] for column in xcols]
+        z_index = [position[column] for column in zcols]
+
+        # first stage from the cached cross-products, factored once for every outcome
+        szx = gram[np.ix_(z_index, x_index)]
+        first = linalg.cho_solve(linalg.cho_factor(gram[np.ix_(z_index, z_index)]), szx)
+        hat_gram = first.T @ szx
+        params = np.linalg.solve(hat_gram, first.T @ gram[np.ix_(z_index, y_index)])
+
+        # robust standard errors need the residuals, the only step that touches every row
+        xhat = values[:, z_index] @ first
+        eps = values[:, y_index] - values[:, x_index] @ params
+        cov = _sandwich(xhat, np.linalg.inv(hat_gram), eps, 'robust', False, len(values) - len(xcols))
+        se = np.sqrt(np.diagonal(cov, axis1=1, axis2=2)).T
+
+        for j, outcome in enumerate(outcomes):
+            for i, term in enumerate(xcols):
+                rows.append((sample, outcome, ' '.join(instruments), ' '.join(controls), len(controls),
+                             term, params[i, j], se[i, j]))
+
+    return rows
+
+@instrument
+def spec_grid(df, outcomes, endog, instruments, controls, always=['const'], samples={'all': None},
+              min_controls=0, max_controls=None, n_workers=None, chunk_size=64):
+
+    '''
+    Fits every combination of outcome, instrument set, subset of the optional controls, and
+    sample by 2SLS with heteroskedasticity-robust standard errors (as iv2sls with 
+    cov_type='robust'). For each sample the design matrix and the cross-products of every 
+    grid column are computed once and shared by all specifications, so a specification's 
+    coefficients come from a Cholesky factorization of small submatrices rather than from 
+    the data, and all outcomes are solved against the same factor. Only the residuals for 
+    the standard errors touch every row. Chunks of specifications are fit in parallel across 
+    a process pool.
+
+    Within a sample, rows missing any grid column are dropped, so every specification on a
+    sample uses the same observations. Controls that are constant within a sample (e.g. 
+    urban in an urban-only sample) are left out of that sample's subsets.
+
+    inputs:
+        df: dataframe with every grid column
+        outcomes: list of outcomes
+        endog: list of endogenous regressors
+        instruments: list of instrument sets, each a list of excluded instruments
+        controls: list of optional controls; every subset is a specification
+        always: controls included in every specification
+        samples: dictionary of sample name to pandas query string selecting the sample's 
+        rows. None selects every row.
+        min_controls, max_controls: bounds on the number of optional controls
+        n_workers: number of worker processes. None uses the number of cores; 1 runs in 
+        this process.
+        chunk_size: number of specifications per task
+    outputs:
+        results: long dataframe with one row per specification, outcome and term, with 
+        columns sample, outcome, instruments, controls, n_controls, term, coef, std_error, 
+        pvalue and nobs
+    '''
+
+    instrument_columns = list(dict.fromkeys(column for instrument_set in instruments for column in instrument_set))
+    columns = list(dict.fromkeys(list(always) + list(controls) + list(endog) + instrument_columns + list(outcomes)))
+
+    tasks = []
+    nobs = {}
+
+    for sample, query in samples.items():
+
+        data = df if query is None else df.query(query)
+        data = data[columns].dropna()
+        values = data.to_numpy(dtype=float)
+        gram = values.T @ values
+        nobs[sample] = len(values)
+
+        varying = [column for column in controls if data[column].nunique() > 1]
+        top = len(varying) if max_controls is None else min(max_controls, len(varying))
+
+        designs = [(tuple(instrument_set), tuple(always) + subset, tuple(endog))
+                   for instrument_set in instruments
+                   for size in range(min_controls, top + 1)
+                   for subset in itertools.combinations(varying, size)]
+
+        for start in range(0, len(designs), chunk_size):
+            tasks.append((sample, values, gram, columns, designs[start:start + chunk_size], list(outcomes)))
+
+    if n_workers == 1:
+        chunks = [_spec_grid_job(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            chunks = list(executor.map(_spec_grid_job, tasks))
+
+    results = pd.DataFrame([row for chunk in chunks for row in chunk],
+                           columns=['sample', 'outcome', 'instruments', 'controls', 'n_controls', 'term', 'coef', 'std_error'])
+    from scipy import stats
+
+    results['pvalue'] = 2 * stats.norm.sf(np.abs(results['coef'] / results['std_error']))
+    results['nobs'] = results['sample'].map(nobs)
+
+    return results
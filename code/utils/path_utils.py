@@ -0,0 +1,152 @@
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import contextvars
+import os
+
+# directory holding this repository's code
+CODE_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# environment variables read as the default project root and config file, e.g. by
+# subprocesses started with project_env
+ROOT_VARIABLE = 'TAXPREP_ROOT'
+CONFIG_VARIABLE = 'TAXPREP_CONFIG'
+
+# (root, config) of the project used in the current context. contexts are local to a
+# thread (and copied into threads started with contextvars.copy_context), so runs on
+# different projects in one process do not see each other's paths
+_PROJECT = contextvars.ContextVar('project', default=None)
+
+def current_project():
+
+    '''
+    Returns the project root and config file used in the current context: those set with
+    use_project or set_project, or else the TAXPREP_ROOT and TAXPREP_CONFIG environment
+    variables, or else this repository and its 'code/config/data.yaml'.
+
+    inputs: None
+    outputs:
+        root: absolute path of the project directory holding data/ and results/
+        config: absolute path of the yaml config file
+    '''
+
+    project = _PROJECT.get()
+
+    if project is None:
+        root = os.environ.get(ROOT_VARIABLE) or os.path.dirname(CODE_DIR)
+        config = os.environ.get(CONFIG_VARIABLE)
+    else:
+        root, config = project
+
+    root = os.path.abspath(root)
+    config = os.path.abspath(config) if config else os.path.join(root, 'code', 'config', 'data.yaml')
+
+    return root, config
+
+def _resolve(root=None, config=None):
+
+    '''
+    Returns the (root, config) pair for a new project setting. A new root brings its own
+    default config file; None keeps the current value.
+    '''
+
+    current_root, current_config = current_project()
+
+    if root is None:
+        return current_root, (current_config if config is None else os.path.abspath(config))
+
+    return os.path.abspath(root), (None if config is None else os.path.abspath(config))
+
+def set_project(root=None, config=None):
+
+    '''
+    Sets the project root, which data, results, cache and relative config paths are
+    resolved against, and the config file read by load_config, for the rest of the
+    current context (e.g. a script's main thread). Nothing depends on the working
+    directory. Use use_project to set the project for a block of code only.
+
+    inputs:
+        root: project directory holding data/ and results/. None keeps the current root,
+        which is the repository by default.
+        config: path to the yaml config file. None keeps the current config file, which is
+        '<root>/code/config/data.yaml' by default.
+    outputs: None
+    '''
+
+    _PROJECT.set(_resolve(root=root, config=config))
+
+    return None
+
+@contextlib.contextmanager
+def use_project(root=None, config=None):
+
+    '''
+    Context manager which sets the project (see set_project) for the code inside the
+    block, and restores the previous project when the block exits.
+
+    inputs:
+        root: project directory holding data/ and results/. None keeps the current root.
+        config: path to the yaml config file. None keeps the current config file.
+    outputs: None
+    '''
+
+    token = _PROJECT.set(_resolve(root=root, config=config))
+
+    try:
+        yield None
+    finally:
+        _PROJECT.reset(token)
+
+def project_path(*parts):
+
+    '''
+    Returns an absolute path inside the current project root, e.g. project_path('data', 'clean').
+    Absolute parts are returned unchanged.
+
+    inputs:
+        parts: path components relative to the project root
+    outputs:
+        path: absolute, normalized path
+    '''
+
+    return os.path.normpath(os.path.join(current_project()[0], *parts))
+
+def config_path():
+
+    '''
+    Returns the absolute path of the config file read by load_config.
+
+    inputs: None
+    outputs:
+        path: path to the yaml config file
+    '''
+
+    return current_project()[1]
+
+def project_env():
+
+    '''
+    Returns a copy of the environment with TAXPREP_ROOT and TAXPREP_CONFIG set to the
+    current project, for starting subprocesses on the same project.
+
+    inputs: None
+    outputs:
+        env: dictionary of environment variables
+    '''
+
+    root, config = current_project()
+
+    return dict(os.environ, **{ROOT_VARIABLE: root, CONFIG_VARIABLE: config})
+
+def project_executor(max_workers=None):
+
+    '''
+    Returns a ProcessPoolExecutor whose worker processes resolve paths against the
+    current project, whichever start method the pool uses.
+
+    inputs:
+        max_workers: number of worker processes. None uses the number of cores.
+    outputs:
+        executor: concurrent.futures.ProcessPoolExecutor
+    '''
+
+    return ProcessPoolExecutor(max_workers=max_workers, initializer=set_project, initargs=current_project())
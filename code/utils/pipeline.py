@@ -0,0 +1,398 @@
+import argparse
+from cache_utils import CACHE_DIR, function_source, hash_file
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import data_utils
+from data_utils import *
+import hashlib
+import json
+import os
+from path_utils import CODE_DIR, project_env
+import subprocess
+import sys
+
+# intermediate files, relative to the project root
+INTERMEDIATE_DIR = 'data/intermediate/'
+
+# data_utils functions called by each cleaning stage, directly or through one another. the
+# stages are keyed on the source code of these functions rather than on all of
+# data_utils.py, so editing the regression, table or summary helpers does not rerun them
+PREP_COUNTS_FUNCTIONS = ['load_config', 'county_prep_counts', 'get_paid_prep_counts', '_get_paid_prep_count_job', 'get_paid_prep_count',
+                         'get_prep_file_path', 'build_zip_counts', 'zip_to_county', 'allocate_to_county', 'get_xwalk_matrix',
+                         '_xwalk_matrix', 'read_xwalk_weights']
+MERGE_METRO_FUNCTIONS = ['merge_metro', 'read_metro']
+MERGE_DEMOG_FUNCTIONS = ['merge_demog', 'read_demog', 'parse_geo_fips']
+MERGE_SOI_FUNCTIONS = ['load_config', 'merge_soi', 'read_soi', 'stream_soi', 'get_cfips', 'make_state_indicators', 'write_clean_data',
+                       'apply_schema', 'memory_report']
+PANEL_FUNCTIONS = ['build_panel', '_build_panel_year_job', 'build_panel_year', 'panel_year_sources', 'write_clean_data', 'apply_schema',
+                   'memory_report'] + data_utils.PANEL_YEAR_DEPENDS + ['load_config']
+
+class Stage:
+
+    '''
+    A single step of the data pipeline.
+
+    attributes:
+        name: unique stage name
+        command: argument list run to build the stage
+        inputs: list of files the stage reads. a stage depends on every other stage that
+        lists one of its inputs as an output.
+        outputs: list of files the stage writes
+        config_keys: list of data.yaml keys the stage reads. only changes to these keys
+        mark the stage as out of date.
+        functions: list of functions the stage runs. changes to their source code mark the
+        stage as out of date, while edits elsewhere in the same files do not.
+    '''
+
+    def __init__(self, name, command, inputs, outputs, config_keys=[], functions=[]):
+        self.name = name
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.config_keys = config_keys
+        self.functions = functions
+
+    def signature(self, out):
+
+        '''
+        Returns a hash of the stage's command, input file contents, config values and
+        function source code.
+        '''
+
+        payload = {'command': self.command,
+                   'inputs': {path: hash_file(path) for path in self.inputs},
+                   'config': {key: out.get(key) for key in self.config_keys},
+                   'code': hashlib.sha256(function_source(self.functions).encode()).hexdigest()}
+
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+def _intermediate(name):
+
+    '''
+    Returns the path of an intermediate file in the project.
+    '''
+
+    return project_path(INTERMEDIATE_DIR, name)
+
+def _code(path):
+
+    '''
+    Returns the path of a file in the repository's code directory, e.g. 'utils/data_utils.py'.
+    '''
+
+    return os.path.join(CODE_DIR, path)
+
+def _state_path():
+
+    '''
+    Returns the path of the file recording stage signatures.
+    '''
+
+    return project_path(CACHE_DIR, 'pipeline_state.json')
+
+def _function_stage(name, *args):
+
+    '''
+    Builds the command that runs one of the stage_* functions below in a fresh interpreter.
+    '''
+
+    return [sys.executable, os.path.abspath(__file__), '--run-stage', name] + list(args)
+
+def _functions(names):
+
+    '''
+    Returns the data_utils functions with the given names.
+    '''
+
+    return [getattr(data_utils, name) for name in names]
+
+def _script_stage(script, *args):
+
+    '''
+    Builds the command that runs one of the scripts in code/analysis.
+    '''
+
+    return [sys.executable, _code('analysis/' + script)] + list(args)
+
+def build_stages(out):
+
+    '''
+    Declares the stages of the pipeline, from the raw preparer listings through to the
+    tables and figures.
+
+    inputs:
+        out: config dictionary returned by load_config
+    outputs:
+        stages: list of Stage objects
+    '''
+
+    years = ['2017', '2021']
+    states = list(dict.fromkeys(out['states']))
+    paths = out['prep_paths']
+    clean = [project_path('data/clean/dat_clean.feather'), project_path('data/clean/dat_clean_agi.feather')]
+
+    stages = []
+
+    for year in years:
+        stages.append(Stage('prep_counts_' + year,
+                            _function_stage('prep_counts', year),
+                            inputs=[get_prep_file_path(state=state, year=year, paths=paths) for state in states]
+                            + [project_path('data/raw/zip_county_xwalk/ZIP_COUNTY_03' + year + '.csv')],
+                            outputs=[_intermediate('prep_counts_' + year + '.parquet')],
+                            config_keys=['states', 'xwalk_weight'],
+                            functions=[stage_prep_counts] + _functions(PREP_COUNTS_FUNCTIONS)))
+
+    stages.append(Stage('merge_metro',
+                        _function_stage('merge_metro'),
+                        inputs=[_intermediate('prep_counts_' + year + '.parquet') for year in years]
+                        + [project_path('data/raw/urban_rural/Ruralurbancontinuumcodes2023.xlsx')],
+                        outputs=[_intermediate('merged_metro.parquet')],
+                        functions=[stage_merge_metro] + _functions(MERGE_METRO_FUNCTIONS)))
+
+    stages.append(Stage('merge_demog',
+                        _function_stage('merge_demog'),
+                        inputs=[_intermediate('merged_metro.parquet')]
+                        + [project_path('data/raw/census/census_' + name + '.csv') for name in ['5yr_acs_2021', 'econ_2021', 'educ_2021', 'marriage_2021']],
+                        outputs=[_intermediate('merged_demog.parquet')],
+                        functions=[stage_merge_demog] + _functions(MERGE_DEMOG_FUNCTIONS)))
+
+    stages.append(Stage('merge_soi',
+                        _function_stage('merge_soi'),
+                        inputs=[_intermediate('merged_demog.parquet')]
+                        + [project_path('data/raw/SOI', name) for name in ['21incyallnoagi.csv', '17incyallnoagi.csv', '21incyallagi.csv', '17incyallagi.csv']],
+                        outputs=clean,
+                        config_keys=['infl_mpl', 'agi_bin_dict', 'agi_17_bin_dict', 'clean_dtypes'],
+                        functions=[stage_merge_soi] + _functions(MERGE_SOI_FUNCTIONS)))
+
+    stages.append(Stage('panel',
+                        _script_stage('build_panel.py'),
+                        inputs=[path for year in out['panel_years'] for path in panel_year_sources(str(year), states, out['xwalk_weight'])]
+                        + [_code('analysis/build_panel.py')],
+                        outputs=[project_path('data/clean/dat_panel.feather')],
+                        config_keys=['panel_years', 'prep_paths', 'states', 'xwalk_weight', 'clean_dtypes'],
+                        functions=_functions(PANEL_FUNCTIONS)))
+
+    stages.append(Stage('summary_stats',
+                        _script_stage('summary_stats.py'),
+                        inputs=[clean[0], _code('analysis/summary_stats.py'), _code('utils/taxprep.py'), _code('utils/data_utils.py'), _code('utils/table_utils.py')],
+                        outputs=[project_path('results/tables/summ_stats.tex')],
+                        config_keys=['summ_stats', 'summ_stats_years', 'summ_stats_weights', 'summ_stats_by']))
+
+    stages.append(Stage('regs',
+                        _script_stage('regs.py'),
+                        inputs=[clean[0], _code('analysis/regs.py'), _code('utils/taxprep.py'), _code('utils/data_utils.py'), _code('utils/iv_utils.py'), _code('utils/table_utils.py')],
+                        outputs=[project_path('results/tables/fs.txt')]
+                        + [project_path('results/tables/ss_' + outcome + '.tex') for outcome in ['share_eip', 'mean_eip', 'share_ctc_dif', 'mean_ctc_dif', 'share_eitc_dif', 'mean_eitc_dif']],
+                        config_keys=[key for key in out if key.startswith('fs_') or key.startswith('spec_')] + ['table_labels']))
+
+    stages.append(Stage('plot_eitc',
+                        _script_stage('plots.py', 'eitc'),
+                        inputs=[project_path('data/clean/eitc_fig_data.csv'), _code('analysis/plots.py'), _code('utils/taxprep.py')],
+                        outputs=[project_path('results/figures/eitc_amts.png')]))
+
+    stages.append(Stage('plot_heatmap',
+                        _script_stage('plots.py', 'heatmap'),
+                        inputs=[clean[0], project_path('data/raw/geography/cb_2018_us_county_500k.shp'), _code('analysis/plots.py'), _code('utils/taxprep.py'),
+                                _code('utils/data_utils.py'), _code('utils/plot_utils.py')],
+                        outputs=[project_path('results/figures/prep_use_21_heatmap.png')],
+                        config_keys=['geo_drop_states', 'geo_crs', 'geo_tolerance', 'map_default', 'map_variables']))
+
+    stages.append(Stage('maps',
+                        _script_stage('maps.py'),
+                        inputs=[clean[0], project_path('data/raw/geography/cb_2018_us_county_500k.shp'), _code('analysis/maps.py'), _code('utils/data_utils.py'),
+                                _code('utils/plot_utils.py')],
+                        outputs=[project_path('results/figures/maps/map_' + variable + '.' + fmt) for variable in out['map_variables'] for fmt in ['png', 'pdf']],
+                        config_keys=['geo_drop_states', 'geo_crs', 'geo_tolerance', 'map_default', 'map_variables']))
+
+    return stages
+
+def stage_prep_counts(year):
+
+    '''
+    Writes county-level preparer counts for one year to the intermediate directory.
+    '''
+
+    out = load_config()
+
+    dat_dict = county_prep_counts(years=[year], states=out['states'], n_workers=out['n_workers'], 
+                                  xwalk_weight=out['xwalk_weight'])
+
+    dat_dict[year].to_parquet(_intermediate('prep_counts_' + year + '.parquet'))
+
+    return None
+
+def stage_merge_metro():
+
+    '''
+    Merges the yearly preparer counts and the rural-urban continuum codes.
+    '''
+
+    df = pd.merge(pd.read_parquet(_intermediate('prep_counts_2021.parquet')),
+                  pd.read_parquet(_intermediate('prep_counts_2017.parquet')),
+                  how='left', on='county', validate='1:1')
+
+    df = merge_metro(df)
+
+    df.to_parquet(_intermediate('merged_metro.parquet'))
+
+    return None
+
+def stage_merge_demog():
+
+    '''
+    Merges the Census ACS variables.
+    '''
+
+    df = merge_demog(pd.read_parquet(_intermediate('merged_metro.parquet')))
+
+    df.to_parquet(_intermediate('merged_demog.parquet'))
+
+    return None
+
+def stage_merge_soi():
+
+    '''
+    Merges the SOI filing data and writes the clean data files.
+    '''
+
+    df, df_agi = merge_soi(pd.read_parquet(_intermediate('merged_demog.parquet')))
+
+    write_clean_data(df, name='dat_clean')
+    write_clean_data(df_agi, name='dat_clean_agi')
+
+    return None
+
+def _load_state():
+
+    '''
+    Reads the signatures recorded for each stage the last time it was built.
+    '''
+
+    path = _state_path()
+
+    if os.path.exists(path):
+        with open(path, 'r') as stream:
+            return json.load(stream)
+
+    return {}
+
+def _save_state(state):
+
+    '''
+    Records stage signatures, replacing the state file atomically.
+    '''
+
+    path = _state_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path + '.tmp', 'w') as stream:
+        json.dump(state, stream, indent=2)
+    os.replace(path + '.tmp', path)
+
+    return None
+
+def run_pipeline(targets=None, jobs=None, force=False, dry_run=False):
+
+    '''
+    Runs the pipeline, rebuilding only the stages whose outputs are missing or whose inputs
+    or config values have changed since they were last built. Stages whose upstream stages
+    are complete run in parallel.
+
+    inputs:
+        targets: list of stage names to bring up to date, along with every stage they depend
+        on. None builds every stage.
+        jobs: maximum number of stages to run at once. None uses the number of cores.
+        force: if True, rebuilds every selected stage
+        dry_run: if True, prints the stages that are out of date without running them.
+        stages downstream of an out-of-date stage may also rebuild once it has run.
+    outputs:
+        ran: list of names of the stages that were rebuilt (or would be, for a dry run)
+    '''
+
+    out = load_config()
+    stages = {stage.name: stage for stage in build_stages(out)}
+
+    producers = {path: stage.name for stage in stages.values() for path in stage.outputs}
+    deps = {name: {producers[path] for path in stage.inputs if path in producers} for name, stage in stages.items()}
+
+    # restrict to the requested targets and their upstream stages
+    selected = set()
+    pending = list(targets if targets is not None else stages)
+    while pending:
+        name = pending.pop()
+        if name not in stages:
+            raise ValueError('unknown stage: ' + name)
+        if name not in selected:
+            selected.add(name)
+            pending.extend(deps[name])
+
+    state = _load_state()
+    done = set()
+    ran = []
+    running = {}
+
+    os.makedirs(project_path(INTERMEDIATE_DIR), exist_ok=True)
+
+    # stages run in subprocesses on this project
+    env = project_env()
+
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as executor:
+
+        while len(done) < len(selected):
+
+            for name in sorted(selected - done - set(running.values())):
+                if not deps[name] <= done:
+                    continue
+                stage = stages[name]
+
+                if dry_run and deps[name] & set(ran):
+                    print('out of date: ' + name)
+                    ran.append(name)
+                    done.add(name)
+                    continue
+
+                missing = [path for path in stage.inputs if not os.path.exists(path)]
+                if missing:
+                    raise FileNotFoundError('stage ' + name + ' is missing ' + str(len(missing)) + ' input(s), e.g. ' + missing[0])
+
+                signature = stage.signature(out)
+                stale = force or state.get(name) != signature or not all(os.path.exists(path) for path in stage.outputs)
+
+                if not stale:
+                    done.add(name)
+                elif dry_run:
+                    print('out of date: ' + name)
+                    ran.append(name)
+                    done.add(name)
+                else:
+                    print('running ' + name)
+                    running[executor.submit(subprocess.run, stage.command, check=True, env=env)] = name
+                    ran.append(name)
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                name = running.pop(future)
+                future.result()
+                state[name] = stages[name].signature(out)
+                _save_state(state)
+                done.add(name)
+
+    return ran
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Rebuild out-of-date stages of the data pipeline.')
+    parser.add_argument('targets', nargs='*', help='stages to build (default: all)')
+    parser.add_argument('--jobs', type=int, default=None, help='maximum number of stages to run at once')
+    parser.add_argument('--force', action='store_true', help='rebuild every selected stage')
+    parser.add_argument('--dry-run', action='store_true', help='list out-of-date stages without running them')
+    parser.add_argument('--run-stage', nargs='+', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_stage:
+        globals()['stage_' + args.run_stage[0]](*args.run_stage[1:])
+    else:
+        run_pipeline(targets=args.targets or None, jobs=args.jobs, force=args.force, dry_run=args.dry_run)
@@ -0,0 +1,285 @@
+from cache_utils import CACHE_DIR, cache_key, evict_cache
+import inspect
+import matplotlib as mpl
+from matplotlib.collections import PatchCollection
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.patches import PathPatch
+from matplotlib.path import Path
+import numpy as np
+import os
+import pandas as pd
+from path_utils import project_executor, project_path
+import shapely
+
+# geopandas, mapclassify and seaborn are imported in the functions that use them, so that
+# importing this module does not load them until a map is drawn
+
+# county shapefile, relative to the project root
+GEOMETRY_PATH = 'data/raw/geography/cb_2018_us_county_500k.shp'
+
+def prepare_geometry(path=None, drop_states=['02', '15', '66', '72', '78'], crs=None, tolerance=0):
+
+    '''
+    Reads the Census county shapefile and prepares it for drawing: drops the listed states
+    in one filter, projects to the plotting CRS, and simplifies the county borders. Counties
+    are simplified as a coverage, so neighbouring counties keep identical shared borders
+    and no gaps or overlaps open up between them.
+
+    inputs:
+        path: path to the county shapefile. None uses GEOMETRY_PATH in the project.
+        drop_states: list of two-digit state FIPS codes to leave off the map
+        crs: CRS to project to, e.g. 'EPSG:5070'. None keeps the shapefile's CRS.
+        tolerance: simplification tolerance in units of the plotting CRS. 0 keeps every
+        vertex.
+    outputs:
+        geo: geodataframe with columns 'county' (five-digit FIPS code as an integer), 'NAME',
+        'STATEFP' and 'geometry'
+    '''
+
+    import geopandas as gpd
+
+    path = project_path(GEOMETRY_PATH) if path is None else path
+    geo = gpd.read_file(path, columns=['GEOID', 'STATEFP', 'NAME'])
+
+    geo = geo.loc[~geo.STATEFP.isin(drop_states)].reset_index(drop=True)
+    geo['county'] = geo.GEOID.astype(int)
+
+    if crs is not None:
+        geo = geo.to_crs(crs)
+
+    if tolerance:
+        geo['geometry'] = shapely.coverage_simplify(geo.geometry.values, tolerance)
+
+    return geo[['county', 'NAME', 'STATEFP', 'geometry']]
+
+def load_geometry(out, use_cache=True):
+
+    '''
+    Returns the prepared county geometry (see prepare_geometry) for the 'geo_*' keys of the
+    config file. The prepared frame is stored as GeoParquet in the cache, keyed on the
+    shapefile contents and the config values, so the shapefile is only read and simplified
+    again when one of them changes.
+
+    inputs:
+        out: config dictionary returned by load_config
+        use_cache: if False, prepares the geometry from the shapefile without reading or
+        writing the cache
+    outputs:
+        geo: geodataframe with columns 'county', 'NAME', 'STATEFP' and 'geometry'
+    '''
+
+    import geopandas as gpd
+
+    arguments = {'drop_states': out['geo_drop_states'], 'crs': out['geo_crs'], 'tolerance': out['geo_tolerance']}
+
+    if not use_cache:
+        return prepare_geometry(**arguments)
+
+    key = cache_key('prepare_geometry', [project_path(GEOMETRY_PATH)], arguments, code=inspect.getsource(prepare_geometry))
+    path = os.path.join(project_path(CACHE_DIR), 'prepare_geometry_' + key[:24] + '.parquet')
+
+    if os.path.exists(path):
+        os.utime(path)
+        return gpd.read_parquet(path)
+
+    geo = prepare_geometry(**arguments)
+
+    os.makedirs(project_path(CACHE_DIR), exist_ok=True)
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    geo.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+    evict_cache()
+
+    return geo
+
+def county_collection(geo, ax, edgecolor='k', linewidth=0.1):
+
+    '''
+    Draws every county polygon on ax as a single PatchCollection, so a map for another
+    variable only needs new face colors rather than new patches.
+
+    inputs:
+        geo: geodataframe of county polygons (see load_geometry)
+        ax: matplotlib axes to draw on
+        edgecolor: border color
+        linewidth: border width
+    outputs:
+        collection: the PatchCollection added to ax
+        index: array giving the row of geo that each patch belongs to (multipolygon
+        counties have one patch per part)
+    '''
+
+    parts, index = shapely.get_parts(geo.geometry.values, return_index=True)
+
+    patches = [PathPatch(Path.make_compound_path(*[Path(np.asarray(ring.coords)[:, :2]) 
+                                                    for ring in [part.exterior] + list(part.interiors)]))
+               for part in parts]
+
+    collection = PatchCollection(patches, edgecolor=edgecolor, linewidth=linewidth)
+    ax.add_collection(collection, autolim=True)
+    ax.autoscale_view()
+
+    # lon/lat maps are stretched as geopandas does, so they look the same as geo.plot()
+    if geo.crs is not None and geo.crs.is_geographic:
+        ymin, ymax = geo.total_bounds[[1, 3]]
+        ax.set_aspect(1 / np.cos(np.deg2rad((ymin + ymax) / 2)))
+    else:
+        ax.set_aspect('equal')
+
+    return collection, index
+
+def classify_values(values, scheme):
+
+    '''
+    Assigns values to map classes and builds the legend labels for them.
+
+    inputs:
+        values: array of values, possibly with NaNs
+        scheme: dictionary with either 'bins' (upper bounds of user-defined classes) or
+        'scheme' and 'k' (a mapclassify scheme such as 'Quantiles'), plus optional 'labels'
+        (one per class) or 'fmt' (format of the default interval labels)
+    outputs:
+        classes: array of class indices, -1 where values are missing
+        labels: list of legend labels, one per class
+    '''
+
+    import mapclassify
+
+    missing = np.isnan(values)
+
+    if 'bins' in scheme:
+        binning = mapclassify.UserDefined(values[~missing], bins=scheme['bins'])
+    else:
+        binning = mapclassify.classify(values[~missing], scheme['scheme'], k=scheme.get('k', 5))
+
+    classes = np.full(len(values), -1)
+    classes[~missing] = binning.yb
+
+    labels = scheme.get('labels') or [label[1:-1] for label in binning.get_legend_classes(scheme.get('fmt', '{:.2f}'))]
+
+    if len(labels) != binning.k:
+        raise ValueError('scheme has ' + str(len(labels)) + ' labels for ' + str(binning.k) + ' classes')
+
+    return classes, labels
+
+def draw_map(collection, index, values, scheme, ax):
+
+    '''
+    Colors an existing county collection by one variable and replaces the legend. Counties
+    with missing values are left undrawn.
+
+    inputs:
+        collection, index: county collection and patch index from county_collection
+        values: array of values aligned with the rows of the county geometry
+        scheme: bin scheme (see classify_values), plus optional 'cmap' and 'title'
+        ax: axes holding the collection
+    outputs: None
+    '''
+
+    classes, labels = classify_values(np.asarray(values, dtype=float), scheme)
+
+    # class i gets color i / (k - 1) of the colormap, as in geopandas
+    cmap = mpl.colormaps[scheme.get('cmap', 'Greens')]
+    colors = cmap(np.arange(len(labels)) / max(len(labels) - 1, 1))
+
+    classes = classes[index]
+    facecolors = np.zeros((len(classes), 4))
+    facecolors[classes >= 0] = colors[classes[classes >= 0]]
+    edgecolors = np.zeros((len(classes), 4))
+    edgecolors[classes >= 0] = mpl.colors.to_rgba('k')
+
+    collection.set_facecolor(facecolors)
+    collection.set_edgecolor(edgecolors)
+
+    if ax.get_legend() is not None:
+        ax.get_legend().remove()
+
+    handles = [Line2D([0], [0], linestyle='none', marker='o', markersize=10, markerfacecolor=color, markeredgewidth=0)
+               for color in colors]
+
+    ax.legend(handles, labels, loc='lower left', bbox_to_anchor=(0.83, 0), title=scheme.get('title'), frameon=False, numpoints=1)
+
+    return None
+
+def _render_maps_job(job):
+
+    '''
+    Renders a batch of maps on one figure, swapping face colors between variables. Runs in
+    a worker process.
+    '''
+
+    import seaborn as sns
+
+    out, maps, formats, figsize = job
+
+    geo = load_geometry(out)
+
+    # the style is restored afterwards, so it does not leak into other figures drawn in this process
+    with mpl.rc_context():
+        sns.set_theme()
+        mpl.rcParams['font.family'] = 'serif'
+
+        fig = Figure(figsize=figsize)
+        ax = fig.add_subplot()
+        ax.set_axis_off()
+        collection, index = county_collection(geo, ax)
+
+        for values, scheme, path in maps:
+            draw_map(collection, index, values, scheme, ax)
+            for fmt in formats:
+                fig.savefig(path + '.' + fmt)
+
+    return [path for _, _, path in maps]
+
+def render_maps(df, out, variables=None, formats=['png'], directory=None, 
+                file_names={}, n_workers=None, figsize=(11.7*1.2, 8.27*1.1)):
+
+    '''
+    Draws a county choropleth for each variable. The county geometry is loaded once per
+    worker process and drawn once as a PatchCollection; each further map only swaps its
+    face colors. Variables are split into one batch per worker.
+
+    Bin schemes come from the config file: 'map_variables' maps each variable to a scheme
+    (see classify_values and draw_map) whose keys override those of 'map_default'.
+
+    inputs:
+        df: county-level dataframe with column 'county' and the variables to map
+        out: config dictionary returned by load_config
+        variables: list of variables to map. None maps every variable in 'map_variables'.
+        formats: list of file formats to write, e.g. ['png', 'pdf']
+        directory: output directory. None uses 'results/figures/maps' in the project.
+        file_names: dictionary of output file names (without extension) for some
+        variables. others are written to 'map_<variable>'.
+        n_workers: number of worker processes. None uses the number of cores; 1 draws the
+        maps in this process.
+        figsize: figure size in inches
+    outputs:
+        paths: list of output paths, without extensions
+    '''
+
+    variables = list(out['map_variables']) if variables is None else variables
+    directory = project_path('results/figures/maps') if directory is None else directory
+
+    # build the geometry cache before starting workers, and align the data to it
+    geo = load_geometry(out)
+    data = pd.merge(geo[['county']], df[['county'] + variables], how='left', on='county', validate='1:1')
+
+    os.makedirs(directory, exist_ok=True)
+
+    maps = [(data[variable].to_numpy(dtype=float),
+             {**out['map_default'], **(out['map_variables'].get(variable) or {})},
+             os.path.join(directory, file_names.get(variable, 'map_' + variable)))
+            for variable in variables]
+
+    n_batches = min(len(maps), n_workers or os.cpu_count())
+    jobs = [(out, maps[i::n_batches], formats, figsize) for i in range(n_batches)]
+
+    if n_batches == 1:
+        batches = [_render_maps_job(job) for job in jobs]
+    else:
+        with project_executor(max_workers=n_batches) as executor:
+            batches = list(executor.map(_render_maps_job, jobs))
+
+    return [path for batch in batches for path in batch]
@@ -0,0 +1,232 @@
+import contextlib
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pandas as pd
+import pstats
+import resource
+import sys
+import threading
+import time
+
+# list of stage records of the current run: one record per instrumented call, in the order
+# the calls finished. reset_records gives a run its own list in its context, which the
+# threads it starts in copies of that context append to, so runs in other threads keep
+# separate records. outside a run, calls share the process-wide default list
+RECORDS = contextvars.ContextVar('records', default=[])
+
+# the profile of the slowest outermost stage of the current run, kept with the same scope as RECORDS
+_SLOWEST = contextvars.ContextVar('slowest', default={'stage': None})
+
+# the process that enabled profiling
+_STATE = {'profile_pid': None}
+
+# nesting depth of the running stages, per thread, so stages run in parallel threads nest separately
+_LOCAL = threading.local()
+
+def _bytes_read():
+
+    '''
+    Returns the number of bytes this process has read so far, or None where the operating
+    system does not report it (Linux only).
+    '''
+
+    try:
+        with open('/proc/self/io', 'r') as stream:
+            for line in stream:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+    return None
+
+def _peak_rss():
+
+    '''
+    Returns the peak resident set size, in bytes, of this process or of any of its finished
+    worker processes, whichever is larger.
+    '''
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * scale
+
+def _cpu_time():
+
+    '''
+    Returns user plus system CPU time of this process and its finished worker processes.
+    '''
+
+    times = os.times()
+
+    return times.user + times.system + times.children_user + times.children_system
+
+def _rows(value):
+
+    '''
+    Counts the rows of a dataframe or series, or of every frame in a tuple, list or
+    dictionary. Returns None for anything else.
+    '''
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+
+    if isinstance(value, dict):
+        value = list(value.values())
+
+    if isinstance(value, (tuple, list)):
+        counts = [_rows(item) for item in value]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+
+    return None
+
+@contextlib.contextmanager
+def stage(name, rows_in=None):
+
+    '''
+    Context manager which records the wall time, CPU time (including finished worker
+    processes), peak resident memory, bytes read, and row counts of a block of code in
+    the current run's RECORDS. Set record['rows_out'] on the yielded record to report
+    output rows. If profiling is enabled (see enable_profiling), outermost stages are
+    run under cProfile and the profile of the slowest one is kept for write_run_report.
+
+    inputs:
+        name: stage name
+        rows_in: number of input rows, if known
+    outputs:
+        record: dictionary holding the stage measurements, filled in when the block exits
+    '''
+
+    depth = getattr(_LOCAL, 'depth', 0)
+    record = {'stage': name, 'depth': depth, 'pid': os.getpid(), 'rows_in': rows_in, 'rows_out': None}
+
+    profile = None
+    if depth == 0 and _STATE['profile_pid'] == os.getpid():
+        profile = cProfile.Profile()
+
+    bytes_read = _bytes_read()
+    cpu = _cpu_time()
+    start = time.perf_counter()
+
+    _LOCAL.depth = depth + 1
+    if profile is not None:
+        profile.enable()
+
+    try:
+        yield record
+    finally:
+        if profile is not None:
+            profile.disable()
+        _LOCAL.depth = depth
+
+        record['wall_s'] = time.perf_counter() - start
+        record['cpu_s'] = _cpu_time() - cpu
+        record['peak_rss_mb'] = _peak_rss() / 1024**2
+        record['bytes_read'] = None if bytes_read is None else _bytes_read() - bytes_read
+
+        RECORDS.get().append(record)
+
+        slowest = _SLOWEST.get()
+        if profile is not None and (slowest['stage'] is None or record['wall_s'] > slowest['stage'][0]['wall_s']):
+            slowest['stage'] = (record, profile)
+
+def instrument(func):
+
+    '''
+    Decorator which runs every call of func as a stage (see stage), named after the
+    function. Input rows are the rows of the largest dataframe or series argument, and
+    output rows are counted from the return value.
+    '''
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+
+        rows_in = [_rows(arg) for arg in list(args) + list(kwargs.values()) if isinstance(arg, (pd.DataFrame, pd.Series))]
+
+        with stage(func.__name__, rows_in=max(rows_in) if rows_in else None) as record:
+            result = func(*args, **kwargs)
+            record['rows_out'] = _rows(result)
+
+        return result
+
+    return wrapper
+
+def enable_profiling():
+
+    '''
+    Profiles every outermost stage in this process with cProfile from now on, keeping the
+    profile of the slowest one for write_run_report.
+
+    inputs: None
+    outputs: None
+    '''
+
+    _STATE['profile_pid'] = os.getpid()
+
+    return None
+
+def reset_records():
+
+    '''
+    Starts a new list of stage records and a new kept profile in the current context, so
+    that a run in a long-running process reports only its own stages. Runs in other
+    threads keep their own records, and the stages of this run, including those in
+    threads started in copies of its context, are recorded in the new list.
+
+    inputs: None
+    outputs: None
+    '''
+
+    RECORDS.set([])
+    _SLOWEST.set({'stage': None})
+
+    return None
+
+def write_run_report(path, top=30):
+
+    '''
+    Writes the stage records of the current run (see reset_records) to '<path>.json'
+    (with run metadata) and '<path>.csv'. If profiling was enabled, the profile of the
+    slowest outermost stage is written to '<path>_<stage>.prof' (readable with pstats or
+    snakeviz), along with a text summary of its most expensive functions in
+    '<path>_<stage>.txt'.
+
+    inputs:
+        path: output path, without extension
+        top: number of functions listed in the profile summary
+    outputs:
+        records: dataframe with one row per stage call
+    '''
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    columns = ['stage', 'depth', 'pid', 'wall_s', 'cpu_s', 'peak_rss_mb', 'rows_in', 'rows_out', 'bytes_read']
+    records = pd.DataFrame(RECORDS.get(), columns=columns)
+
+    report = {'command': sys.argv,
+              'finished': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'peak_rss_mb': _peak_rss() / 1024**2,
+              'stages': RECORDS.get()}
+
+    with open(path + '.json', 'w') as stream:
+        json.dump(report, stream, indent=2)
+
+    records.to_csv(path + '.csv', index=False)
+
+    if _SLOWEST.get()['stage'] is not None:
+        record, profile = _SLOWEST.get()['stage']
+        profile.dump_stats(path + '_' + record['stage'] + '.prof')
+
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(top)
+        with open(path + '_' + record['stage'] + '.txt', 'w') as stream:
+            stream.write(summary.getvalue())
+
+    return records
@@ -0,0 +1,145 @@
+import csv
+import numpy as np
+import pandas as pd
+
+# significance stars, checked in order against p-values rounded to three digits
+STARS = [(0.01, r'^{***}'), (0.05, r'^{**}'), (0.1, r'^{*}')]
+
+def results_frame(results):
+
+    '''
+    Collects fitted results into one frame that tables are rendered from. Works with
+    linearmodels and statsmodels results as well as the results classes in iv_utils.
+
+    inputs:
+        results: list of fitted results, one per table column
+    outputs:
+        frame: dataframe with one column per result. rows are indexed by (stat, term), with
+        stats 'estimate', 'se' and 'pvalue' for each coefficient, and 'nobs', 'rsquared'
+        and 'fvalue' (term '') for each model.
+    '''
+
+    columns = []
+
+    for res in results:
+
+        se = res.std_errors if hasattr(res, 'std_errors') else res.bse
+        model = pd.Series({'nobs': res.nobs,
+                           'rsquared': getattr(res, 'rsquared', np.nan),
+                           'fvalue': getattr(res, 'fvalue', np.nan)})
+        model.index = pd.MultiIndex.from_product([model.index, ['']])
+
+        columns.append(pd.concat([pd.concat({'estimate': res.params, 'se': se, 'pvalue': res.pvalues}), model]))
+
+    return pd.concat(columns, axis=1, keys=range(len(columns)))
+
+def format_value(value, digits=3):
+
+    '''
+    Formats one table value: rounded to digits, or truncated to an integer if digits is
+    'int'. Missing values are left blank.
+    '''
+
+    if pd.isna(value):
+        return ''
+    if digits == 'int':
+        return str(int(value))
+
+    return str(np.round(value, digits))
+
+def render_rows(frame, rows, digits=3, se_digits=3):
+
+    '''
+    Renders a row spec against a results frame.
+
+    Each entry of rows is a dictionary of one of these kinds:
+        {'term': name, 'label': text, 'se_label': text}: the estimates of a coefficient,
+        with significance stars, followed by a row of standard errors in parentheses.
+        optional keys 'digits' and 'se_digits' override the defaults, and 'stars': False
+        drops the stars.
+        {'stat': name, 'label': text}: a model statistic such as 'nobs', with optional
+        'digits'
+        {'label': text, 'cells': [text, ...]}: a row of literal cells
+        {'text': text}: a literal line, such as \\hline, written to .tex and .txt files only
+
+    inputs:
+        frame: results frame (see results_frame)
+        rows: list of row dictionaries
+        digits: default number of digits for estimates and statistics
+        se_digits: default number of digits for standard errors
+    outputs:
+        lines: list of rendered entries, each either a list of cells (label first) or a
+        string for a literal line
+    '''
+
+    lines = []
+
+    for row in rows:
+
+        if 'text' in row:
+            lines.append(row['text'])
+
+        elif 'cells' in row:
+            lines.append([row['label']] + list(row['cells']))
+
+        elif 'stat' in row:
+            values = frame.loc[(row['stat'], '')]
+            lines.append([row['label']] + [format_value(value, row.get('digits', digits)) for value in values])
+
+        else:
+            term = row['term']
+            estimates = frame.loc[('estimate', term)] if ('estimate', term) in frame.index else pd.Series(np.nan, index=frame.columns)
+            se = frame.loc[('se', term)] if ('se', term) in frame.index else pd.Series(np.nan, index=frame.columns)
+            pvalues = frame.loc[('pvalue', term)] if ('pvalue', term) in frame.index else pd.Series(np.nan, index=frame.columns)
+
+            cells = []
+            for estimate, p in zip(estimates, pvalues):
+                cell = format_value(estimate, row.get('digits', digits))
+                if cell and row.get('stars', True) and not pd.isna(p):
+                    cell += next((star for cutoff, star in STARS if np.round(p, 3) < cutoff), '')
+                cells.append(cell)
+
+            lines.append([row['label']] + cells)
+            lines.append([row.get('se_label', '')] + ['(' + format_value(value, row.get('se_digits', se_digits)) + ')' if not pd.isna(value) else ''
+                                                      for value in se])
+
+    return lines
+
+def write_table(frame, rows, paths, header=[], footer=[], digits=3, se_digits=3):
+
+    '''
+    Renders a table once and writes it to each path, in a format chosen by the extension:
+    .tex and .txt files get LaTeX rows between the header and footer lines, and .csv files
+    get one line per table row, without the LaTeX markup.
+
+    inputs:
+        frame: results frame (see results_frame)
+        rows: row spec (see render_rows)
+        paths: list of output paths
+        header: list of literal LaTeX lines written before the rows
+        footer: list of literal LaTeX lines written after the rows
+        digits: default number of digits for estimates and statistics
+        se_digits: default number of digits for standard errors
+    outputs: None
+    '''
+
+    lines = render_rows(frame, rows, digits=digits, se_digits=se_digits)
+
+    for path in paths:
+
+        if path.endswith('.csv'):
+            with open(path, mode='w', newline='') as output:
+                writer = csv.writer(output)
+                for line in lines:
+                    if not isinstance(line, str):
+                        writer.writerow([cell.replace('^{', '').replace('}', '').replace('\\quad', '').strip() for cell in line])
+        else:
+            with open(path, mode='w') as output:
+                for line in header:
+                    print(line, file=output)
+                for line in lines:
+                    print(line if isinstance(line, str) else ' & '.join(line) + r' \\', file=output)
+                for line in footer:
+                    print(line, file=output)
+
+    return None
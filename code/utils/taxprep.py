@@ -0,0 +1,395 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from data_utils import *
+import os
+from profile_utils import enable_profiling, reset_records, write_run_report
+
+# stages in the order run() runs them. every stage after 'clean' reads the clean data, and
+# they are independent of each other
+STAGES = ['clean', 'stats', 'regs', 'plots']
+
+# second-stage outcomes of the regression tables
+OUTCOMES = ['share_eip', 'mean_eip', 'share_ctc_dif', 'mean_ctc_dif', 'share_eitc_dif', 'mean_eitc_dif']
+
+# summary table rows: (label, label of the standard deviation row, scale, digits of the mean, digits of the standard deviation)
+SUMMARY_FORMATS = {'share_using_pp': ('Share using paid preparer', '', 1, 3, 3),
+                   'share_ctc': (r"\quad Claim rate", r"\quad", 1, 3, 3),
+                   'mean_ctc': (r"\quad Average dollar amount of benefits per claim", r"\quad ", 1, 'int', 1),
+                   'tot_ctc': (r"\quad Total benefits (thousands)", r"\quad", 1000, 1, 3),
+                   'share_eitc_lt_75k': (r"\quad Claim rate", r"\quad", 1, 3, 3),
+                   'mean_eitc': (r"\quad Average dollar amount of benefits per claim", r"\quad", 1, 'int', 1),
+                   'tot_eitc': (r"\quad Total benefits (thousands)", r"\quad", 1000, 1, 3),
+                   'share_eip': (r"\quad Claim rate", r"\quad", 1, 3, 3),
+                   'mean_eip': (r"\quad Average dollar amount of benefits per claim", r"\quad ", 1, 'int', 1),
+                   'eip_amount': (r"\quad Total benefits (thousands)", r"\quad", 1000, 1, 3)}
+
+# format of variables not in SUMMARY_FORMATS, which are labelled with their name
+DEFAULT_SUMMARY_FORMAT = (None, '', 1, 3, 3)
+
+# section headings of the summary table, written above the variable that opens each section
+SUMMARY_SECTIONS = {'share_ctc': 'CTC', 'share_eitc_lt_75k': 'EITC^{*}', 'share_eip': 'EIP'}
+
+def run_clean(use_cache=True, write_csv=False, n_workers=None):
+
+    '''
+    Cleans and merges the raw data files (see clean_data).
+
+    inputs:
+        use_cache: if False, re-reads every raw input instead of using the on-disk cache
+        write_csv: if True, also writes .csv copies of the clean data files
+        n_workers: number of worker processes reading the preparer listings. None uses
+        'n_workers' from the config file.
+    outputs:
+        paths: list of files written
+    '''
+
+    os.makedirs(project_path('data/clean'), exist_ok=True)
+
+    clean_data(use_cache=use_cache, write_csv=write_csv, n_workers=n_workers)
+
+    return [project_path('data/clean/' + name + '.feather') for name in ['dat_clean', 'dat_clean_agi']]
+
+def write_summary_table(summary, variables, path):
+
+    '''
+    Writes the summary statistics table for one summary frame (all counties, or one group).
+    The table has a column for each year of the frame and, with two or more years, for
+    the difference between the first two. Variables missing from SUMMARY_FORMATS use
+    DEFAULT_SUMMARY_FORMAT.
+
+    inputs:
+        summary: frame returned by summarize, or one group of it
+        variables: variables in the table, in order
+        path: output path
+    outputs: None
+    '''
+
+    years = [x for x in summary.columns if x != 'difference']
+    columns = years + (['difference'] if len(years) > 1 else [])
+
+    formats = {x: SUMMARY_FORMATS.get(x, DEFAULT_SUMMARY_FORMAT) for x in variables}
+
+    scale = pd.Series({x: formats[x][2] for x in variables})
+    frame = pd.concat({'estimate': summary.loc['mean', columns].div(scale, axis=0),
+                       'se': summary.loc['std', columns].div(scale, axis=0)})
+
+    # rows in the order of variables, with a heading (and a blank line between sections) where a section opens
+    spec = []
+    sections = 0
+    for x in variables:
+        if x in SUMMARY_SECTIONS:
+            if sections:
+                spec.append({'text': r"\\"})
+            spec += [{'text': SUMMARY_SECTIONS[x] + ' &' * len(columns) + ' '}, {'text': r" \\"}]
+            sections += 1
+        label, se_label, _, digits, se_digits = formats[x]
+        spec.append({'term': x, 'label': x.replace('_', r'\_') if label is None else label, 'se_label': se_label,
+                     'digits': digits, 'se_digits': se_digits, 'stars': False})
+    spec.append({'text': r"\hline"})
+
+    header = [r"\begin{table}[h!]",
+              r"\begin{center}",
+              r"\caption{County-level Summary Statistics \label{tab:summ_stats}}",
+              r"\begin{tabular*}{\linewidth}{@{\extracolsep{\fill}}l" + 'c' * len(columns) + "}",
+              ' ' + '&      ' * (len(columns) - 1) + r"& County-Level Mean\\",
+              ' & ' + ' & '.join(years) + (r" &  Difference \\" if len(years) > 1 else r" \\"),
+              r"\hline"]
+
+    footer = [r"\\",
+              r"\end{tabular}",
+              r"\multicolumn{" + str(len(columns) + 1) + r"}{p\linewidth}{\footnotesize{\emph{Notes:} The table shows summary statistics for rates of preparer use and CTC, EITC, and EIP claims for U.S. counties for tax years 2017 and 2021. Reported values are county-level means. 2017 dollar amounts have been adjusted for inflation using the Bureau of Labor Statistics CPI inflation calculator, indexed to December 2021. Standard deviations are displayed in parentheses. The full sample includes 3,127 counties. Counties in Connecticut are excluded from the sample because the state of Connecticut changed its county definitions during the sample period. ",
+              r"\newline * The denominator for the share of returns claiming EITC here and elsewhere in this paper is the total number of returns filed reporting less than \$75K in adjusted gross income. Returns reporting more than \$75K in adjusted gross income are not eligible for this credit. ",
+              r"}}",
+              r"\end{center}",
+              r"\end{table}"]
+
+    write_table(frame, spec, [path], header=header, footer=footer)
+
+    return None
+
+def run_stats():
+
+    '''
+    Writes the table of summary statistics (table 1) for the variables and years listed
+    under 'summ_stats' and 'summ_stats_years' in the config file, one table per group if
+    'summ_stats_by' is set.
+
+    inputs: None
+    outputs:
+        paths: list of files written
+    '''
+
+    out = load_config()
+
+    # import cleaned data, checking the configured variables first and reading only their columns
+    variables = out['summ_stats']
+    df = load_clean_data(columns=out.check_columns('summary_stats', clean_data_columns()))
+
+    # county-level means and standard deviations in each year and of the difference, in one pass
+    summary = summarize(df, variables, years=out['summ_stats_years'], weights=out['summ_stats_weights'], by=out['summ_stats_by'])
+
+    os.makedirs(project_path('results/tables'), exist_ok=True)
+
+    # generate table of summary statistics, one per group if grouped
+    if out['summ_stats_by'] is None:
+        paths = {project_path('results/tables/summ_stats.tex'): summary}
+    else:
+        paths = {project_path('results/tables/summ_stats_' + '_'.join(str(x) for x in np.atleast_1d(group)) + '.tex'): summary.loc[group]
+                 for group in summary.index.droplevel([-2, -1]).unique()}
+
+    for path, frame in paths.items():
+        write_summary_table(frame, variables, path)
+
+    return list(paths)
+
+def run_regs(bootstrap=0, n_workers=None):
+
+    '''
+    Runs the first- and second-stage regressions and writes tables 2-8 to results/tables.
+
+    inputs:
+        bootstrap: number of state-clustered wild bootstrap replications whose p-values and
+        intervals are printed for every specification. 0 skips the bootstrap.
+        n_workers: number of worker processes for the bootstrap. None uses the number of
+        cores.
+    outputs:
+        paths: list of files written
+    '''
+
+    out = load_config()
+
+    # check the configured variables against the clean data before any work, then read only those.
+    # the bootstrap clusters by state
+    out.check_columns('regs', clean_data_columns(), extra=OUTCOMES)
+    df = load_clean_data(columns=regression_columns(out, outcomes=OUTCOMES, absorb=['STATEFIPS'] if bootstrap else []))
+    df = df.dropna(subset=['maj_black',
+                           'maj_hisp',
+                           'urban',
+                           'share_college',
+                           'hh_inc_pct',
+                           'r_marriage',
+                           'share_using_pp',
+                           'share_using_pp_17',
+                           'share_eip',
+                           'mean_eip',
+                           'share_ctc_dif',
+                           'mean_ctc_dif',
+                           'share_eitc_dif',
+                           'mean_eitc_dif'])
+
+    os.makedirs(project_path('results/tables'), exist_ok=True)
+
+    ### first stage regressions
+
+    y = df[out['fs_y']]
+
+    # specs 1-3 add controls in turn, so fit them together on one incrementally updated QR factorization
+    results1, results2, results3 = nested_ols(y, [add_constant(df[out['fs_X_1']]),
+                                                  add_constant(df[out['fs_X_2']]),
+                                                  add_constant(df[out['fs_X_3']])],
+                                              cov_type='HC3')
+
+    rows = [{'label': 'Specification', 'cells': ['(1)', '(2)', '(3)']},
+            {'label': 'Demographic controls', 'cells': ['', 'X', 'X']},
+            {'label': 'Socioeconomic controls', 'cells': ['', '', 'X']},
+            {'text': r"\hline"},
+            {'term': 'share_using_pp_17', 'label': out['table_labels']['share_using_pp_17'][0], 'se_digits': 0},
+            {'text': r"\hline"},
+            {'stat': 'nobs', 'label': 'N', 'digits': 'int'},
+            {'stat': 'rsquared', 'label': 'R-squared'},
+            {'stat': 'fvalue', 'label': 'F Statistic', 'digits': 'int'}]
+
+    write_table(results_frame([results1, results2, results3]), rows, [project_path('results/tables/fs.txt')])
+
+    ### second-stage regressions
+
+    # eip, ctc and eitc outcomes share each specification's first stage, so fit them together
+    make_2sls_tables(df, outcomes=OUTCOMES)
+
+    ### bootstrap inference
+
+    if bootstrap:
+
+        # 'const' in the second-stage controls names the constant, which the clean data does not hold
+        data = df.assign(const=1.0)
+
+        for spec in ['spec_1', 'spec_2', 'spec_3']:
+
+            # first stage, with the 2017 preparer share as the regressor of interest
+            res = resample(df[out['fs_y']], add_constant(df[out['fs_X_' + spec[-1]]]), None, None,
+                           method='wild', clusters=df['STATEFIPS'], reps=bootstrap, n_workers=n_workers)
+            print('first stage, ' + spec)
+            print(res)
+
+            for outcome in OUTCOMES:
+                res = resample(data[outcome], data[out[spec + '_controls']], data[out[spec + '_endog']], data[out[spec + '_inst']],
+                               method='wild', clusters=df['STATEFIPS'], reps=bootstrap, n_workers=n_workers)
+                print(outcome + ', ' + spec)
+                print(res)
+
+    return [project_path('results/tables/fs.txt')] + [project_path('results/tables/ss_' + outcome + '.tex') for outcome in OUTCOMES]
+
+def run_plots(figures=['eitc', 'heatmap']):
+
+    '''
+    Draws the 2017-2021 EITC amounts plot (figure 1) and the 2021 preparer use heatmap
+    (figure 2). Figures are drawn on their own matplotlib figures, without pyplot, so this
+    can run alongside other work in the same process.
+
+    inputs:
+        figures: list of figures to draw, out of 'eitc' and 'heatmap'
+    outputs:
+        paths: list of files written
+    '''
+
+    import matplotlib as mpl
+    from matplotlib.figure import Figure
+    from plot_utils import render_maps
+
+    os.makedirs(project_path('results/figures'), exist_ok=True)
+    paths = []
+
+    if 'eitc' in figures:
+
+        # eitc amounts
+        eitc = pd.read_csv(project_path('data/clean/eitc_fig_data.csv'))
+
+        xs = [eitc.nc_17_inc, eitc.oc_17_inc, eitc.tc_17_inc, eitc.thc_17_inc, eitc.nc_21_inc, eitc.oc_21_inc, eitc.tc_21_inc, eitc.thc_21_inc]
+        ys = [eitc.nc_17_ben, eitc.oc_17_ben, eitc.tc_17_ben, eitc.thc_17_ben, eitc.nc_21_ben, eitc.oc_21_ben, eitc.tc_21_ben, eitc.thc_21_ben]
+
+        linestyles = ['dotted', 'dashed', 'dashdot', 'solid', 'dotted', 'dashed', 'dashdot', 'solid']
+        colors = ['cornflowerblue', 'cornflowerblue', 'cornflowerblue', 'cornflowerblue', 'firebrick', 'firebrick','firebrick','firebrick']
+        labels = ['No Children, TY17', 'One Child, TY17', 'Two Children, TY17', 'Three or More Children, TY17', 'No Children, TY21', 'One Child, TY21', 'Two Children, TY21', 'Three or More Children, TY21']
+
+        # default style with serif fonts, restored afterwards so other figures are unaffected
+        with mpl.rc_context():
+            mpl.rc_file_defaults()
+            mpl.rcParams['font.family'] = 'serif'
+            mpl.rcParams['font.sans-serif'] = ['Times_New_Roman']
+
+            fig = Figure(figsize=(14,6))
+            ax = fig.subplots()
+
+            for i in range(len(xs)):
+                ax.plot(xs[i], ys[i], linestyle=linestyles[i], color=colors[i], label=labels[i], linewidth=2)
+
+            ax.set_xlabel('Earned Income ($)', fontsize=20)
+            ax.set_ylabel('Credit Amount ($)', fontsize=20)
+            ax.tick_params(bottom=True, top=False, right=False, left=True)
+            ax.tick_params(axis='both', labelsize=16)
+            fig.subplots_adjust(bottom=0.15)
+            ax.legend(loc='upper right', fontsize=12.5)
+            ax.spines[['right', 'top']].set_visible(False)
+
+            fig.savefig(project_path('results/figures/eitc_amts.png'))
+
+        paths.append(project_path('results/figures/eitc_amts.png'))
+
+    if 'heatmap' in figures:
+
+        ### load data
+        stats = load_clean_data(columns=['county', 'share_using_pp'])
+
+        print(stats[stats['share_using_pp'].isnull()]['county'])
+
+        ### make plot
+        # counties are filtered, projected and simplified once and cached, and the bins, labels
+        # and title are read from map_variables in data.yaml (see plot_utils.py)
+        paths += [path + '.png' for path in render_maps(stats, load_config(), variables=['share_using_pp'], directory=project_path('results/figures'),
+                                                        file_names={'share_using_pp': 'prep_use_21_heatmap'}, n_workers=1)]
+
+    return paths
+
+def run(stages=None, jobs=None, root=None, config=None, use_cache=True, bootstrap=0):
+
+    '''
+    Runs stages of the analysis in this process. 'clean' runs first, and the stages after
+    it, which only read the clean data, run at the same time on a thread pool; each also
+    spreads its own work over up to jobs worker processes. Modules are imported once, so
+    a long-running process can call run repeatedly. The project is set only for this call
+    (see path_utils.use_project), so calls on different projects, including concurrent
+    ones from other threads, do not share paths. Stage records are reset when a run
+    starts, so write_run_report after a run reports that run.
+
+    inputs:
+        stages: list of stage names out of STAGES. None runs every stage.
+        jobs: number of worker processes for each stage's pooled work (preparer listings,
+        bootstrap). None uses 'n_workers' from the config file for the listings and every
+        core for the bootstrap.
+        root: project directory holding data/ and results/. None keeps the current project.
+        config: path to the yaml config file. None keeps the current config file.
+        use_cache: if False, the clean stage re-reads every raw input
+        bootstrap: number of wild bootstrap replications printed by the regs stage
+    outputs:
+        paths: dictionary keyed by stage of the files each stage wrote
+    '''
+
+    stages = STAGES if stages is None else list(dict.fromkeys(stages))
+
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise ValueError('unknown stage(s): ' + ', '.join(unknown) + '. stages are ' + ', '.join(STAGES))
+
+    with use_project(root=root, config=config):
+
+        reset_records()
+
+        # read and validate the config before starting any work
+        load_config()
+
+        functions = {'clean': lambda: run_clean(use_cache=use_cache, n_workers=jobs),
+                     'stats': run_stats,
+                     'regs': lambda: run_regs(bootstrap=bootstrap, n_workers=jobs),
+                     'plots': run_plots}
+
+        paths = {}
+
+        if 'clean' in stages:
+            paths['clean'] = functions['clean']()
+
+        rest = [stage for stage in stages if stage != 'clean']
+
+        if len(rest) == 1:
+            paths[rest[0]] = functions[rest[0]]()
+        elif rest:
+            # each thread runs in a copy of this context, so it resolves paths in this run's project
+            with ThreadPoolExecutor(max_workers=len(rest)) as executor:
+                futures = {stage: executor.submit(contextvars.copy_context().run, functions[stage]) for stage in rest}
+                paths.update({stage: future.result() for stage, future in futures.items()})
+
+    return {stage: paths[stage] for stage in stages}
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(prog='taxprep', description='Run stages of the tax preparer analysis.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    parser_run = commands.add_parser('run', help='run stages in this process')
+    parser_run.add_argument('stages', nargs='*', metavar='STAGE', help='stages to run, out of ' + ', '.join(STAGES) + ' (default: all)')
+    parser_run.add_argument('--jobs', type=int, default=None, help='number of worker processes for each stage')
+    parser_run.add_argument('--config', default=None, help='path to the yaml config file (default: code/config/data.yaml in the project)')
+    parser_run.add_argument('--root', default=None, help='project directory holding data/ and results/ (default: this repository)')
+    parser_run.add_argument('--no-cache', action='store_true', help='re-read every raw input instead of using the cache in data/cache/')
+    parser_run.add_argument('--bootstrap', type=int, default=0, metavar='REPS', help='also print wild bootstrap inference with REPS replications from the regs stage')
+    parser_run.add_argument('--report', action='store_true', help='write a timing and memory report for each stage to results/logs/taxprep')
+    parser_run.add_argument('--profile', action='store_true', help='with --report, also write a cProfile dump of the slowest stage')
+    args = parser.parse_args()
+
+    unknown = [stage for stage in args.stages if stage not in STAGES]
+    if unknown:
+        parser_run.error('unknown stage(s): ' + ', '.join(unknown))
+
+    if args.profile:
+        enable_profiling()
+
+    set_project(root=args.root, config=args.config)
+
+    paths = run(stages=args.stages or None, jobs=args.jobs, use_cache=not args.no_cache, bootstrap=args.bootstrap)
+
+    for stage, files in paths.items():
+        print(stage + ': ' + str(len(files)) + ' file(s) written')
+
+    # write the timing and memory of each stage
+    if args.report:
+        write_run_report(project_path('results/logs/taxprep'))